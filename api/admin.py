@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PredictionHistory, SimilarityHistory
+from .models import PredictionHistory, SimilarityHistory, FeedbackJob
 
 
 @admin.register(PredictionHistory)
@@ -55,3 +55,16 @@ class SimilarityHistoryAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         # Prevent manual creation from admin (only through API)
         return False
+
+
+@admin.register(FeedbackJob)
+class FeedbackJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'similarity', 'status', 'cache_hit', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['status', 'cache_hit', 'created_at']
+    search_fields = ['user__username', 'user__email']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+    ordering = ['-created_at']
+    
+    def has_add_permission(self, request):
+        # Jobs are queued by the feedback endpoint
+        return False
@@ -4,3 +4,22 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        # Keeps the statistics rollups in step with SimilarityHistory
+        from . import stats  # noqa: F401
+
+        from .ml_models.config import PRELOAD_MODELS, INFERENCE_ROUTING
+
+        if not PRELOAD_MODELS:
+            return
+
+        # Import the URLconf (and with it the views and their SDKs) now rather
+        # than on each worker's first request
+        from django.urls import get_resolver
+        get_resolver().url_patterns
+
+        # Local models only; the HuggingFace client has nothing to warm up
+        if INFERENCE_ROUTING != 'remote':
+            from .ml_models import warm_up_models
+            warm_up_models()
@@ -0,0 +1,319 @@
+"""
+Siamese embeddings of user submissions, and nearest-neighbour search over them
+
+Each SimilarityHistory entry can store the float16 Siamese embedding of its
+user image (256 bytes) together with the version of the encoder that
+produced it. The feedback worker fills it in, since it embeds every attempt
+for the feedback cache anyway.
+
+Searches are exact: blocked brute force over one user's attempts. For large
+tables `python manage.py build_submission_index` writes a snapshot of all
+stored embeddings, sorted by user, to a memory-mapped .npy file. A user's
+rows are then one contiguous slice found by binary search, and only entries
+added or (re-)embedded after the snapshot was built are read from the
+database: each embedding records when it was written (embedded_at), since
+the feedback worker and embed_history embed older entries too. The snapshot is
+float32 with precomputed squared norms, so a search is one matrix-vector
+product per block (NumPy's float16 conversion costs several times more than
+the product itself).
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import SimilarityHistory
+
+# Directory of the submission snapshot
+INDEX_DIR = Path(os.getenv('SUBMISSION_INDEX_DIR', str(Path(settings.BASE_DIR) / 'submission_index')))
+
+# Rows compared per block: bounds the float32 working set to block x dimension
+SEARCH_BLOCK_ROWS = 16384
+
+# Rows read per query when building the snapshot
+BUILD_CHUNK_SIZE = 10000
+
+
+def encode_embedding(embedding) -> bytes:
+    """float16 bytes of an embedding, as stored on SimilarityHistory"""
+    return np.asarray(embedding, dtype=np.float32).reshape(-1).astype(np.float16).tobytes()
+
+
+def decode_embeddings(blobs) -> np.ndarray:
+    """Stack stored embeddings into an (N, D) float16 array"""
+    blobs = [bytes(blob) for blob in blobs]
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float16)
+    return np.frombuffer(b''.join(blobs), dtype=np.float16).reshape(len(blobs), -1)
+
+
+def store_embedding(similarity_id, embedding, version):
+    """Save the embedding of a SimilarityHistory entry's user image"""
+    SimilarityHistory.objects.filter(pk=similarity_id).update(
+        embedding=encode_embedding(embedding), embedding_version=version, embedded_at=timezone.now()
+    )
+
+
+def nearest(query, embeddings, k, sq_norms=None, block_rows=SEARCH_BLOCK_ROWS):
+    """
+    The k rows of `embeddings` closest to `query`, by Euclidean distance
+
+    The rows are compared in blocks (converted to float32 one at a time if
+    needed), so memory-mapped arrays of any size are searched in bounded memory.
+
+    Args:
+        sq_norms: Precomputed squared norms of the rows, if available
+
+    Returns:
+        (rows, distances): row numbers and distances, closest first
+    """
+    query = np.asarray(query, dtype=np.float32).reshape(-1)
+    query_sq = float(np.dot(query, query))
+    best_rows = np.empty(0, dtype=np.int64)
+    best_sq = np.empty(0, dtype=np.float32)
+    for start in range(0, len(embeddings), block_rows):
+        block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32)
+        block_sq = np.einsum('ij,ij->i', block, block) if sq_norms is None else sq_norms[start:start + block_rows]
+        squared = block_sq - 2 * (block @ query) + query_sq
+        rows = np.concatenate([best_rows, np.arange(start, start + len(block))])
+        squared = np.concatenate([best_sq, np.maximum(squared, 0)])
+        if len(squared) > k:
+            keep = np.argpartition(squared, k - 1)[:k]
+            rows, squared = rows[keep], squared[keep]
+        best_rows, best_sq = rows, squared
+    order = np.lexsort((best_rows, best_sq))
+    return best_rows[order], np.sqrt(best_sq[order])
+
+
+class SubmissionIndex:
+    """
+    Snapshot of stored submission embeddings, sorted by user and id
+    """
+
+    def __init__(self, ids, user_ids, target_classes, embeddings, sq_norms, version: str, watermark: int,
+                 built_at=None):
+        """
+        Args:
+            ids: SimilarityHistory ids, sorted by (user_ids, ids)
+            user_ids: User of each row
+            target_classes: Target class of each row
+            embeddings: (N, D) float32 array (usually memory-mapped), aligned with ids
+            sq_norms: Squared norm of each row
+            version: Encoder version of every embedding
+            watermark: Highest SimilarityHistory id when the snapshot was built
+            built_at: When the build started; entries embedded since may be missing
+                (None for snapshots written before embedded_at existed)
+        """
+        if len(embeddings) != len(ids):
+            raise ValueError(f'{len(embeddings)} embeddings for {len(ids)} ids')
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.target_classes = np.asarray(target_classes, dtype=np.int64)
+        self.embeddings = embeddings
+        self.sq_norms = np.asarray(sq_norms, dtype=np.float32)
+        self.version = version
+        self.watermark = int(watermark)
+        self.built_at = built_at
+
+    def __len__(self):
+        return len(self.ids)
+
+    def user_rows(self, user_id) -> slice:
+        """Rows of one user's attempts"""
+        start = int(np.searchsorted(self.user_ids, user_id, side='left'))
+        end = int(np.searchsorted(self.user_ids, user_id, side='right'))
+        return slice(start, end)
+
+    @staticmethod
+    def index_path(index_dir):
+        return Path(index_dir) / 'submissions.npz'
+
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR):
+        """Load a snapshot; its embeddings are memory-mapped"""
+        index_dir = Path(index_dir)
+        with np.load(cls.index_path(index_dir)) as data:
+            embeddings = np.load(index_dir / str(data['embeddings']), mmap_mode='r')
+            built_at = datetime.fromisoformat(str(data['built_at'])) if 'built_at' in data.files else None
+            return cls(
+                data['ids'], data['user_ids'], data['target_classes'], embeddings, data['sq_norms'],
+                version=str(data['version']), watermark=int(data['watermark']), built_at=built_at
+            )
+
+    @classmethod
+    def build(cls, version: str, index_dir=INDEX_DIR, chunk_size: int = BUILD_CHUNK_SIZE):
+        """
+        Snapshot every stored embedding of an encoder version
+
+        Two passes over the table in id order keep memory flat: the first
+        reads ids, users and classes to work out each row's place in user
+        order, the second writes the embeddings straight into place in a
+        memory-mapped file.
+
+        Returns:
+            SubmissionIndex
+        """
+        index_dir = Path(index_dir)
+        # Taken first: an entry embedded while the snapshot is written is also searched live
+        built_at = timezone.now()
+        watermark = SimilarityHistory.objects.aggregate(last=Max('id'))['last'] or 0
+        rows = SimilarityHistory.objects.filter(
+            id__lte=watermark, embedding_version=version, embedding__isnull=False
+        ).order_by('id')
+
+        keys = []
+        for chunk in _chunks(rows, ('id', 'user_id', 'target_class'), chunk_size):
+            keys.extend(chunk)
+        if not keys:
+            raise ValueError(f'No stored embeddings for encoder version {version}')
+        keys = np.array(keys, dtype=np.int64)
+        ids = keys[:, 0]
+        order = np.lexsort((ids, keys[:, 1]))
+        position = np.empty(len(ids), dtype=np.int64)
+        position[order] = np.arange(len(ids))
+
+        dim = len(bytes(rows.values_list('embedding', flat=True).first())) // 2
+        index_dir.mkdir(parents=True, exist_ok=True)
+        embeddings_name = f'submissions_{watermark}.npy'
+        tmp_path = index_dir / f'{embeddings_name}.tmp'
+        embeddings = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(ids), dim))
+        sq_norms = np.zeros(len(ids), dtype=np.float32)
+        for chunk in _chunks(rows, ('id', 'embedding'), chunk_size):
+            chunk_ids = np.array([row[0] for row in chunk], dtype=np.int64)
+            at = np.minimum(np.searchsorted(ids, chunk_ids), len(ids) - 1)
+            # Rows embedded after the first pass are not part of this snapshot
+            known = ids[at] == chunk_ids
+            if known.any():
+                decoded = decode_embeddings([row[1] for row, keep in zip(chunk, known) if keep]).astype(np.float32)
+                embeddings[position[at[known]]] = decoded
+                sq_norms[position[at[known]]] = np.einsum('ij,ij->i', decoded, decoded)
+        embeddings.flush()
+        del embeddings
+        tmp_path.replace(index_dir / embeddings_name)
+
+        # Written last: the index file names the embeddings file it belongs to
+        index_path = cls.index_path(index_dir)
+        tmp_path = index_path.with_suffix('.tmp.npz')
+        np.savez(
+            tmp_path, ids=ids[order], user_ids=keys[order, 1], target_classes=keys[order, 2], sq_norms=sq_norms,
+            embeddings=np.array(embeddings_name), version=np.array(version), watermark=np.array(watermark),
+            built_at=np.array(built_at.isoformat())
+        )
+        tmp_path.replace(index_path)
+
+        # Processes still mapping an older snapshot keep reading it until they reload
+        for old in index_dir.glob('submissions_*.npy'):
+            if old.name != embeddings_name:
+                old.unlink(missing_ok=True)
+        return cls.load(index_dir)
+
+
+def _chunks(rows, fields, chunk_size):
+    """values_list() of a queryset ordered by id, in keyset-paginated chunks"""
+    last_id = 0
+    while True:
+        chunk = list(rows.filter(id__gt=last_id).values_list(*fields)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+# Snapshot loaded by this process, and the index file mtime it was loaded at
+_snapshot = (None, None)
+
+
+def get_submission_index(index_dir=INDEX_DIR):
+    """The current snapshot (reloaded after a rebuild), or None if there is none"""
+    global _snapshot
+    try:
+        mtime = SubmissionIndex.index_path(index_dir).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    key = (str(index_dir), mtime)
+    if _snapshot[0] != key:
+        try:
+            _snapshot = (key, SubmissionIndex.load(index_dir))
+        except Exception as e:
+            print(f"Warning: Could not load submission index from {index_dir}: {e}")
+            return None
+    return _snapshot[1]
+
+
+def similar_attempts(user_id, embedding, version, k=5, target_class=None, exclude_id=None, index_dir=INDEX_DIR):
+    """
+    A user's stored attempts whose embeddings are closest to `embedding`
+
+    Args:
+        user_id: User whose attempts are searched
+        embedding: Query embedding
+        version: Encoder version of the query; only embeddings of the same version are compared
+        k: Number of attempts returned
+        target_class: Only search attempts at this class
+        exclude_id: SimilarityHistory id left out (e.g. the query's own entry)
+
+    Returns:
+        list of (SimilarityHistory, embedding distance) pairs, closest first
+    """
+    # Extra candidates cover the excluded entry and entries deleted since the snapshot was built
+    wanted = 2 * k + 1
+    candidates = []
+    live = Q()
+    snapshot = get_submission_index(index_dir)
+    if snapshot is not None and snapshot.version == version:
+        rows = snapshot.user_rows(user_id)
+        ids, embeddings, sq_norms = snapshot.ids[rows], snapshot.embeddings[rows], snapshot.sq_norms[rows]
+        if target_class is not None:
+            keep = np.flatnonzero(snapshot.target_classes[rows] == target_class)
+            ids, embeddings, sq_norms = ids[keep], embeddings[keep], sq_norms[keep]
+        found, distances = nearest(embedding, embeddings, wanted, sq_norms)
+        candidates.extend(zip(distances.tolist(), ids[found].tolist()))
+        live = Q(id__gt=snapshot.watermark)
+        if snapshot.built_at is not None:
+            live |= Q(embedded_at__gte=snapshot.built_at)
+
+    # Entries added or embedded since the snapshot was built (or all of them, without one)
+    recent = SimilarityHistory.objects.filter(
+        live, user_id=user_id, embedding_version=version, embedding__isnull=False
+    ).order_by()
+    if target_class is not None:
+        recent = recent.filter(target_class=target_class)
+    recent = list(recent.values_list('id', 'embedding'))
+    if recent:
+        # The stored embedding supersedes the snapshot's copy of a re-embedded entry
+        recent_ids = {row[0] for row in recent}
+        candidates = [candidate for candidate in candidates if candidate[1] not in recent_ids]
+        found, distances = nearest(embedding, decode_embeddings([row[1] for row in recent]), wanted)
+        candidates.extend((distance, recent[row][0]) for row, distance in zip(found.tolist(), distances.tolist()))
+
+    candidates = [(distance, entry_id) for distance, entry_id in sorted(candidates) if entry_id != exclude_id]
+    candidates = candidates[:wanted]
+    # Primary key lookups; filtering on user too can make the planner scan the user's index instead
+    entries = SimilarityHistory.objects.defer('embedding').in_bulk([entry_id for _, entry_id in candidates])
+    return [
+        (entries[entry_id], distance) for distance, entry_id in candidates
+        if entry_id in entries and entries[entry_id].user_id == user_id
+    ][:k]
+
+
+def nearest_reference(embedding, version):
+    """
+    The reference exemplar closest to an embedding
+
+    Returns:
+        (class_id, exemplar name, distance), or None when the local encoder
+        is unavailable or did not produce `version`
+    """
+    from .ml_models.router import LOCAL, get_router
+
+    model = get_router().model(LOCAL)
+    if model is None or getattr(model, 'embedding_version', None) != version:
+        return None
+    reference_index = getattr(model, 'reference_index', None)
+    if reference_index is None:
+        return None
+    return reference_index.nearest_exemplar(embedding)
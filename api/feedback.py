@@ -0,0 +1,328 @@
+"""
+AI feedback generation, run as background jobs
+
+FeedbackView only queues a FeedbackJob; `python manage.py run_feedback_worker`
+claims queued jobs, asks the feedback provider (Gemini, or a local stub for
+development and tests) and stores the result on the job and on its
+SimilarityHistory entry.
+
+Feedback is reused across near-identical attempts: each job stores the
+int8-quantized Siamese embedding of the user image, and a job whose
+embedding lies within CACHE_DISTANCE of a recently finished job for the same
+target class copies that job's feedback instead of calling the provider.
+The full embedding is also kept on the SimilarityHistory entry, for
+searches over past attempts (see api/embeddings.py).
+"""
+import os
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from PIL import Image
+
+from .embeddings import store_embedding
+from .models import FeedbackJob
+from .result_cache import image_digest
+
+FEEDBACK_PROMPT = (
+    "Analyze the attached blended image (white=reference, blackish=input). "
+    "Provide only an actionable feedback summary. The summary must consist of "
+    "a general assessment sentence followed by a list of 4 specific focus points "
+    "for correction in the next attempt. Format the response as follows:<br><br>"
+    "[General assessment sentence]<br><br>"
+    "Focus points for correction:<br>"
+    "1. [First point]<br>"
+    "2. [Second point]<br>"
+    "3. [Third point]<br>"
+    "4. [Fourth point]<br><br>"
+    "Do not provide a detailed section-by-section analysis or any introductory/closing remarks."
+)
+
+# A job is retried until it has failed this many times
+MAX_ATTEMPTS = int(os.getenv('FEEDBACK_MAX_ATTEMPTS', '3'))
+
+# Running jobs older than this are assumed orphaned by a dead worker and re-queued
+STALE_AFTER = timedelta(seconds=int(os.getenv('FEEDBACK_STALE_SECONDS', '600')))
+
+# Embedding distance under which two attempts share feedback
+# (SIMILARITY_THRESHOLD, 0.45, separates different characters; 0.1 is roughly a 1 degree rotation)
+CACHE_DISTANCE = float(os.getenv('FEEDBACK_CACHE_DISTANCE', '0.1'))
+
+# Most recent finished jobs per cache key compared against a new attempt
+CACHE_CANDIDATES = 500
+
+# Finished feedback is reused for this long (0 disables the cache)
+CACHE_TTL = timedelta(days=int(os.getenv('FEEDBACK_CACHE_DAYS', '30')))
+
+
+class GeminiFeedbackProvider:
+    """Generates feedback with Google Gemini"""
+
+    def __init__(self, model_name='gemini-2.5-flash'):
+        import google.generativeai as genai
+
+        api_key = os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables")
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def __call__(self, image, prompt):
+        try:
+            return self.model.generate_content([prompt, image]).text
+        except Exception as e:
+            raise Exception(f"Gemini API request failed: {str(e)}")
+
+
+class StubFeedbackProvider:
+    """Canned feedback in the Gemini response format, for development and tests"""
+
+    def __call__(self, image, prompt):
+        return (
+            "Your character follows the overall shape of the reference.<br><br>"
+            "Focus points for correction:<br>"
+            "1. Keep stroke thickness consistent<br>"
+            "2. Match the curvature of the top stroke<br>"
+            "3. Align the vertical strokes with the reference<br>"
+            "4. Finish stroke endings cleanly"
+        )
+
+
+class SiameseEmbedder:
+    """Siamese embedding of a stored user image, using the local models"""
+
+    def __init__(self):
+        from .ml_models import get_classification_model
+
+        self.model = get_classification_model()
+        self.model.load_siamese_model()
+        self.version = self.model.siamese_version
+        self.embedding_version = self.model.embedding_version
+
+    @staticmethod
+    def model_input(image):
+        """
+        Stored user images are the dark-on-white display layer: undo that to
+        get the white-on-black 64x64 the model saw
+
+        The display layer is upscaled, so this is close to the original input
+        (a few grey levels per pixel) only for images that were preprocessed
+        before scoring. Raw uploads were scored as uploaded, and only their
+        preprocessed crop is stored.
+        """
+        import cv2 as cv
+        from .ml_models.config import IMAGE_SIZE
+
+        gray = 255 - np.asarray(image.convert('L'))
+        return cv.resize(gray, IMAGE_SIZE, interpolation=cv.INTER_AREA)
+
+    def __call__(self, image):
+        tensors = self.model.preprocess_batch([self.model_input(image)], skip_preprocessing=True)
+        return self.model.run_siamese(tensors)[0].numpy()
+
+    def embed_batch(self, images, batch_size=None):
+        """(N, D) float32 embeddings of stored user images, in batched passes"""
+        return self.model.embed_batch(
+            [self.model_input(image) for image in images], batch_size=batch_size, skip_preprocessing=True
+        )
+
+    def score_batch(self, inputs, target_classes, batch_size=None):
+        """
+        Embeddings of model_input() arrays and their (similarity_score,
+        distance, is_same_character) against the target classes' references
+        """
+        embeddings = self.model.embed_batch(inputs, batch_size=batch_size, skip_preprocessing=True)
+        scores = self.model.score_embeddings(embeddings, target_classes)
+        threshold = self.model.optimal_threshold
+        return embeddings, [(score, distance, distance < threshold) for score, distance in scores]
+
+
+FEEDBACK_PROVIDERS = {
+    'gemini': GeminiFeedbackProvider,
+    'stub': StubFeedbackProvider,
+}
+
+
+def get_feedback_provider(name=None):
+    """Build the provider named by `name` or FEEDBACK_PROVIDER (default: gemini)"""
+    name = name or os.getenv('FEEDBACK_PROVIDER', 'gemini')
+    if name not in FEEDBACK_PROVIDERS:
+        raise ValueError(f"Unknown feedback provider: {name} (expected one of {', '.join(FEEDBACK_PROVIDERS)})")
+    return FEEDBACK_PROVIDERS[name]()
+
+
+def get_embedder():
+    """
+    SiameseEmbedder, or None when local models are unavailable (cache keys
+    then fall back to the exact image content)
+    """
+    from .ml_models.config import INFERENCE_ROUTING
+
+    if INFERENCE_ROUTING == 'remote':
+        return None
+    try:
+        return SiameseEmbedder()
+    except Exception as e:
+        print(f"Warning: Could not load Siamese model for the feedback cache: {e}")
+        return None
+
+
+def quantize_embedding(embedding):
+    """int8 encoding of an L2-normalized embedding (components lie in [-1, 1])"""
+    return np.clip(np.rint(np.asarray(embedding, dtype=np.float32) * 127), -127, 127).astype(np.int8)
+
+
+def feedback_cache_key(target_class, image, embedder=None, embedding=None):
+    """
+    Cache key and quantized embedding for feedback on `image` drawn as `target_class`
+
+    With an embedder the key is the target class and embedding version, and
+    near-identical attempts are matched by embedding distance. Without one
+    the key includes a hash of the image, so only identical images match.
+
+    Args:
+        embedding: embedder(image), if it was already computed
+
+    Returns:
+        (cache_key, embedding): embedding is an int8 array, or None
+    """
+    if embedder is None:
+        return f'{target_class}:exact:{image_digest(np.asarray(image))[:32]}', None
+    if embedding is None:
+        embedding = embedder(image)
+    return f'{target_class}:{embedder.version}', quantize_embedding(embedding)
+
+
+def cached_feedback(cache_key, embedding=None, exclude_id=None):
+    """Feedback of the closest recent finished job with this cache key, or None"""
+    if not cache_key or not CACHE_TTL:
+        return None
+    candidates = FeedbackJob.objects.filter(
+        cache_key=cache_key,
+        status=FeedbackJob.DONE,
+        finished_at__gte=timezone.now() - CACHE_TTL
+    ).exclude(pk=exclude_id).order_by('-finished_at')
+    if embedding is None:
+        return candidates.values_list('feedback', flat=True).first()
+
+    rows = [row for row in candidates.values_list('embedding', 'feedback')[:CACHE_CANDIDATES] if row[0]]
+    if not rows:
+        return None
+    gallery = np.frombuffer(b''.join(bytes(row[0]) for row in rows), dtype=np.int8).reshape(len(rows), -1)
+    distances = np.linalg.norm((gallery.astype(np.float32) - embedding.astype(np.float32)) / 127, axis=1)
+    best = int(np.argmin(distances))
+    return rows[best][1] if distances[best] <= CACHE_DISTANCE else None
+
+
+def cache_stats():
+    """Hit/miss counts of the feedback cache over all finished jobs"""
+    counts = FeedbackJob.objects.filter(status=FeedbackJob.DONE).aggregate(
+        hits=Count('id', filter=Q(cache_hit=True)),
+        misses=Count('id', filter=Q(cache_hit=False))
+    )
+    total = counts['hits'] + counts['misses']
+    counts['hit_rate'] = counts['hits'] / total if total else 0.0
+    return counts
+
+
+def enqueue_feedback(similarity, waiting=False):
+    """
+    Queue feedback generation for a SimilarityHistory entry
+
+    A waiting job is not claimed until its entry's images are written (see api/write_behind.py)
+    """
+    status = FeedbackJob.WAITING if waiting else FeedbackJob.PENDING
+    return FeedbackJob.objects.create(user=similarity.user, similarity=similarity, status=status)
+
+
+def claim_next_job():
+    """
+    Atomically take the oldest queued job, or return None if there is none
+
+    The claim is a conditional UPDATE, so any number of workers can poll the
+    same table without processing a job twice.
+    """
+    stale_before = timezone.now() - STALE_AFTER
+    claimable = FeedbackJob.objects.filter(
+        Q(status=FeedbackJob.PENDING) | Q(status=FeedbackJob.RUNNING, started_at__lt=stale_before)
+    )
+    for job in claimable.order_by('created_at')[:10]:
+        claimed = FeedbackJob.objects.filter(pk=job.pk, status=job.status, started_at=job.started_at).update(
+            status=FeedbackJob.RUNNING,
+            started_at=timezone.now()
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def process_job(job, provider, embedder=None):
+    """
+    Generate feedback for a claimed job and store it
+
+    Feedback cached for a near-identical attempt is reused without calling
+    the provider. Failures re-queue the job until MAX_ATTEMPTS, then mark it
+    failed.
+
+    Returns:
+        FeedbackJob: the updated job
+    """
+    similarity = job.similarity
+    if job.cache_key is None:
+        try:
+            with similarity.user_image.open('rb') as f:
+                user_image = Image.open(f)
+                user_image.load()
+            embedding = embedder(user_image) if embedder is not None else None
+            if embedding is not None:
+                store_embedding(similarity.id, embedding, getattr(embedder, 'embedding_version', embedder.version))
+            job.cache_key, embedding = feedback_cache_key(similarity.target_class, user_image, embedder, embedding)
+            job.embedding = embedding.tobytes() if embedding is not None else None
+        except Exception as e:
+            print(f"Warning: No feedback cache key for job {job.id}: {e}")
+            job.cache_key = ''
+
+    embedding = np.frombuffer(bytes(job.embedding), dtype=np.int8) if job.embedding else None
+    feedback = cached_feedback(job.cache_key, embedding, exclude_id=job.pk)
+    job.cache_hit = feedback is not None
+    try:
+        if feedback is None:
+            with similarity.blended_overlay.open('rb') as f:
+                image = Image.open(f)
+                image.load()
+            feedback = provider(image, FEEDBACK_PROMPT)
+    except Exception as e:
+        job.attempts += 1
+        job.error = str(e)
+        job.status = FeedbackJob.FAILED if job.attempts >= MAX_ATTEMPTS else FeedbackJob.PENDING
+        job.finished_at = timezone.now() if job.status == FeedbackJob.FAILED else None
+        job.save(update_fields=['attempts', 'error', 'status', 'finished_at', 'cache_key', 'embedding', 'cache_hit'])
+        return job
+
+    with transaction.atomic():
+        similarity.feedback = feedback
+        similarity.save(update_fields=['feedback'])
+        job.attempts += 1
+        job.feedback = feedback
+        job.error = None
+        job.status = FeedbackJob.DONE
+        job.finished_at = timezone.now()
+        job.save(update_fields=[
+            'attempts', 'feedback', 'error', 'status', 'finished_at', 'cache_key', 'embedding', 'cache_hit'
+        ])
+    return job
+
+
+def run_pending_jobs(provider, limit=None, embedder=None):
+    """Process queued jobs until the queue is empty (or `limit` jobs ran); returns the count"""
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        process_job(job, provider, embedder)
+        processed += 1
+    return processed
@@ -0,0 +1,217 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+# (label, path) of the requests timed for the heaviest user; {deep} is replaced
+# by the cursor of the prediction history's 20th page
+ENDPOINTS = [
+    ('prediction history', '/api/history/predictions/'),
+    ('prediction history, page 20', '/api/history/predictions/?cursor={deep}'),
+    ('similarity history', '/api/history/similarities/'),
+    ('similarity history, one character', '/api/history/similarities/?target_class=7'),
+    ('similarity history, matches only', '/api/history/similarities/?matched=true'),
+    ('statistics', '/api/user/statistics/'),
+    ('statistics, one character', '/api/user/statistics/?target_class=7'),
+    ('statistics, last 30 days', '/api/user/statistics/?days=30'),
+    ('statistics, date range', '/api/user/statistics/?start_date={start}&end_date={end}'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway test database with history rows and report query plans and timings '
+        'of the history and statistics endpoints with the pre-0006 indexes (user only) and the current ones'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=1_000_000,
+            help='Rows seeded into each history table (default: 1000000)'
+        )
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Users the rows are spread over, skewed towards a few heavy users (default: 1000)'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Timed requests per endpoint and index set (default: 20)'
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the seeded test database for the next run'
+        )
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help='Destroy an existing test database without asking'
+        )
+
+    def handle(self, *args, **options):
+        from django.db import connection
+        from django.test.utils import setup_test_environment, teardown_test_environment
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        # Never the configured database: the benchmark drops and creates indexes
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=not options['interactive'], serialize=False, keepdb=options['keepdb']
+        )
+        try:
+            self.seed(options['rows'], options['users'])
+            user = self.heaviest_user()
+            self.stdout.write(f'Benchmarking user {user.username} ({user.similarity_rows} similarity rows)')
+            for label, current in (('Indexes before 0006 (user only)', False), ('Current indexes', True)):
+                self.stdout.write(self.style.MIGRATE_HEADING(f'\n== {label} =='))
+                self.set_indexes(current)
+                self.benchmark(user, options['repeat'])
+        finally:
+            self.set_indexes(True)
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+    def seed(self, rows, users):
+        from django.contrib.auth.models import User
+        from django.utils import timezone
+        from api.models import PredictionHistory, SimilarityHistory
+        from api.stats import rebuild_statistics
+
+        if SimilarityHistory.objects.count() >= rows:
+            self.stdout.write('Reusing seeded test database')
+            return
+
+        self.stdout.write(f'Seeding {rows} prediction and {rows} similarity rows over {users} users...')
+        start = time.monotonic()
+        User.objects.bulk_create(User(username=f'bench{i}') for i in range(users))
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+        now = timezone.now()
+        rng = random.Random(0)
+
+        def row_values():
+            # Cubing skews the rows towards the first users (the first 0.1% get 10%)
+            user_id = user_ids[int(len(user_ids) * rng.random() ** 3)]
+            created_at = now - timedelta(seconds=rng.uniform(0, 365 * 24 * 3600))
+            return user_id, rng.randrange(36), created_at
+
+        def predictions(count):
+            for _ in range(count):
+                user_id, target_class, created_at = row_values()
+                yield PredictionHistory(
+                    user_id=user_id, image='predictions/bench.png', predicted_class=target_class,
+                    confidence=rng.uniform(40, 100), created_at=created_at
+                )
+
+        def similarities(count):
+            for _ in range(count):
+                user_id, target_class, created_at = row_values()
+                score = min(100.0, max(0.0, rng.gauss(78, 12)))
+                yield SimilarityHistory(
+                    user_id=user_id, user_image='similarity/bench.png', target_class=target_class,
+                    similarity_score=score, distance=(100 - score) / 100, is_same_character=score >= 75,
+                    created_at=created_at
+                )
+
+        for model, rows_of in ((PredictionHistory, predictions), (SimilarityHistory, similarities)):
+            # auto_now_add would overwrite the spread-out timestamps
+            created_at = model._meta.get_field('created_at')
+            auto_now_add, created_at.auto_now_add = created_at.auto_now_add, False
+            try:
+                for done in range(0, rows, 10_000):
+                    model.objects.bulk_create(rows_of(min(10_000, rows - done)), batch_size=10_000)
+            finally:
+                created_at.auto_now_add = auto_now_add
+
+        # bulk_create skips the signals that maintain the statistics rollups
+        rebuild_statistics()
+        self.stdout.write(f'Seeded in {time.monotonic() - start:.0f}s')
+
+    def heaviest_user(self):
+        from django.contrib.auth.models import User
+        from django.db.models import Count
+
+        return User.objects.annotate(similarity_rows=Count('similarities')).order_by('-similarity_rows').first()
+
+    def set_indexes(self, current):
+        """Switch the history tables between their Meta.indexes and a single index on user"""
+        from django.db import connection, models
+        from api.models import PredictionHistory, SimilarityHistory
+
+        with connection.cursor() as cursor:
+            existing = {
+                table: set(connection.introspection.get_constraints(cursor, table))
+                for table in (PredictionHistory._meta.db_table, SimilarityHistory._meta.db_table)
+            }
+        with connection.schema_editor() as editor:
+            for model in (PredictionHistory, SimilarityHistory):
+                names = existing[model._meta.db_table]
+                user_only = models.Index(fields=['user'], name=f'bench_{model._meta.model_name[:14]}_user')
+                wanted, unwanted = (model._meta.indexes, [user_only]) if current else ([user_only], model._meta.indexes)
+                for index in unwanted:
+                    if index.name in names:
+                        editor.remove_index(model, index)
+                for index in wanted:
+                    if index.name not in names:
+                        editor.add_index(model, index)
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                for model in (PredictionHistory, SimilarityHistory):
+                    cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+            else:
+                cursor.execute('ANALYZE')
+
+    def benchmark(self, user, repeat):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework.test import APIClient
+        from api.models import SimilarityHistory
+
+        client = APIClient()
+        client.force_authenticate(user)
+
+        url = '/api/history/predictions/'
+        for _ in range(19):
+            url = client.get(url).data['next'] or url
+        newest = SimilarityHistory.objects.filter(user=user).latest('created_at').created_at
+        params = {
+            'deep': url.partition('cursor=')[2],
+            'start': (newest - timedelta(days=90, hours=6)).strftime('%Y-%m-%dT%H:%M:%S'),
+            'end': (newest - timedelta(hours=6)).strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+        explain = {
+            'postgresql': 'EXPLAIN ANALYZE ',
+            'sqlite': 'EXPLAIN QUERY PLAN ',
+        }.get(connection.vendor, 'EXPLAIN ')
+        results = []
+        for label, path in ENDPOINTS:
+            path = path.format(**params)
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(path)
+            # Copied now: each request clears the connection's query log
+            captured = list(queries.captured_queries)
+            if response.status_code != 200:
+                self.stderr.write(f'{label}: HTTP {response.status_code} {response.data}')
+                continue
+
+            self.stdout.write(self.style.SQL_KEYWORD(f'\n-- {label}: GET {path}'))
+            for query in captured:
+                if not query['sql'].lstrip().upper().startswith('SELECT'):
+                    continue
+                self.stdout.write(query['sql'])
+                with connection.cursor() as cursor:
+                    cursor.execute(explain + query['sql'])
+                    for row in cursor.fetchall():
+                        self.stdout.write('    ' + ' '.join(str(column) for column in row))
+
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                client.get(path)
+                timings.append((time.perf_counter() - start) * 1000)
+            results.append((label, len(captured), statistics.median(timings), max(timings)))
+
+        self.stdout.write('\n{:<36} {:>7} {:>11} {:>11}'.format('endpoint', 'queries', 'median ms', 'max ms'))
+        for label, query_count, median, slowest in results:
+            self.stdout.write(f'{label:<36} {query_count:>7} {median:>11.1f} {slowest:>11.1f}')
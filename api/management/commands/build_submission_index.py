@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Snapshot the stored embeddings of user submissions for nearest-neighbour search (see api/embeddings.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--embedding-version', default=None,
+            help="Encoder version to snapshot (default: the local Siamese model's)"
+        )
+        parser.add_argument(
+            '--dir', default=None,
+            help='Snapshot directory (default: SUBMISSION_INDEX_DIR)'
+        )
+
+    def handle(self, *args, **options):
+        from api.embeddings import INDEX_DIR, SubmissionIndex
+
+        version = options['embedding_version']
+        if version is None:
+            from api.ml_models import get_classification_model
+
+            try:
+                version = get_classification_model().embedding_version
+            except Exception as e:
+                raise CommandError(f'Could not load the Siamese model (pass --embedding-version): {e}')
+
+        start = time.monotonic()
+        try:
+            index = SubmissionIndex.build(version, options['dir'] or INDEX_DIR)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {len(index)} embeddings of {len(set(index.user_ids.tolist()))} users '
+            f'up to history id {index.watermark} in {time.monotonic() - start:.1f}s'
+        ))
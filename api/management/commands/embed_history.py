@@ -0,0 +1,89 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill the Siamese embeddings of similarity history entries' user images "
+        '(entries without one, or embedded by another encoder version; see api/embeddings.py)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Images per forward pass (default: EMBED_BATCH_SIZE or 64)'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=512,
+            help='Entries read, embedded and updated together (default: 512)'
+        )
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='Only embed this user id (repeatable; default: all users)'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Stop after this many entries'
+        )
+
+    def handle(self, *args, **options):
+        from PIL import Image
+        from api.embeddings import encode_embedding
+        from api.feedback import SiameseEmbedder
+        from api.models import SimilarityHistory
+
+        try:
+            embedder = SiameseEmbedder()
+        except Exception as e:
+            raise CommandError(f'Could not load the Siamese model: {e}')
+        version = embedder.embedding_version
+
+        # exclude() keeps entries whose version is NULL
+        rows = SimilarityHistory.objects.exclude(embedding_version=version).exclude(user_image='').order_by('id')
+        if options['user_ids']:
+            rows = rows.filter(user_id__in=options['user_ids'])
+        chunk_size = max(1, options['chunk_size'])
+        limit = options['limit']
+
+        embedded = skipped = 0
+        last_id = 0
+        start = time.monotonic()
+        while limit is None or embedded + skipped < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - embedded - skipped)
+            chunk = list(rows.filter(id__gt=last_id).only('id', 'user_image')[:size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            entries, images = [], []
+            for entry in chunk:
+                try:
+                    with entry.user_image.open('rb') as f:
+                        image = Image.open(f)
+                        image.load()
+                except Exception as e:
+                    self.stderr.write(f'Skipping entry {entry.id}: {e}')
+                    skipped += 1
+                    continue
+                entries.append(entry)
+                images.append(image)
+            if not entries:
+                continue
+
+            embedded_at = timezone.now()
+            for entry, embedding in zip(entries, embedder.embed_batch(images, options['batch_size'])):
+                entry.embedding = encode_embedding(embedding)
+                entry.embedding_version = version
+                entry.embedded_at = embedded_at
+            SimilarityHistory.objects.bulk_update(entries, ['embedding', 'embedding_version', 'embedded_at'])
+            embedded += len(entries)
+
+            elapsed = time.monotonic() - start
+            self.stdout.write(f'{embedded} embedded, {skipped} skipped ({embedded / elapsed:.0f} images/s)')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Embedded {embedded} entries with encoder {version} ({skipped} skipped) '
+            f'in {time.monotonic() - start:.1f}s'
+        ))
@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand, CommandError
+import inspect
+
+
+class Command(BaseCommand):
+    help = 'Export the classifier and Siamese encoder to ONNX and TorchScript'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=['onnx', 'torchscript', 'all'], default='all',
+            help='Export format (default: all)'
+        )
+        parser.add_argument(
+            '--output-dir', default=None,
+            help='Directory for exported models (default: ml_models/weights/exported)'
+        )
+
+    def handle(self, *args, **options):
+        import torch
+        from pathlib import Path
+        from api.ml_models import get_classification_model
+        from api.ml_models.backends import (
+            CLASSIFIER, SIAMESE_ENCODER, SiameseEncoder, missing_onnx_packages, read_manifest, write_manifest
+        )
+        from api.ml_models.config import EXPORT_DIR, IMAGE_SIZE, NUM_CHANNELS
+        from api.ml_models.reference_index import file_sha256
+
+        formats = ['onnx', 'torchscript'] if options['format'] == 'all' else [options['format']]
+        if 'onnx' in formats:
+            missing = missing_onnx_packages()
+            if missing:
+                raise CommandError(
+                    f"ONNX export needs {' and '.join(missing)}: pip install onnx onnxruntime (or use --format torchscript)"
+                )
+        export_dir = Path(options['output_dir']) if options['output_dir'] else EXPORT_DIR
+        export_dir.mkdir(parents=True, exist_ok=True)
+
+        # Export from eager PyTorch modules, whatever backend is configured
+        try:
+            inference = get_classification_model(preload_siamese=False)
+            inference.load_siamese_model()
+        except Exception as e:
+            raise CommandError(f'Could not load models: {e}')
+
+        models = {
+            CLASSIFIER: (inference.model.cpu().eval(), inference.checkpoint_path),
+            SIAMESE_ENCODER: (SiameseEncoder(inference.siamese_model).cpu().eval(), inference.siamese_checkpoint),
+        }
+        dummy = torch.randn(1, NUM_CHANNELS, *IMAGE_SIZE)
+        check = torch.randn(4, NUM_CHANNELS, *IMAGE_SIZE)
+
+        manifest = read_manifest(export_dir)
+        for name, (module, checkpoint_path) in models.items():
+            entry = {'checkpoint_sha256': file_sha256(checkpoint_path)}
+            with torch.no_grad():
+                expected = module(check)
+
+            if 'onnx' in formats:
+                path = export_dir / f'{name}.onnx'
+                self._export_onnx(module, dummy, path)
+                entry['onnx'] = path.name
+                self._report(name, 'onnx', expected, self._run_onnx(path, check))
+
+            if 'torchscript' in formats:
+                path = export_dir / f'{name}.pt'
+                with torch.no_grad():
+                    traced = torch.jit.trace(module, dummy)
+                traced = torch.jit.freeze(traced.eval())
+                traced.save(str(path))
+                entry['torchscript'] = path.name
+                with torch.no_grad():
+                    self._report(name, 'torchscript', expected, torch.jit.load(str(path))(check))
+
+            # Keep artifacts of formats not exported this run if they match the checkpoint
+            previous = manifest.get(name, {})
+            if previous.get('checkpoint_sha256') == entry['checkpoint_sha256']:
+                entry = {**previous, **entry}
+            manifest[name] = entry
+
+        write_manifest(export_dir, manifest)
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported models to {export_dir}. Set INFERENCE_BACKEND=onnx or torchscript to use them.'
+        ))
+
+    def _export_onnx(self, module, dummy, path):
+        import torch
+
+        export_kwargs = {}
+        # Use the TorchScript-based exporter where the dynamo exporter is the default
+        if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+            export_kwargs['dynamo'] = False
+        torch.onnx.export(
+            module, (dummy,), str(path),
+            input_names=['input'], output_names=['output'],
+            dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+            opset_version=17,
+            **export_kwargs
+        )
+
+    def _run_onnx(self, path, batch):
+        from api.ml_models.backends import OnnxRunner
+        return OnnxRunner(path)(batch)
+
+    def _report(self, name, fmt, expected, actual):
+        max_diff = (expected - actual).abs().max().item()
+        style = self.style.SUCCESS if max_diff < 1e-3 else self.style.WARNING
+        self.stdout.write(style(f'✓ {name} -> {fmt} (max abs diff vs eager: {max_diff:.2e})'))
@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Build int8 ONNX models and gate them against the fp32 models'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--holdout-dir', default=None,
+            help='Folder of raw held-out character images to evaluate on (in addition to reference images)'
+        )
+        parser.add_argument(
+            '--min-agreement', type=float, default=0.99,
+            help='Minimum classifier top-1 agreement with fp32 (default: 0.99)'
+        )
+        parser.add_argument(
+            '--max-drift', type=float, default=0.05,
+            help='Maximum Siamese embedding distance from fp32 per image (default: 0.05)'
+        )
+
+    def handle(self, *args, **options):
+        from api.ml_models import get_classification_model
+        from api.ml_models.backends import (
+            CLASSIFIER, SIAMESE_ENCODER, missing_onnx_packages, read_manifest, write_manifest
+        )
+        from api.ml_models.config import EXPORT_DIR, REFERENCE_IMAGES_DIR
+        from api.ml_models.reference_index import file_sha256
+
+        missing = missing_onnx_packages()
+        if missing:
+            raise CommandError(f"Quantization needs {' and '.join(missing)}: pip install onnx onnxruntime")
+        from api.ml_models.quantization import evaluate_int8, list_images, quantize_onnx
+
+        manifest = read_manifest(EXPORT_DIR)
+        for name in (CLASSIFIER, SIAMESE_ENCODER):
+            if not manifest.get(name, {}).get('onnx'):
+                raise CommandError(f'No ONNX export for {name}. Run `python manage.py export_models --format onnx` first.')
+
+        try:
+            inference = get_classification_model(preload_siamese=False)
+            inference.load_siamese_model()
+        except Exception as e:
+            raise CommandError(f'Could not load models: {e}')
+
+        checkpoints = {CLASSIFIER: inference.checkpoint_path, SIAMESE_ENCODER: inference.siamese_checkpoint}
+        for name, checkpoint_path in checkpoints.items():
+            if manifest[name].get('checkpoint_sha256') != file_sha256(checkpoint_path):
+                raise CommandError(f'ONNX export for {name} is stale. Re-run `python manage.py export_models`.')
+
+        # Quantize
+        int8_paths = {}
+        for name in (CLASSIFIER, SIAMESE_ENCODER):
+            source = EXPORT_DIR / manifest[name]['onnx']
+            target = EXPORT_DIR / f'{name}.int8.onnx'
+            quantize_onnx(source, target)
+            int8_paths[name] = target
+            self.stdout.write(
+                f'✓ {name}: {source.stat().st_size / 1e6:.1f} MB -> {target.stat().st_size / 1e6:.1f} MB (int8)'
+            )
+
+        # Evaluate: reference images are already preprocessed, held-out images are raw
+        # uploads and get the same crop and resize as requests do
+        images = [(path, True) for path in list_images(REFERENCE_IMAGES_DIR)]
+        if options['holdout_dir']:
+            from api.views import decode_image, preprocess_image_array
+
+            holdout = list_images(options['holdout_dir'])
+            if not holdout:
+                raise CommandError(f"No images found in {options['holdout_dir']}")
+            for path in holdout:
+                try:
+                    images.append((preprocess_image_array(decode_image(path.read_bytes())), True))
+                except Exception as e:
+                    raise CommandError(f'Could not read held-out image {path}: {e}')
+
+        report = evaluate_int8(
+            inference, int8_paths[CLASSIFIER], int8_paths[SIAMESE_ENCODER], images,
+            min_agreement=options['min_agreement'], max_drift=options['max_drift']
+        )
+
+        for name, metrics in report.items():
+            manifest[name]['onnx_int8'] = int8_paths[name].name
+            manifest[name]['int8_gate'] = {**metrics, 'checkpoint_sha256': manifest[name]['checkpoint_sha256']}
+            summary = ', '.join(f'{k}={v:.4f}' if isinstance(v, float) else f'{k}={v}' for k, v in metrics.items())
+            style = self.style.SUCCESS if metrics['approved'] else self.style.ERROR
+            self.stdout.write(style(f"{'APPROVED' if metrics['approved'] else 'REJECTED'} {name}: {summary}"))
+
+        write_manifest(EXPORT_DIR, manifest)
+        self.stdout.write('Set INFERENCE_BACKEND=onnx and INFERENCE_QUANTIZED=True to serve approved int8 models.')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-user statistics rollups from the similarity history (see api/stats.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='Only rebuild this user id (repeatable; default: all users)'
+        )
+
+    def handle(self, *args, **options):
+        from api.models import UserClassStats
+        from api.stats import rebuild_statistics
+
+        rebuild_statistics(options['user_ids'])
+        rows = UserClassStats.objects.all()
+        if options['user_ids']:
+            rows = rows.filter(user_id__in=options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt statistics ({rows.count()} user/character rows)'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Retry history writes that failed in the write-behind stage (see api/write_behind.py)'
+
+    def handle(self, *args, **options):
+        from api.write_behind import JOURNAL_DIR, replay_journal
+
+        replayed, failed = replay_journal()
+        message = f'Replayed {replayed} journaled write(s) from {JOURNAL_DIR}'
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{message}; {failed} failed again and stay journaled'))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,165 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the similarity scores of stored history entries with the current Siamese model '
+        'and references (run after shipping a new checkpoint; resumable)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Images per forward pass (default: EMBED_BATCH_SIZE or 64)'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=512,
+            help='Entries read, scored and updated together (default: 512)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Threads loading images ahead of the model (default: 4)'
+        )
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='Only rescore this user id (repeatable; default: all users)'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Stop after this many entries (resume later from the checkpoint)'
+        )
+        parser.add_argument(
+            '--checkpoint', default=str(Path(settings.BASE_DIR) / 'rescore_history.json'),
+            help='Progress file; a run with the same model and users resumes from it'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore the checkpoint and rescore from the first entry'
+        )
+        parser.add_argument(
+            '--skip-statistics', action='store_true',
+            help='Do not rebuild the statistics rollups afterwards (run rebuild_statistics later)'
+        )
+
+    def handle(self, *args, **options):
+        from api.embeddings import encode_embedding
+        from api.feedback import SiameseEmbedder
+        from api.models import SimilarityHistory
+        from api.stats import rebuild_statistics
+
+        try:
+            embedder = SiameseEmbedder()
+        except Exception as e:
+            raise CommandError(f'Could not load the Siamese model: {e}')
+
+        user_ids = sorted(set(options['user_ids'])) if options['user_ids'] else None
+        checkpoint_path = Path(options['checkpoint'])
+        progress = {'version': embedder.version, 'users': user_ids, 'last_id': 0, 'rescored': 0, 'skipped': 0}
+        if checkpoint_path.exists() and not options['restart']:
+            saved = json.loads(checkpoint_path.read_text())
+            if (saved.get('version'), saved.get('users')) == (embedder.version, user_ids):
+                progress = saved
+                self.stdout.write(f"Resuming after history id {saved['last_id']} ({saved['rescored']} already rescored)")
+            else:
+                self.stdout.write('Checkpoint is for another model or user filter; starting from the first entry')
+
+        rows = SimilarityHistory.objects.exclude(user_image='').order_by('id')
+        if user_ids:
+            rows = rows.filter(user_id__in=user_ids)
+        chunk_size = max(1, options['chunk_size'])
+        limit = options['limit']
+        fetched = 0
+
+        def next_chunk(after):
+            nonlocal fetched
+            size = chunk_size if limit is None else min(chunk_size, limit - fetched)
+            if size <= 0:
+                return []
+            chunk = list(rows.filter(id__gt=after).only('id', 'target_class', 'user_image')[:size])
+            fetched += len(chunk)
+            return chunk
+
+        def load(entry):
+            # Decoding and resizing run in the pool, overlapping the forward passes.
+            # Only the display image is stored, so this approximates the original input
+            # (see SiameseEmbedder.model_input and the README).
+            from PIL import Image
+
+            try:
+                with entry.user_image.open('rb') as f:
+                    image = Image.open(f)
+                    image.load()
+                return embedder.model_input(image)
+            except Exception as e:
+                return e
+
+        rescored = skipped = 0
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, options['workers']), thread_name_prefix='rescore-load') as pool:
+            chunk = next_chunk(progress['last_id'])
+            loading = pool.map(load, chunk)
+            while chunk:
+                # Start reading the next chunk's images before scoring this one
+                following = next_chunk(chunk[-1].id)
+                following_loading = pool.map(load, following)
+
+                entries, inputs = [], []
+                for entry, loaded in zip(chunk, loading):
+                    if isinstance(loaded, Exception):
+                        self.stderr.write(f'Skipping entry {entry.id}: {loaded}')
+                        skipped += 1
+                        continue
+                    entries.append(entry)
+                    inputs.append(loaded)
+
+                if entries:
+                    embeddings, scores = embedder.score_batch(
+                        inputs, [entry.target_class for entry in entries], options['batch_size']
+                    )
+                    embedded_at = timezone.now()
+                    for entry, embedding, (score, distance, is_same) in zip(entries, embeddings, scores):
+                        # Rounded like the similarity endpoint's response, which clients save
+                        entry.similarity_score = round(score, 2)
+                        entry.distance = round(distance, 4)
+                        entry.is_same_character = is_same
+                        entry.embedding = encode_embedding(embedding)
+                        entry.embedding_version = embedder.embedding_version
+                        entry.embedded_at = embedded_at
+                    SimilarityHistory.objects.bulk_update(
+                        entries,
+                        ['similarity_score', 'distance', 'is_same_character', 'embedding', 'embedding_version',
+                         'embedded_at']
+                    )
+                    rescored += len(entries)
+
+                # Written only after the chunk is committed, so a crash redoes at most one chunk
+                progress.update(
+                    last_id=chunk[-1].id,
+                    rescored=progress['rescored'] + len(entries),
+                    skipped=progress['skipped'] + len(chunk) - len(entries),
+                )
+                tmp = checkpoint_path.with_suffix('.tmp')
+                tmp.write_text(json.dumps(progress))
+                tmp.replace(checkpoint_path)
+
+                elapsed = time.monotonic() - start
+                self.stdout.write(f'{rescored} rescored, {skipped} skipped ({rescored / elapsed:.0f} images/s)')
+                chunk, loading = following, following_loading
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rescored {rescored} entries with model {embedder.version} ({skipped} skipped) '
+            f'in {time.monotonic() - start:.1f}s; checkpoint at history id {progress["last_id"]}'
+        ))
+
+        # bulk_update skips the signals that keep the rollups current
+        if not options['skip_statistics']:
+            start = time.monotonic()
+            rebuild_statistics(user_ids)
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt statistics in {time.monotonic() - start:.1f}s'))
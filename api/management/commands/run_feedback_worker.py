@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Process queued AI feedback jobs (see api/feedback.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--provider', choices=['gemini', 'stub'], default=None,
+            help='Feedback provider (default: FEEDBACK_PROVIDER or gemini)'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help='Seconds to wait between polls when the queue is empty (default: 2)'
+        )
+        parser.add_argument(
+            '--exact-cache', action='store_true',
+            help='Reuse feedback only for identical images (skips loading the Siamese model)'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the queue once and exit instead of polling forever'
+        )
+
+    def handle(self, *args, **options):
+        from django.db import close_old_connections
+        from api.feedback import cache_stats, get_embedder, get_feedback_provider, run_pending_jobs
+
+        try:
+            provider = get_feedback_provider(options['provider'])
+        except Exception as e:
+            raise CommandError(f'Could not create feedback provider: {e}')
+
+        embedder = None if options['exact_cache'] else get_embedder()
+        cache_mode = 'embedding' if embedder is not None else 'exact'
+        self.stdout.write(f'Feedback worker started ({type(provider).__name__}, {cache_mode} cache)')
+        while True:
+            close_old_connections()
+            processed = run_pending_jobs(provider, embedder=embedder)
+            if processed:
+                stats = cache_stats()
+                self.stdout.write(self.style.SUCCESS(
+                    f'Processed {processed} feedback job(s) '
+                    f"(cache: {stats['hits']} hits, {stats['misses']} misses, {stats['hit_rate']:.0%} hit rate)"
+                ))
+            if options['once']:
+                return
+            if not processed:
+                time.sleep(options['poll_interval'])
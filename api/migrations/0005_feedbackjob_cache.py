@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_feedbackjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feedbackjob',
+            name='cache_hit',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='feedbackjob',
+            name='cache_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='feedbackjob',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
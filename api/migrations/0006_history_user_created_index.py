@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_feedbackjob_cache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='predictionhistory',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='predictionhist_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='similarityhistory',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='similarityhist_user_created'),
+        ),
+    ]
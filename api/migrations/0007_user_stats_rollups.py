@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:38
+
+import datetime
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    # Same figures as api.stats.rebuild_statistics, on the historical models
+    SimilarityHistory = apps.get_model('api', 'SimilarityHistory')
+    UserClassStats = apps.get_model('api', 'UserClassStats')
+    UserDailyStats = apps.get_model('api', 'UserDailyStats')
+
+    counters = {
+        'count': Count('id'),
+        'score_sum': Sum('similarity_score'),
+        'best_score': Max('similarity_score'),
+        'matches': Count('id', filter=Q(is_same_character=True)),
+        'high_scores': Count('id', filter=Q(similarity_score__gte=90)),
+        'good_scores': Count('id', filter=Q(similarity_score__gte=75, similarity_score__lt=90)),
+        'last_at': Max('created_at'),
+    }
+    history = SimilarityHistory.objects.order_by()
+    UserClassStats.objects.bulk_create(
+        (UserClassStats(**row) for row in history.values('user_id', 'target_class').annotate(**counters)),
+        batch_size=1000
+    )
+    daily = history.annotate(day=TruncDate('created_at', tzinfo=datetime.timezone.utc)).values(
+        'user_id', 'day', 'target_class'
+    ).annotate(**counters)
+    UserDailyStats.objects.bulk_create((UserDailyStats(**row) for row in daily), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_history_user_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserClassStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_class', models.IntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0)),
+                ('best_score', models.FloatField(default=0)),
+                ('matches', models.PositiveIntegerField(default=0)),
+                ('high_scores', models.PositiveIntegerField(default=0)),
+                ('good_scores', models.PositiveIntegerField(default=0)),
+                ('last_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'User Class Stats',
+                'constraints': [models.UniqueConstraint(fields=('user', 'target_class'), name='userclassstats_user_class')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_class', models.IntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0)),
+                ('best_score', models.FloatField(default=0)),
+                ('matches', models.PositiveIntegerField(default=0)),
+                ('high_scores', models.PositiveIntegerField(default=0)),
+                ('good_scores', models.PositiveIntegerField(default=0)),
+                ('last_at', models.DateTimeField(blank=True, null=True)),
+                ('day', models.DateField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'User Daily Stats',
+                'constraints': [models.UniqueConstraint(fields=('user', 'day', 'target_class'), name='userdailystats_user_day_class')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_user_stats_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='predictionhistory',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='predictions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='similarityhistory',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='similarityhistory',
+            index=models.Index(fields=['user', 'target_class', '-created_at', '-id'], name='similarityhist_user_class'),
+        ),
+        migrations.AddIndex(
+            model_name='similarityhistory',
+            index=models.Index(condition=models.Q(('is_same_character', True)), fields=['user', '-created_at', '-id'], name='similarityhist_user_matched'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_history_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='feedbackjob',
+            name='status',
+            field=models.CharField(choices=[('waiting', 'Waiting for images'), ('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='predictionhistory',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
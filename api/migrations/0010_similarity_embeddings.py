@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_write_behind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='similarityhistory',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='similarityhistory',
+            name='embedding_version',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
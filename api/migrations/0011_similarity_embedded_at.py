@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_similarity_embeddings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='similarityhistory',
+            name='embedded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='similarityhistory',
+            index=models.Index(fields=['user', 'embedded_at'], name='similarityhist_user_embedded'),
+        ),
+    ]
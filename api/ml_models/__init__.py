@@ -2,6 +2,8 @@
 Model loader singleton for Django
 Ensures model is loaded only once and reused across requests
 """
+import gc
+import os
 from pathlib import Path
 
 # Global model instance
@@ -32,7 +34,7 @@ def get_classification_model(preload_siamese=True):
             device='cpu',  # Change to 'cuda' if GPU available
             checkpoint_path=str(model_path / 'efficientnet_b0_augmented_best.pth')
         )
-        print("✓ Classification model loaded")
+        print(f"✓ Classification model loaded ({_classification_model.classifier_backend})")
     
     # Preload Siamese model to avoid delay on first similarity request
     if preload_siamese and not _siamese_preloaded:
@@ -46,36 +48,49 @@ def get_classification_model(preload_siamese=True):
 
 
 def _preload_siamese_model(inference_instance):
-    """Preload the Siamese model onto the inference instance"""
-    import torch
-    from .config import MODELS_DIR
-    from .siamese_network import SiameseNetwork
-    import glob
+    """Preload the Siamese model and reference embeddings onto the inference instance"""
+    inference_instance.load_siamese_model()
+
+
+def warm_up_models():
+    """
+    Load all models and run a warm-up pass (called from ApiConfig.ready)
     
-    if hasattr(inference_instance, 'siamese_model'):
-        return  # Already loaded
+    Under `gunicorn --preload` this runs once in the master: forked workers
+    inherit the loaded weights and reference embeddings copy-on-write.
+    """
+    model = get_classification_model()
+    try:
+        model.warm_up()
+    except Exception as e:
+        print(f"Warning: Model warm-up failed: {e}")
+    # Move everything allocated so far out of the GC's reach, so collections
+    # in the workers do not touch (and copy) the pages shared with the master
+    gc.collect()
+    gc.freeze()
+    print("✓ Models warmed up")
+    return model
+
+
+def configure_worker(num_workers: int = 1):
+    """
+    Per-process setup after fork (called from gunicorn's post_fork hook)
     
-    siamese_runs = sorted(glob.glob(str(MODELS_DIR / "*siamese*efficientnet*.pth")))
-    if not siamese_runs:
-        raise FileNotFoundError("No Siamese model checkpoint found!")
-    siamese_checkpoint = siamese_runs[-1]
+    Splits the CPU cores between workers so they don't oversubscribe them,
+    and rebuilds runtime state that does not survive fork.
     
-    print(f"Preloading Siamese model from: {siamese_checkpoint}")
-    checkpoint = torch.load(siamese_checkpoint, map_location=inference_instance.device)
+    Args:
+        num_workers: Number of worker processes sharing this machine
+    """
+    import torch
+    from .config import TORCH_NUM_THREADS
     
-    backbone = checkpoint.get('backbone', 'efficientnet_b0')
-    embedding_dim = checkpoint.get('embedding_dim', 128)
+    num_threads = TORCH_NUM_THREADS or max(1, (os.cpu_count() or 1) // max(1, num_workers))
+    torch.set_num_threads(num_threads)
     
-    inference_instance.siamese_model = SiameseNetwork(
-        backbone=backbone,
-        embedding_dim=embedding_dim,
-        pretrained_path=None
-    )
-    inference_instance.siamese_model.load_state_dict(checkpoint['model_state_dict'])
-    inference_instance.siamese_model = inference_instance.siamese_model.to(inference_instance.device)
-    inference_instance.siamese_model.eval()
-    inference_instance.optimal_threshold = 0.45
-    print("✓ Siamese model preloaded")
+    if _classification_model is not None:
+        _classification_model.after_fork()
+    return num_threads
 
 
 def reload_model():
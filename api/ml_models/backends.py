@@ -0,0 +1,138 @@
+"""
+Execution backends for the classifier and the Siamese encoder
+
+'eager' runs the PyTorch modules directly. 'torchscript' and 'onnx' run the
+artifacts written by `python manage.py export_models`, which records the
+checkpoint each artifact was exported from; stale or missing artifacts fall
+back to eager.
+
+The onnx backend needs onnxruntime, and exporting/quantizing also needs
+onnx. Neither is in requirements.txt (the deployed app serves through the
+HF Space), so without them the onnx backend falls back to eager as well.
+"""
+import importlib.util
+import json
+
+import torch
+
+BACKENDS = ('eager', 'torchscript', 'onnx')
+
+# Names of the exported models (see export_models)
+CLASSIFIER = 'classifier'
+SIAMESE_ENCODER = 'siamese_encoder'
+
+
+class SiameseEncoder(torch.nn.Module):
+    """Exposes SiameseNetwork.forward_once as forward() for export"""
+
+    def __init__(self, siamese_model):
+        super(SiameseEncoder, self).__init__()
+        self.siamese_model = siamese_model
+
+    def forward(self, x):
+        return self.siamese_model.forward_once(x)
+
+
+class OnnxRunner:
+    """Runs an ONNX model with ONNX Runtime on CPU, tensor in / tensor out"""
+
+    def __init__(self, model_path, num_threads: int = None):
+        self.model_path = str(model_path)
+        self.reset(num_threads)
+
+    def reset(self, num_threads: int = None):
+        """
+        (Re)create the inference session
+
+        Sessions own a thread pool, which does not survive fork: a session
+        created before fork must be reset in the child before use.
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        outputs = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+def missing_onnx_packages(*packages):
+    """Which of the optional ONNX packages (default: onnx, onnxruntime) are not installed"""
+    return [package for package in packages or ('onnx', 'onnxruntime') if importlib.util.find_spec(package) is None]
+
+
+def read_manifest(export_dir):
+    """Load the export manifest, or an empty dict if nothing was exported"""
+    manifest_path = export_dir / 'manifest.json'
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(export_dir, manifest):
+    export_dir.mkdir(parents=True, exist_ok=True)
+    with open(export_dir / 'manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_runner(backend: str, name: str, eager_fn, checkpoint_path, export_dir=None, quantized: bool = False):
+    """
+    Build the forward function for one model
+
+    Args:
+        backend: One of BACKENDS
+        name: CLASSIFIER or SIAMESE_ENCODER
+        eager_fn: PyTorch callable used for 'eager' and as fallback
+        checkpoint_path: Checkpoint the eager model was loaded from
+        export_dir: Directory holding exported artifacts (default: config.EXPORT_DIR)
+        quantized: Prefer the int8 ONNX model if its accuracy gate approved it
+
+    Returns:
+        (callable mapping a (N, 1, H, W) tensor to a tensor, backend actually used)
+    """
+    from .config import EXPORT_DIR
+    from .reference_index import file_sha256
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    if quantized and backend != 'onnx':
+        print(f"Warning: Quantized models require INFERENCE_BACKEND=onnx; using fp32 {backend}")
+        quantized = False
+    if backend == 'eager':
+        return eager_fn, 'eager'
+    if backend == 'onnx' and missing_onnx_packages('onnxruntime'):
+        print("Warning: INFERENCE_BACKEND=onnx needs onnxruntime (pip install onnxruntime); using eager PyTorch")
+        return eager_fn, 'eager'
+
+    export_dir = export_dir or EXPORT_DIR
+    entry = read_manifest(export_dir).get(name, {})
+    artifact, label = entry.get(backend), backend
+    checkpoint_sha256 = file_sha256(checkpoint_path)
+
+    if quantized:
+        gate = entry.get('int8_gate', {})
+        # The gate only vouches for the checkpoint it evaluated
+        if entry.get('onnx_int8') and gate.get('approved') and gate.get('checkpoint_sha256') == checkpoint_sha256:
+            artifact, label = entry['onnx_int8'], 'onnx-int8'
+        else:
+            print(f"Warning: int8 {name} not approved by accuracy gate (run quantize_models); using fp32 onnx")
+
+    if not artifact or not (export_dir / artifact).exists():
+        print(f"Warning: No {label} export for {name}; using eager PyTorch")
+        return eager_fn, 'eager'
+    if entry.get('checkpoint_sha256') != checkpoint_sha256:
+        print(f"Warning: {label} export for {name} is stale (checkpoint changed); using eager PyTorch")
+        return eager_fn, 'eager'
+
+    if backend == 'torchscript':
+        module = torch.jit.load(str(export_dir / artifact), map_location='cpu')
+        module.eval()
+        return module, label
+
+    return OnnxRunner(export_dir / artifact, num_threads=torch.get_num_threads()), label
@@ -0,0 +1,114 @@
+"""
+Dynamic micro-batching for model forward passes
+
+Concurrent requests each submit a single item; a background thread collects
+items for up to a short window (or until the batch is full), runs one batched
+forward pass and hands each caller its own result.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Collects single-item requests and runs them through one batched call
+
+    Thread-safe: any number of threads may call submit() concurrently. The
+    worker thread is started lazily and restarted after a fork, so an
+    instance created in a gunicorn master before forking is safe to use in
+    the workers.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 16, max_wait_ms: float = 5.0, name: str = 'batcher'):
+        """
+        Args:
+            batch_fn: Callable taking a list of items and returning a list of
+                      results in the same order
+            max_batch_size: Maximum number of items per batched call
+            max_wait_ms: How long to wait for more items after the first one
+            name: Name of the worker thread
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    @property
+    def pending(self) -> int:
+        """Approximate number of items waiting to be batched"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None and self._thread.is_alive():
+                return
+            # New process (or first use): threads do not survive fork
+            if self._pid != pid:
+                self._queue = queue.Queue()
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Queue one item and return a Future for its result"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    async def submit_async(self, item):
+        """Awaitable variant of submit() for ASGI callers"""
+        return await asyncio.wrap_future(self.submit(item))
+
+    def __call__(self, item, timeout: float = None):
+        """Submit one item and block until its result is ready"""
+        return self.submit(item).result(timeout=timeout)
+
+    def _collect(self, work_queue):
+        """Block for the first item, then gather more until the window closes"""
+        batch = [work_queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(work_queue.get_nowait())
+                else:
+                    batch.append(work_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        work_queue = self._queue
+        while True:
+            batch = []
+            try:
+                batch = self._collect(work_queue)
+                # Skip callers that gave up (cancelled) before the batch ran
+                batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+
+                results = list(self.batch_fn([item for item, _ in batch]))
+                if len(results) != len(batch):
+                    raise RuntimeError(f'{self.name}: batch_fn returned {len(results)} results for {len(batch)} items')
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except BaseException as e:
+                # The worker must outlive any failure, or every queued caller would hang
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
@@ -1,6 +1,7 @@
 """
 Simplified configuration for Django integration
 """
+import os
 from pathlib import Path
 
 # Base directory for ml_models
@@ -9,14 +10,71 @@ BASE_DIR = Path(__file__).parent
 # Model weights directory
 MODELS_DIR = BASE_DIR / 'weights'
 
+# Static reference images (one per class) used for similarity
+REFERENCE_IMAGES_DIR = BASE_DIR.parent / 'reference_images'
+
+# Extra reference exemplars, in class_{n}/ folders (same format as the reference images)
+REFERENCE_GALLERY_DIR = Path(os.getenv('REFERENCE_GALLERY_DIR', str(REFERENCE_IMAGES_DIR / 'gallery')))
+
+# How a class's exemplar distances combine: 'min' (nearest exemplar) or 'mean'
+REFERENCE_GALLERY_SCORE = os.getenv('REFERENCE_GALLERY_SCORE', 'min')
+
+# Derived artifacts (e.g. precomputed reference embeddings)
+CACHE_DIR = MODELS_DIR / 'cache'
+
+# TorchScript / ONNX exports (see `python manage.py export_models`)
+EXPORT_DIR = MODELS_DIR / 'exported'
+
 # Model parameters
 NUM_CLASSES = 36  # Updated to 36 classes for augmented model
 IMAGE_SIZE = (64, 64)
 NUM_CHANNELS = 1  # Grayscale
 
+# Siamese embedding distance below which two images are the same character
+SIMILARITY_THRESHOLD = 0.45
+
 # Device
 DEVICE = 'cpu'  # Change to 'cuda' if you have GPU
 
+# Execution backend: 'eager', 'torchscript' or 'onnx' (see backends.py)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'eager')
+
+# Use int8 ONNX models when their accuracy gate passed (see quantize_models)
+INFERENCE_QUANTIZED = os.getenv('INFERENCE_QUANTIZED', 'False') == 'True'
+
 # Normalization (default values for Ranjana dataset)
 MEAN = 0.2677
 STD = 0.4220
+
+# Images per forward pass in bulk embedding (embed_batch, e.g. `manage.py embed_history`)
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '64'))
+
+# Dynamic micro-batching of concurrent requests (see batching.py)
+BATCHING_ENABLED = os.getenv('INFERENCE_BATCHING', 'False') == 'True'
+BATCH_MAX_SIZE = int(os.getenv('INFERENCE_BATCH_MAX_SIZE', '16'))
+BATCH_WINDOW_MS = float(os.getenv('INFERENCE_BATCH_WINDOW_MS', '5'))
+
+# Load models and run a warm-up pass at startup rather than on the first request
+# (set by gunicorn.conf.py so the gunicorn master loads them once before forking)
+PRELOAD_MODELS = os.getenv('PRELOAD_ML_MODELS', 'False') == 'True'
+
+# Torch intra-op threads per worker process (0 = CPU count / number of workers)
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', '0'))
+
+# HuggingFace Space client (see hf_client.py)
+HF_POOL_SIZE = int(os.getenv('HF_POOL_SIZE', '4'))  # Concurrent connections to the Space
+HF_TIMEOUT = float(os.getenv('HF_TIMEOUT', '30'))  # Seconds per attempt
+HF_RETRIES = int(os.getenv('HF_RETRIES', '2'))  # Extra attempts after a failed or timed-out call
+HF_BACKOFF = float(os.getenv('HF_BACKOFF', '0.5'))  # Seconds before the first retry, doubled each time
+HF_HEDGE_AFTER = float(os.getenv('HF_HEDGE_AFTER', '0'))  # Send a duplicate call after this many seconds (0 = off)
+
+# Where inference runs: 'local', 'remote' (HuggingFace Space) or 'hybrid' (see router.py).
+# Defaults to 'remote' when USE_HUGGINGFACE_API=True, else 'local'.
+INFERENCE_ROUTING = os.getenv('INFERENCE_ROUTING') or (
+    'remote' if os.getenv('USE_HUGGINGFACE_API', 'False') == 'True' else 'local'
+)
+ROUTER_SPILL_DEPTH = int(os.getenv('ROUTER_SPILL_DEPTH', '2'))  # In-flight local requests before spilling (below GUNICORN_THREADS)
+ROUTER_WINDOW = int(os.getenv('ROUTER_WINDOW', '50'))  # Calls per backend kept for latency and error rates
+ROUTER_BREAKER_FAILURES = int(os.getenv('ROUTER_BREAKER_FAILURES', '5'))  # Consecutive remote failures that open the circuit
+ROUTER_BREAKER_COOLDOWN = float(os.getenv('ROUTER_BREAKER_COOLDOWN', '30'))  # Seconds before a trial call is let through
+ROUTER_SHADOW_RATE = float(os.getenv('ROUTER_SHADOW_RATE', '0'))  # Fraction of requests re-run on the other backend
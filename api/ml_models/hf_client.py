@@ -1,100 +1,283 @@
-from gradio_client import Client, handle_file
-from PIL import Image
+"""
+Client for the models hosted on the HuggingFace Space
+
+Calls go through a small pool of gradio Clients so concurrent requests don't
+queue behind each other. Every attempt is bounded by a timeout, failed
+attempts are retried with exponential backoff, and a slow attempt can be
+hedged with a duplicate call (the first answer wins). Images are uploaded
+straight from memory, no temp files needed.
+"""
 import io
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from pathlib import Path
+
 import numpy as np
+from PIL import Image
+
+from .config import HF_POOL_SIZE, HF_TIMEOUT, HF_RETRIES, HF_BACKOFF, HF_HEDGE_AFTER
+
+
+def image_bytes(image):
+    """Encoded image bytes from a path, raw bytes, numpy array or PIL Image"""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if isinstance(image, (str, Path)):
+        return Path(image).read_bytes()
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    return buf.getvalue()
+
 
 class HuggingFaceMLClient:
-    def __init__(self, space_url):
+    def __init__(self, space_url, pool_size=HF_POOL_SIZE, timeout=HF_TIMEOUT, retries=HF_RETRIES,
+                 backoff=HF_BACKOFF, hedge_after=HF_HEDGE_AFTER):
         """
         Initialize HF Space client
         space_url: Your HF Space URL, e.g., "https://your-username-calligraphy-ml-api.hf.space"
+        pool_size: Maximum number of concurrent calls to the Space
+        timeout: Seconds allowed per attempt (upload + prediction)
+        retries: Extra attempts after a failed or timed-out call
+        backoff: Seconds before the first retry, doubled for each further retry
+        hedge_after: Seconds after which a still-running call is duplicated (0 = no hedging)
         """
         self.space_url = space_url.rstrip('/')
-        self.client = Client(self.space_url)
-    
-    def predict(self, image_path, top_k=1, skip_preprocessing=False):
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = timeout
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        # Identifies the remote models for result caching
+        self.classifier_version = self.siamese_version = f'hf:{self.space_url}'
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._pid = None
+        # Connect once up front so a bad URL fails at startup, not on the first request
+        self._release(self._acquire())
+
+    def _ensure_executors(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                # Threads do not survive fork: (re)create the pools in this process
+                self._attempts = ThreadPoolExecutor(max_workers=2 * self.pool_size, thread_name_prefix='hf-attempt')
+                self._calls = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='hf-call')
+                self._pid = pid
+
+    def _new_client(self):
+        from gradio_client import Client
+        return Client(self.space_url, verbose=False, httpx_kwargs={'timeout': self.timeout})
+
+    def _acquire(self):
+        """Take an idle gradio Client, creating one if the pool isn't full yet"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.pool_size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._new_client()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No HF client free after {self.timeout}s")
+
+    def _release(self, client, broken=False):
+        """Return a client to the pool, or drop it if its connection may be bad"""
+        if broken:
+            with self._lock:
+                self._created -= 1
+        else:
+            self._idle.put(client)
+
+    def _upload(self, client, image, name='image.png'):
+        """Upload an image from memory; returns the file argument for the call"""
+        import httpx
+
+        response = httpx.post(
+            client.upload_url,
+            headers=client.headers,
+            cookies=client.cookies,
+            verify=client.ssl_verify,
+            files=[('files', (name, image_bytes(image)))],
+            **{**client.httpx_kwargs, 'timeout': self.timeout}
+        )
+        response.raise_for_status()
+        # Without a 'meta' key gradio_client passes the already-uploaded file through as is
+        return {'path': response.json()[0], 'orig_name': name}
+
+    def _attempt(self, api_name, images):
+        """One call: upload the images and run the endpoint, within the timeout"""
+        from gradio_client.exceptions import AppError
+
+        client = self._acquire()
+        broken = False
+        try:
+            files = [self._upload(client, image) for image in images]
+            job = client.submit(*files, api_name=api_name)
+            try:
+                return job.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                job.cancel()
+                raise TimeoutError(f"HF API call {api_name} timed out after {self.timeout}s")
+        except AppError:
+            raise
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self._release(client, broken)
+
+    def _hedged_attempt(self, api_name, images):
+        """_attempt, duplicated if the first one is still running after hedge_after seconds"""
+        if not self.hedge_after or self.hedge_after <= 0:
+            return self._attempt(api_name, images)
+
+        self._ensure_executors()
+        pending = {self._attempts.submit(self._attempt, api_name, images)}
+        done, pending = wait(pending, timeout=self.hedge_after)
+        if not done:
+            pending.add(self._attempts.submit(self._attempt, api_name, images))
+
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = error or future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    def _call(self, api_name, *images):
+        """Run an endpoint with retries and exponential backoff (app errors are not retried)"""
+        from gradio_client.exceptions import AppError
+
+        for attempt in range(self.retries + 1):
+            try:
+                return self._hedged_attempt(api_name, images)
+            except AppError:
+                raise
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                # Jitter keeps concurrent retries from hitting the Space in lockstep
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.75, 1.25))
+
+    def predict(self, image, top_k=1, skip_preprocessing=False):
         """
         Predict character class
-        
+
         Args:
-            image_path: Path to image file
+            image: Image as a path, raw bytes, numpy array or PIL Image
             top_k: Number of top predictions (not used, for API compatibility)
             skip_preprocessing: If True, image is already preprocessed (ignored for HF API)
         """
         try:
             # Call Gradio API - Classification interface
-            result = self.client.predict(
-                handle_file(image_path),
-                api_name="/predict_class"
-            )
-            
+            result = self._call("/predict_class", image)
+
             return {
                 'class': result['predicted_class'],
                 'confidence': result['confidence']
             }
         except Exception as e:
             raise Exception(f"HF API prediction failed: {str(e)}")
-    
-    def compute_similarity(self, image1_path, image2_path, siamese_checkpoint=None, skip_preprocessing=False):
+
+    def predict_many(self, images, top_k=1):
+        """
+        predict() for several images, up to pool_size at a time
+
+        Returns:
+            list: One prediction dict per image, or the Exception its call raised
+        """
+        self._ensure_executors()
+        futures = [self._calls.submit(self.predict, image, top_k) for image in images]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def compute_similarity(self, image1, image2, siamese_checkpoint=None, skip_preprocessing=False):
         """
         Compute similarity between two images
-        
+
         Args:
-            image1_path: Path to first image
-            image2_path: Path to second image
+            image1: First image (path, raw bytes, numpy array or PIL Image)
+            image2: Second image (path, raw bytes, numpy array or PIL Image)
             siamese_checkpoint: Not used for HF API (for compatibility)
             skip_preprocessing: If True, images are already preprocessed (ignored for HF API)
-        
+
         Returns:
             tuple: (similarity_score, distance, ref_image_pil, user_image_pil, overlay_image_pil)
         """
         try:
             # Call Gradio API - Similarity interface
-            result = self.client.predict(
-                handle_file(image1_path),
-                handle_file(image2_path),
-                api_name="/compute_similarity"
-            )
-            
-            # Debug: print result structure
-            print(f"HF API result type: {type(result)}")
-            print(f"HF API result length: {len(result) if isinstance(result, (list, tuple)) else 'N/A'}")
-            
+            result = self._call("/compute_similarity", image1, image2)
+
             # result should be a tuple: (dict, ref_image, user_image, overlay_image)
             if not isinstance(result, (list, tuple)) or len(result) < 4:
                 raise Exception(f"Unexpected HF API response format. Expected tuple with 4 elements, got: {type(result)} with length {len(result) if isinstance(result, (list, tuple)) else 'N/A'}")
-            
+
             result_dict = result[0]
             ref_image_result = result[1]
             user_image_result = result[2]
             overlay_image_result = result[3]
-            
+
             # Gradio returns file paths as strings, load them as PIL Images
             if isinstance(ref_image_result, str):
                 ref_image = Image.open(ref_image_result)
             else:
                 ref_image = ref_image_result
-            
+
             if isinstance(user_image_result, str):
                 user_image = Image.open(user_image_result)
             else:
                 user_image = user_image_result
-            
+
             if isinstance(overlay_image_result, str):
                 overlay_image = Image.open(overlay_image_result)
             else:
                 overlay_image = overlay_image_result
-            
+
             return result_dict['similarity_score'], result_dict['distance'], ref_image, user_image, overlay_image
         except Exception as e:
             raise Exception(f"HF API similarity failed: {str(e)}")
-    
-    def _image_to_bytes(self, img):
-        """Convert PIL Image to bytes"""
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        buf.seek(0)
-        return buf.getvalue()
+
+    def predict_and_compare(self, image, reference_image):
+        """
+        predict(image) and compute_similarity(image, reference_image), run concurrently
+
+        Returns:
+            tuple: (prediction dict, compute_similarity result tuple)
+        """
+        self._ensure_executors()
+        prediction = self._calls.submit(self.predict, image)
+        similarity = self.compute_similarity(image, reference_image)
+        return prediction.result(), similarity
 
 # Singleton instance
 _hf_client = None
@@ -103,7 +286,6 @@ def get_hf_client():
     """Get or create HF client instance"""
     global _hf_client
     if _hf_client is None:
-        import os
         space_url = os.getenv('HUGGINGFACE_SPACE_URL')
         if not space_url:
             raise ValueError("HUGGINGFACE_SPACE_URL environment variable not set")
@@ -1,6 +1,8 @@
 """
 Inference utilities for Ranjana Script classification and similarity
 """
+import io
+
 import numpy as np
 from PIL import Image
 
@@ -23,9 +25,11 @@ class RanjanaInference:
             device: Device to run inference on ('cuda' or 'cpu')
             checkpoint_path: Optional custom checkpoint path
         """
-        from .config import MODELS_DIR
+        from .config import MODELS_DIR, BATCHING_ENABLED, INFERENCE_BACKEND, INFERENCE_QUANTIZED
         from .models import get_model
         from .data_loader import get_transforms
+        from .backends import load_runner, CLASSIFIER
+        from .reference_index import file_sha256
         
         self.device = torch.device(device if torch.cuda.is_available() else 'cpu')
         self.model_name = model_name
@@ -42,17 +46,115 @@ class RanjanaInference:
         self.model.load_state_dict(checkpoint['model_state_dict'])
         self.model = self.model.to(self.device)
         self.model.eval()
+        self.checkpoint_path = str(checkpoint_path)
+        
+        # Execution backend (eager PyTorch, TorchScript or ONNX Runtime)
+        self.backend = INFERENCE_BACKEND
+        self.quantized = INFERENCE_QUANTIZED
+        self._classifier_fn, self.classifier_backend = load_runner(
+            self.backend, CLASSIFIER, self.model, self.checkpoint_path, quantized=self.quantized
+        )
+        # Identifies the classifier weights and backend (e.g. for result caching)
+        self.classifier_version = f'{file_sha256(self.checkpoint_path)[:16]}:{self.classifier_backend}'
+        
+        # Optional micro-batching of concurrent requests
+        self.batching_enabled = BATCHING_ENABLED
+        self._classifier_batcher = self._make_batcher(self._classifier_probs, 'classifier-batcher')
+        self._siamese_batcher = None
+    
+    def _make_batcher(self, forward_fn, name):
+        """Wrap a batched forward function in a MicroBatcher (if enabled)"""
+        if not self.batching_enabled:
+            return None
+        from .batching import MicroBatcher
+        from .config import BATCH_MAX_SIZE, BATCH_WINDOW_MS
+        return MicroBatcher(
+            lambda tensors: list(forward_fn(torch.cat(tensors))),
+            max_batch_size=BATCH_MAX_SIZE,
+            max_wait_ms=BATCH_WINDOW_MS,
+            name=name
+        )
+    
+    def _classifier_probs(self, batch):
+        """Softmax probabilities for a batch tensor of shape (N, 1, H, W)"""
+        with torch.no_grad():
+            outputs = self._classifier_fn(batch.to(self.device))
+            return F.softmax(outputs, dim=1).cpu()
+    
+    def _siamese_embeddings(self, batch):
+        """Siamese embeddings for a batch tensor of shape (N, 1, H, W)"""
+        with torch.no_grad():
+            return self._siamese_fn(batch.to(self.device)).cpu()
+    
+    def _run_batched(self, batcher, forward_fn, tensors):
+        """Run (1, 1, H, W) tensors through the batcher, or as one batch if disabled"""
+        if batcher is None:
+            return forward_fn(torch.cat(tensors))
+        futures = [batcher.submit(tensor) for tensor in tensors]
+        return torch.stack([future.result() for future in futures])
+    
+    def run_classifier(self, tensors):
+        """Classifier probabilities (N, num_classes) for a list of image tensors"""
+        return self._run_batched(self._classifier_batcher, self._classifier_probs, tensors)
+    
+    def run_siamese(self, tensors):
+        """Siamese embeddings (N, embedding_dim) for a list of image tensors"""
+        self.load_siamese_model()
+        return self._run_batched(self._siamese_batcher, self._siamese_embeddings, tensors)
+    
+    def warm_up(self):
+        """
+        Run one dummy forward pass through every loaded model
+        
+        Pays one-time costs (allocator growth, kernel selection, lazy module
+        init) up front instead of on the first request.
+        """
+        from .config import IMAGE_SIZE
+        
+        batch = torch.zeros(1, 1, *IMAGE_SIZE)
+        self._classifier_probs(batch)
+        if hasattr(self, 'siamese_model'):
+            self._siamese_embeddings(batch)
+    
+    def after_fork(self):
+        """
+        Re-create per-process runtime state in a forked worker
+        
+        Weights loaded before fork stay shared copy-on-write. ONNX Runtime
+        sessions are rebuilt because their thread pools do not survive fork;
+        micro-batchers restart their own worker threads.
+        """
+        from .backends import OnnxRunner
+        
+        for runner in (self._classifier_fn, getattr(self, '_siamese_fn', None)):
+            if isinstance(runner, OnnxRunner):
+                runner.reset(num_threads=torch.get_num_threads())
     
-    def preprocess_image(self, image_path, skip_preprocessing=False):
+    @staticmethod
+    def load_image(image):
+        """
+        Open an image given as a path, raw bytes, numpy array or PIL Image
+        
+        Numpy arrays are expected to be grayscale (H, W) or RGB(A) (H, W, C) uint8.
+        """
+        if isinstance(image, Image.Image):
+            return image
+        if isinstance(image, np.ndarray):
+            return Image.fromarray(image)
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return Image.open(io.BytesIO(image))
+        return Image.open(image)
+    
+    def preprocess_image(self, image, skip_preprocessing=False):
         """
         Preprocess image for inference
         
         Args:
-            image_path: Path to image file
+            image: Path to image file, raw bytes, numpy array or PIL Image
             skip_preprocessing: If True, assumes image is already preprocessed
                                (e.g., by views.py preprocess_image) and only applies transforms
         """
-        image = Image.open(image_path)
+        image = self.load_image(image)
         
         # Only do grayscale conversion if not skipping preprocessing
         if not skip_preprocessing:
@@ -72,12 +174,12 @@ class RanjanaInference:
         image_tensor = self.transform(image).unsqueeze(0)
         return image_tensor, image
     
-    def classify(self, image_path: str, top_k: int = 5, skip_preprocessing: bool = False):
+    def classify(self, image, top_k: int = 5, skip_preprocessing: bool = False):
         """
         Classify an image
         
         Args:
-            image_path: Path to image
+            image: Path to image, raw bytes, numpy array or PIL Image
             top_k: Number of top predictions to return
             skip_preprocessing: If True, assumes image is already preprocessed
         
@@ -85,12 +187,8 @@ class RanjanaInference:
             top_classes: Array of top k class indices
             top_probs: Array of top k probabilities
         """
-        image_tensor, _ = self.preprocess_image(image_path, skip_preprocessing)
-        image_tensor = image_tensor.to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(image_tensor)
-            probs = F.softmax(outputs, dim=1)
+        image_tensor, _ = self.preprocess_image(image, skip_preprocessing)
+        probs = self.run_classifier([image_tensor])
         
         # Get top k predictions
         top_probs, top_classes = torch.topk(probs, top_k)
@@ -99,12 +197,12 @@ class RanjanaInference:
         
         return top_classes, top_probs
     
-    def predict(self, image_path: str, top_k: int = 5, skip_preprocessing: bool = False):
+    def predict(self, image, top_k: int = 5, skip_preprocessing: bool = False):
         """
         User-friendly prediction with dict return format
         
         Args:
-            image_path: Path to image
+            image: Path to image, raw bytes, numpy array or PIL Image
             top_k: Number of top predictions
             skip_preprocessing: If True, assumes image is already preprocessed
         
@@ -116,8 +214,45 @@ class RanjanaInference:
                 'top_confidences': list[float]
             }
         """
-        top_classes, top_probs = self.classify(image_path, top_k, skip_preprocessing)
+        top_classes, top_probs = self.classify(image, top_k, skip_preprocessing)
+        return self._format_prediction(top_classes, top_probs)
+    
+    def predict_batch(self, images, top_k: int = 5, skip_preprocessing: bool = False):
+        """
+        Predict several images with a single batched forward pass
+        
+        Args:
+            images: List of images (paths, raw bytes, numpy arrays or PIL Images)
+            top_k: Number of top predictions
+            skip_preprocessing: If True, assumes images are already preprocessed
+        
+        Returns:
+            list[dict]: One prediction dict per image, in input order (see predict)
+        """
+        if not images:
+            return []
+        return self._predictions_from_tensors(self.preprocess_batch(images, skip_preprocessing), top_k)
+    
+    def preprocess_batch(self, images, skip_preprocessing: bool = False):
+        """Preprocess a list of images into a list of (1, 1, H, W) tensors"""
+        return [self.preprocess_image(image, skip_preprocessing)[0] for image in images]
+    
+    def _predictions_from_tensors(self, tensors, top_k: int):
+        """Prediction dicts for preprocessed tensors, from one classifier pass"""
+        return self._predictions_from_probs(self.run_classifier(tensors), top_k)
+    
+    def _predictions_from_probs(self, probs, top_k: int):
+        """Prediction dicts from a (N, num_classes) probability tensor"""
+        top_probs, top_classes = torch.topk(probs, top_k)
+        top_probs = top_probs.cpu().numpy()
+        top_classes = top_classes.cpu().numpy()
         
+        return [self._format_prediction(classes, class_probs)
+                for classes, class_probs in zip(top_classes, top_probs)]
+    
+    @staticmethod
+    def _format_prediction(top_classes, top_probs):
+        """Build the predict() dict from top-k classes and probabilities"""
         return {
             'class': int(top_classes[0]),
             'confidence': float(top_probs[0] * 100),
@@ -125,14 +260,126 @@ class RanjanaInference:
             'top_confidences': (top_probs * 100).tolist()
         }
     
-    def compute_similarity(self, image1_path: str, image2_path: str, 
+    def load_siamese_model(self, siamese_checkpoint: str = None):
+        """
+        Load the Siamese model and its reference embedding index (once)
+        
+        Args:
+            siamese_checkpoint: Path to Siamese model checkpoint
+                               (None = latest checkpoint in MODELS_DIR)
+        """
+        from .config import (
+            MODELS_DIR, REFERENCE_IMAGES_DIR, REFERENCE_GALLERY_DIR, REFERENCE_GALLERY_SCORE, CACHE_DIR,
+            SIMILARITY_THRESHOLD
+        )
+        from .siamese_network import SiameseNetwork
+        from .reference_index import ReferenceEmbeddingIndex, file_sha256
+        from .backends import load_runner, SIAMESE_ENCODER
+        
+        if hasattr(self, 'siamese_model'):
+            return
+        
+        if siamese_checkpoint is None:
+            import glob
+            siamese_runs = sorted(glob.glob(str(MODELS_DIR / "*siamese*efficientnet*.pth")))
+            if not siamese_runs:
+                raise FileNotFoundError("No Siamese model checkpoint found!")
+            siamese_checkpoint = siamese_runs[-1]
+        
+        print(f"Loading Siamese model from: {siamese_checkpoint}")
+        checkpoint = torch.load(siamese_checkpoint, map_location=self.device)
+        
+        # Use default values if not in checkpoint
+        backbone = checkpoint.get('backbone', 'efficientnet_b0')
+        embedding_dim = checkpoint.get('embedding_dim', 128)
+        
+        siamese_model = SiameseNetwork(
+            backbone=backbone,
+            embedding_dim=embedding_dim,
+            pretrained_path=None
+        )
+        siamese_model.load_state_dict(checkpoint['model_state_dict'])
+        siamese_model = siamese_model.to(self.device)
+        siamese_model.eval()
+        
+        self.siamese_checkpoint = str(siamese_checkpoint)
+        self.optimal_threshold = SIMILARITY_THRESHOLD
+        
+        self._siamese_fn, self.siamese_backend = load_runner(
+            self.backend, SIAMESE_ENCODER, siamese_model.forward_once, self.siamese_checkpoint,
+            quantized=self.quantized
+        )
+        self._siamese_batcher = self._make_batcher(self._siamese_embeddings, 'siamese-batcher')
+        reference_key = ReferenceEmbeddingIndex.compute_key(
+            self.siamese_checkpoint, REFERENCE_IMAGES_DIR, self.siamese_backend, REFERENCE_GALLERY_DIR
+        )
+        # Identifies the checkpoint, backend, reference exemplars and their scoring (e.g. for result caching)
+        self.siamese_version = f'{reference_key}-{REFERENCE_GALLERY_SCORE}'
+        # Identifies the encoder alone: embeddings of user images are comparable while it is unchanged
+        self.embedding_version = f'{file_sha256(self.siamese_checkpoint)[:16]}:{self.siamese_backend}'
+        self.siamese_model = siamese_model
+        print(f"✓ Siamese model loaded ({self.siamese_backend})")
+        
+        # Reference exemplars are static: embed them once per checkpoint
+        try:
+            self.reference_index = ReferenceEmbeddingIndex.load_or_build(
+                self.siamese_checkpoint,
+                REFERENCE_IMAGES_DIR,
+                CACHE_DIR,
+                embed_fn=lambda paths: self.embed_batch(paths, skip_preprocessing=True),
+                variant=self.siamese_backend,
+                key=reference_key,
+                gallery_dir=REFERENCE_GALLERY_DIR,
+                reduce=REFERENCE_GALLERY_SCORE
+            )
+            print(
+                f"✓ Reference embeddings ready ({len(self.reference_index)} classes, "
+                f"{self.reference_index.num_exemplars} exemplars)"
+            )
+        except Exception as e:
+            self.reference_index = None
+            print(f"Warning: Could not build reference embeddings: {e}")
+    
+    def embed_batch(self, images, batch_size: int = None, skip_preprocessing: bool = False):
+        """
+        Siamese embeddings of many images, in batched forward_once calls
+        
+        Images are preprocessed one chunk at a time, so memory stays bounded
+        for any number of inputs. Chunks go straight to the encoder rather
+        than through the request micro-batcher.
+        
+        Args:
+            images: List of images (paths, raw bytes, numpy arrays or PIL Images)
+            batch_size: Images per forward pass (None = EMBED_BATCH_SIZE)
+            skip_preprocessing: If True, assumes images are already preprocessed
+        
+        Returns:
+            numpy.ndarray: Contiguous (N, embedding_dim) float32 array, in input order
+        """
+        from .config import EMBED_BATCH_SIZE
+        
+        self.load_siamese_model()
+        batch_size = max(1, int(batch_size or EMBED_BATCH_SIZE))
+        images = list(images)
+        embeddings = np.empty((len(images), self.siamese_model.embedding_dim), dtype=np.float32)
+        for start in range(0, len(images), batch_size):
+            tensors = self.preprocess_batch(images[start:start + batch_size], skip_preprocessing)
+            embeddings[start:start + len(tensors)] = self._siamese_embeddings(torch.cat(tensors)).numpy()
+        return embeddings
+    
+    def _distance_to_similarity(self, distance: float) -> float:
+        """Convert embedding distance to similarity percentage [0, 100]"""
+        max_distance = self.optimal_threshold * 2
+        return max(0, 100 * (1 - distance / max_distance))
+    
+    def compute_similarity(self, image1, image2, 
                           siamese_checkpoint: str = None, skip_preprocessing: bool = False):
         """
         Compute similarity between two images using Siamese Network
         
         Args:
-            image1_path: Path to first image
-            image2_path: Path to second image
+            image1: First image (path, raw bytes, numpy array or PIL Image)
+            image2: Second image (path, raw bytes, numpy array or PIL Image)
             siamese_checkpoint: Path to Siamese model checkpoint
             skip_preprocessing: If True, assumes images are already preprocessed
         
@@ -140,52 +387,213 @@ class RanjanaInference:
             similarity_score: Similarity percentage [0, 100]
             distance: Euclidean distance between embeddings
         """
-        from .config import MODELS_DIR
-        from .siamese_network import SiameseNetwork
-        
         # Load Siamese model if not already loaded
-        if not hasattr(self, 'siamese_model'):
-            if siamese_checkpoint is None:
-                import glob
-                siamese_runs = sorted(glob.glob(str(MODELS_DIR / "*siamese*efficientnet*.pth")))
-                if not siamese_runs:
-                    raise FileNotFoundError("No Siamese model checkpoint found!")
-                siamese_checkpoint = siamese_runs[-1]
-            
-            print(f"Loading Siamese model from: {siamese_checkpoint}")
-            checkpoint = torch.load(siamese_checkpoint, map_location=self.device)
-            
-            # Use default values if not in checkpoint
-            backbone = checkpoint.get('backbone', 'efficientnet_b0')
-            embedding_dim = checkpoint.get('embedding_dim', 128)
-            
-            self.siamese_model = SiameseNetwork(
-                backbone=backbone,
-                embedding_dim=embedding_dim,
-                pretrained_path=None
-            )
-            self.siamese_model.load_state_dict(checkpoint['model_state_dict'])
-            self.siamese_model = self.siamese_model.to(self.device)
-            self.siamese_model.eval()
-            self.optimal_threshold = 0.45
-            print("✓ Siamese model loaded")
+        self.load_siamese_model(siamese_checkpoint)
         
         # Preprocess both images
-        img1_tensor, _ = self.preprocess_image(image1_path, skip_preprocessing)
-        img2_tensor, _ = self.preprocess_image(image2_path, skip_preprocessing)
-        img1_tensor = img1_tensor.to(self.device)
-        img2_tensor = img2_tensor.to(self.device)
+        img1_tensor, _ = self.preprocess_image(image1, skip_preprocessing)
+        img2_tensor, _ = self.preprocess_image(image2, skip_preprocessing)
         
-        # Get embeddings and compute distance
-        with torch.no_grad():
-            emb1, emb2 = self.siamese_model(img1_tensor, img2_tensor)
-            distance = F.pairwise_distance(emb1, emb2).item()
-            
-            # Convert distance to similarity percentage
-            max_distance = self.optimal_threshold * 2
-            similarity_score = max(0, 100 * (1 - distance / max_distance))
+        # Get embeddings (one batched forward_once) and compute distance
+        embeddings = self.run_siamese([img1_tensor, img2_tensor])
+        distance = F.pairwise_distance(embeddings[0:1], embeddings[1:2]).item()
+        
+        return self._distance_to_similarity(distance), distance
+    
+    def compute_similarity_to_class(self, image, target_class: int,
+                                    skip_preprocessing: bool = False):
+        """
+        Compute similarity between an image and a class reference image
+        
+        Uses the precomputed reference embedding, so only the user image
+        goes through the Siamese network.
         
-        return similarity_score, distance
+        Args:
+            image: User image (path, raw bytes, numpy array or PIL Image)
+            target_class: Class whose reference image to compare against
+            skip_preprocessing: If True, assumes image is already preprocessed
+        
+        Returns:
+            similarity_score: Similarity percentage [0, 100]
+            distance: Euclidean distance between embeddings
+        """
+        tensors = self.preprocess_batch([image], skip_preprocessing)
+        return self._similarities_from_tensors(tensors, [target_class])[0]
+    
+    def compute_similarity_to_classes(self, images, target_classes, skip_preprocessing: bool = False):
+        """
+        Batched compute_similarity_to_class: one Siamese pass for all images
+        
+        Args:
+            images: List of user images
+            target_classes: Class to compare each image against (same length as images)
+            skip_preprocessing: If True, assumes images are already preprocessed
+        
+        Returns:
+            list of (similarity_score, distance) tuples, in input order
+        """
+        if not images:
+            return []
+        return self._similarities_from_tensors(self.preprocess_batch(images, skip_preprocessing), target_classes)
+    
+    def score_embeddings(self, embeddings, target_classes):
+        """
+        compute_similarity_to_classes for embeddings from embed_batch
+
+        Args:
+            embeddings: (N, D) float32 array of user image embeddings
+            target_classes: Class to compare each embedding against (length N)
+
+        Returns:
+            list of (similarity_score, distance) tuples, in input order
+        """
+        if not len(embeddings):
+            return []
+        embeddings = torch.from_numpy(np.asarray(embeddings, dtype=np.float32))
+        return self._similarities_from_embeddings(embeddings, target_classes)
+    
+    def rank_classes(self, image, top_k: int = 5, rerank: bool = False, classifier_weight: float = 0.5,
+                     skip_preprocessing: bool = False):
+        """
+        Rank every reference class by similarity to an image
+        
+        The image is embedded once and compared with all reference embeddings
+        in one matrix product. With rerank, the classifier's probabilities
+        for the same preprocessed tensor are blended into the ranking score.
+        
+        Args:
+            image: Path to image, raw bytes, numpy array or PIL Image
+            top_k: Number of classes returned
+            rerank: Blend classifier confidence into the ranking score
+            classifier_weight: Weight of the classifier confidence in [0, 1] when reranking
+            skip_preprocessing: If True, assumes image is already preprocessed
+        
+        Returns:
+            list[dict]: 'class', 'similarity_score', 'distance', 'score' (and
+                        'confidence' when reranking), best first
+        """
+        tensors = self.preprocess_batch([image], skip_preprocessing)
+        self.load_siamese_model()
+        if getattr(self, 'reference_index', None) is None:
+            raise RuntimeError("Reference embeddings are not available")
+        
+        if rerank:
+            probs, embeddings = self._classify_and_embed(tensors)
+        else:
+            probs, embeddings = None, self.run_siamese(tensors)
+        
+        class_ids = self.reference_index.class_ids
+        distances = self.reference_index.distances(embeddings.numpy())[0]
+        # Vectorized _distance_to_similarity
+        similarities = np.maximum(0, 100 * (1 - distances / (self.optimal_threshold * 2)))
+        scores = similarities
+        if probs is not None:
+            confidences = probs[0].numpy()[class_ids] * 100
+            scores = (1 - classifier_weight) * similarities + classifier_weight * confidences
+        
+        ranking = []
+        for row in np.argsort(-scores, kind='stable')[:top_k]:
+            entry = {
+                'class': int(class_ids[row]),
+                'similarity_score': float(similarities[row]),
+                'distance': float(distances[row]),
+                'score': float(scores[row])
+            }
+            if probs is not None:
+                entry['confidence'] = float(confidences[row])
+            ranking.append(entry)
+        return ranking
+    
+    def grade_batch(self, images, target_classes=None, skip_preprocessing: bool = False):
+        """
+        Classify a batch of images and score each against a reference class
+        
+        Each image is compared with its entry in target_classes, or with its
+        predicted class when no target is given (None entry or no list).
+        
+        Returns:
+            list[dict]: predict() dict plus 'compared_with_class',
+                        'similarity_score' and 'distance' per image
+        """
+        if not images:
+            return []
+        tensors = self.preprocess_batch(images, skip_preprocessing)
+        return self._analyze_tensors(tensors, target_classes, top_k=1)
+    
+    def analyze(self, image, target_class: int = None, top_k: int = 1, skip_preprocessing: bool = False):
+        """
+        Classify an image and score it against a reference class in one call
+        
+        The image is decoded and preprocessed once, and the same tensor feeds
+        the classifier and the Siamese encoder.
+        
+        Args:
+            image: Path to image, raw bytes, numpy array or PIL Image
+            target_class: Class to compare against (None = predicted class)
+            top_k: Number of top predictions
+            skip_preprocessing: If True, assumes image is already preprocessed
+        
+        Returns:
+            dict: predict() dict plus 'compared_with_class', 'similarity_score' and 'distance'
+        """
+        tensors = self.preprocess_batch([image], skip_preprocessing)
+        return self._analyze_tensors(tensors, [target_class], top_k)[0]
+    
+    def _analyze_tensors(self, tensors, target_classes, top_k: int):
+        """Predictions plus similarity against target (or predicted) classes"""
+        probs, embeddings = self._classify_and_embed(tensors)
+        predictions = self._predictions_from_probs(probs, top_k)
+        
+        target_classes = list(target_classes or [])
+        compared = [
+            target_classes[i] if i < len(target_classes) and target_classes[i] is not None else prediction['class']
+            for i, prediction in enumerate(predictions)
+        ]
+        similarities = self._similarities_from_embeddings(embeddings, compared)
+        
+        for prediction, target_class, (similarity_score, distance) in zip(predictions, compared, similarities):
+            prediction.update({
+                'compared_with_class': target_class,
+                'similarity_score': similarity_score,
+                'distance': distance
+            })
+        return predictions
+    
+    def _classify_and_embed(self, tensors):
+        """Classifier probabilities and Siamese embeddings for a list of tensors"""
+        self.load_siamese_model()
+        return self.run_classifier(tensors), self.run_siamese(tensors)
+    
+    def _similarities_from_tensors(self, tensors, target_classes):
+        """(similarity_score, distance) of each tensor against its class reference"""
+        return self._similarities_from_embeddings(self.run_siamese(tensors), target_classes)
+    
+    def _similarities_from_embeddings(self, embeddings, target_classes):
+        """(similarity_score, distance) of each embedding against its class reference"""
+        from .config import REFERENCE_IMAGES_DIR
+        
+        self.load_siamese_model()
+        reference_index = getattr(self, 'reference_index', None)
+        
+        # References missing from the index are embedded on the fly
+        missing = sorted({c for c in target_classes if reference_index is None or c not in reference_index})
+        missing_embeddings = {}
+        if missing:
+            reference_tensors = self.preprocess_batch(
+                [str(REFERENCE_IMAGES_DIR / f'class_{c}.png') for c in missing], skip_preprocessing=True
+            )
+            missing_embeddings = dict(zip(missing, self.run_siamese(reference_tensors)))
+        
+        results = []
+        for embedding, target_class in zip(embeddings, target_classes):
+            if target_class in missing_embeddings:
+                distance = F.pairwise_distance(
+                    embedding.unsqueeze(0), missing_embeddings[target_class].unsqueeze(0)
+                ).item()
+            else:
+                distance = reference_index.distance(embedding.numpy(), target_class)
+            results.append((self._distance_to_similarity(distance), distance))
+        return results
     
     def generate_gradcam(self, image_path: str, target_class: int = None, save_path: str = None):
         """
@@ -239,47 +647,17 @@ class RanjanaInference:
         
         return result
     
-    def get_embedding(self, image_path: str, siamese_checkpoint: str = None):
+    def get_embedding(self, image, siamese_checkpoint: str = None, skip_preprocessing: bool = False):
         """
-        Extract 128-dimensional feature embedding
+        Extract the 128-dimensional Siamese embedding of one image
         
         Args:
-            image_path: Path to image
-            siamese_checkpoint: Path to Siamese checkpoint
+            image: Path to image, raw bytes, numpy array or PIL Image
+            siamese_checkpoint: Path to Siamese checkpoint (None = latest in MODELS_DIR)
+            skip_preprocessing: If True, assumes image is already preprocessed
         
         Returns:
             numpy.ndarray: 128-dimensional embedding vector
         """
-        import torch
-        from .config import MODELS_DIR
-        from .siamese_network import SiameseNetwork
-        
-        # Load Siamese model if not already loaded
-        if not hasattr(self, 'siamese_model'):
-            if siamese_checkpoint is None:
-                import glob
-                siamese_runs = sorted(glob.glob(str(MODELS_DIR / "*siamese*efficientnet*.pth")))
-                if not siamese_runs:
-                    raise FileNotFoundError("No Siamese model checkpoint found!")
-                siamese_checkpoint = siamese_runs[-1]
-            
-            self.siamese_model = SiameseNetwork(
-                backbone_name='efficientnet_b0',
-                pretrained=False,
-                num_classes=1,
-                embedding_dim=128
-            )
-            
-            checkpoint = torch.load(siamese_checkpoint, map_location=self.device)
-            self.siamese_model.load_state_dict(checkpoint['model_state_dict'])
-            self.siamese_model.to(self.device)
-            self.siamese_model.eval()
-        
-        # Extract embedding
-        image = Image.open(image_path).convert('L')
-        input_tensor = self.transform(image).unsqueeze(0).to(self.device)
-        
-        with torch.no_grad():
-            embedding = self.siamese_model.forward_once(input_tensor)
-        
-        return embedding.cpu().numpy().flatten()
+        self.load_siamese_model(siamese_checkpoint)
+        return self.embed_batch([image], skip_preprocessing=skip_preprocessing)[0]
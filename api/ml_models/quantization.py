@@ -0,0 +1,117 @@
+"""
+Int8 quantization of the exported ONNX models, with an accuracy gate
+
+Quantized models are only activated (INFERENCE_QUANTIZED=True) when the gate
+recorded in the export manifest approved them for the current checkpoint.
+"""
+import warnings
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from .backends import OnnxRunner
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def quantize_onnx(source_path, target_path):
+    """
+    Dynamically quantize an ONNX model's weights to int8
+
+    Conv and MatMul/Gemm weights are stored as int8; activations are
+    quantized on the fly, so no calibration data is needed.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source_path, target_path = Path(source_path), Path(target_path)
+    prepared_path = source_path.with_suffix('.prep.onnx')
+    try:
+        # Shape inference + graph cleanup improves quantization coverage
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        quant_pre_process(str(source_path), str(prepared_path))
+        model_input = prepared_path
+    except Exception as e:
+        warnings.warn(f"ONNX pre-processing skipped, quantizing the unprepared model: {e}", RuntimeWarning)
+        model_input = source_path
+
+    try:
+        quantize_dynamic(str(model_input), str(target_path), weight_type=QuantType.QInt8)
+    finally:
+        if prepared_path.exists():
+            prepared_path.unlink()
+
+
+def list_images(directory):
+    """Image files in a directory tree, sorted"""
+    return sorted(p for p in Path(directory).rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def _run_in_chunks(runner, batch, chunk_size: int = 64):
+    return torch.cat([runner(batch[i:i + chunk_size]) for i in range(0, len(batch), chunk_size)])
+
+
+def compare_classifiers(reference_fn, candidate_fn, batch):
+    """
+    Top-1 agreement between two classifiers on a batch of image tensors
+
+    Returns:
+        dict: {'samples', 'top1_agreement', 'max_prob_drift'}
+    """
+    with torch.no_grad():
+        expected = torch.softmax(_run_in_chunks(reference_fn, batch), dim=1)
+        actual = torch.softmax(_run_in_chunks(candidate_fn, batch), dim=1)
+    agreement = (expected.argmax(dim=1) == actual.argmax(dim=1)).float().mean().item()
+    return {
+        'samples': len(batch),
+        'top1_agreement': agreement,
+        'max_prob_drift': (expected - actual).abs().max().item(),
+    }
+
+
+def compare_encoders(reference_fn, candidate_fn, batch):
+    """
+    Embedding drift between two encoders on a batch of image tensors
+
+    Returns:
+        dict: {'samples', 'mean_embedding_drift', 'max_embedding_drift'}
+              (Euclidean distance between the two embeddings of each image)
+    """
+    with torch.no_grad():
+        expected = _run_in_chunks(reference_fn, batch)
+        actual = _run_in_chunks(candidate_fn, batch)
+    drift = torch.linalg.norm(expected - actual, dim=1).numpy()
+    return {
+        'samples': len(batch),
+        'mean_embedding_drift': float(np.mean(drift)),
+        'max_embedding_drift': float(np.max(drift)),
+    }
+
+
+def evaluate_int8(inference, classifier_int8_path, encoder_int8_path, images,
+                  min_agreement: float = 0.99, max_drift: float = 0.05):
+    """
+    Gate int8 models against the fp32 eager models
+
+    Args:
+        inference: RanjanaInference with the Siamese model loaded
+        classifier_int8_path: Quantized classifier ONNX file
+        encoder_int8_path: Quantized Siamese encoder ONNX file
+        images: List of (image path or array, skip_preprocessing) to evaluate on
+        min_agreement: Minimum top-1 agreement for the classifier
+        max_drift: Maximum per-image embedding distance for the encoder
+
+    Returns:
+        dict: {'classifier': {...metrics, 'approved'}, 'siamese_encoder': {...metrics, 'approved'}}
+    """
+    batch = torch.cat([inference.preprocess_image(image, skip)[0] for image, skip in images])
+
+    classifier = compare_classifiers(inference.model, OnnxRunner(classifier_int8_path), batch)
+    classifier['approved'] = classifier['top1_agreement'] >= min_agreement
+    classifier['min_agreement'] = min_agreement
+
+    encoder = compare_encoders(inference.siamese_model.forward_once, OnnxRunner(encoder_int8_path), batch)
+    encoder['approved'] = encoder['max_embedding_drift'] <= max_drift
+    encoder['max_drift'] = max_drift
+
+    return {'classifier': classifier, 'siamese_encoder': encoder}
@@ -0,0 +1,271 @@
+"""
+Precomputed Siamese embeddings for the static reference images
+
+The reference images never change between requests, so their embeddings are
+computed once per Siamese checkpoint and persisted next to the weights.
+
+A class can have several reference exemplars: its class_{n}.png plus any
+images in the gallery directory's class_{n}/ folder. All exemplar embeddings
+are stored in one contiguous float32 matrix, grouped by class, with an offset
+array giving each class's rows; a class is scored by the minimum or mean
+distance to its exemplars.
+"""
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+
+def file_sha256(path, chunk_size: int = 1 << 20) -> str:
+    """Return the hex SHA-256 digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Exemplar files picked up from the gallery directory
+GALLERY_SUFFIXES = ('.png', '.jpg', '.jpeg')
+
+# Distance reductions over a class's exemplars
+REDUCTIONS = ('min', 'mean')
+
+
+def _class_id(name):
+    try:
+        return int(name.split('_', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def list_reference_images(reference_dir, gallery_dir=None):
+    """
+    List reference exemplars as (class_id, path) pairs sorted by class id
+
+    Args:
+        reference_dir: Directory containing class_{n}.png files
+        gallery_dir: Optional directory of class_{n}/ folders with extra exemplars
+    """
+    images = []
+    for path in Path(reference_dir).glob('class_*.png'):
+        class_id = _class_id(path.stem)
+        if class_id is not None:
+            images.append((class_id, path))
+    if gallery_dir is not None and Path(gallery_dir).is_dir():
+        for folder in Path(gallery_dir).glob('class_*'):
+            class_id = _class_id(folder.name)
+            if class_id is None or not folder.is_dir():
+                continue
+            images.extend(
+                (class_id, path) for path in folder.iterdir()
+                if path.is_file() and path.suffix.lower() in GALLERY_SUFFIXES
+            )
+    return sorted(images)
+
+
+class ReferenceEmbeddingIndex:
+    """
+    Store of reference embeddings, one or more exemplar rows per class
+    """
+
+    def __init__(self, class_ids, embeddings, key: str = None, offsets=None, reduce: str = 'min', names=None):
+        """
+        Args:
+            class_ids: Sequence of distinct class ids
+            embeddings: Array of shape (num_exemplars, embedding_dim), grouped by class
+            key: Cache key the index was built for
+            offsets: Rows of class i are offsets[i]:offsets[i + 1] (None = one row per class)
+            reduce: How exemplar distances combine into a class distance ('min' or 'mean')
+            names: Optional exemplar file names, aligned with embeddings rows
+        """
+        if reduce not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction {reduce!r}, expected one of {REDUCTIONS}")
+        self.class_ids = np.asarray(class_ids, dtype=np.int64)
+        # A C-contiguous float32 memmap is used as is, without a copy
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.offsets = np.arange(len(self.class_ids) + 1) if offsets is None else np.asarray(offsets, dtype=np.int64)
+        self.key = key
+        self.reduce = reduce
+        self.names = None if names is None else np.asarray(names, dtype=str)
+        self._rows = {int(c): i for i, c in enumerate(self.class_ids)}
+        self._counts = np.diff(self.offsets)
+        # Per-row terms of the expanded squared distance (see distances)
+        self._sq_norms = np.einsum('ij,ij->i', self.embeddings, self.embeddings)
+        self._sums = self.embeddings.sum(axis=1)
+
+    @classmethod
+    def from_rows(cls, row_class_ids, embeddings, names=None, **kwargs):
+        """Build an index from per-row class ids (and exemplar names), in any order"""
+        row_class_ids = np.asarray(row_class_ids, dtype=np.int64)
+        order = np.argsort(row_class_ids, kind='stable')
+        class_ids, starts = np.unique(row_class_ids[order], return_index=True)
+        offsets = np.append(starts, len(order))
+        names = None if names is None else np.asarray(names, dtype=str)[order]
+        return cls(class_ids, np.asarray(embeddings)[order], offsets=offsets, names=names, **kwargs)
+
+    def __contains__(self, class_id):
+        return int(class_id) in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def num_exemplars(self) -> int:
+        return len(self.embeddings)
+
+    def get(self, class_id: int) -> np.ndarray:
+        """Return the exemplar embeddings of a class, shape (count, embedding_dim)"""
+        row = self._rows[int(class_id)]
+        return self.embeddings[self.offsets[row]:self.offsets[row + 1]]
+
+    def distance(self, embedding, class_id: int) -> float:
+        """
+        Euclidean distance between an embedding and a reference class
+
+        Matches torch.nn.functional.pairwise_distance (eps=1e-6), which the
+        pairwise Siamese path uses, reduced over the class's exemplars.
+        """
+        diff = np.asarray(embedding, dtype=np.float32).reshape(1, -1) - self.get(class_id) + 1e-6
+        exemplar_distances = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        return float(exemplar_distances.min() if self.reduce == 'min' else exemplar_distances.mean())
+
+    def distances(self, embeddings) -> np.ndarray:
+        """
+        Distances from each embedding to every reference class, shape (N, num_classes)
+
+        One matrix product against all stacked exemplars, using
+        |e - r + eps|^2 = |e|^2 + |r|^2 - 2 e.r + 2 eps (sum(e) - sum(r)) + D eps^2
+        so the values match distance(), then one reduction per class.
+        """
+        eps = 1e-6
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        squared = (
+            np.einsum('ij,ij->i', embeddings, embeddings)[:, None] + self._sq_norms[None, :]
+            - 2 * (embeddings @ self.embeddings.T)
+            + 2 * eps * (embeddings.sum(axis=1)[:, None] - self._sums[None, :])
+            + embeddings.shape[1] * eps * eps
+        )
+        squared = np.maximum(squared, 0)
+        if len(self.embeddings) == len(self.class_ids):
+            return np.sqrt(squared)
+        if self.reduce == 'min':
+            # sqrt is monotonic: reduce first, then take the root of (N, num_classes) values only
+            return np.sqrt(np.minimum.reduceat(squared, self.offsets[:-1], axis=1))
+        return np.add.reduceat(np.sqrt(squared), self.offsets[:-1], axis=1) / self._counts
+
+    def nearest_exemplar(self, embedding, class_id: int = None):
+        """
+        The single exemplar closest to an embedding, over all classes or within one
+
+        Returns:
+            tuple: (class_id, exemplar name or None, distance)
+        """
+        start, end = 0, len(self.embeddings)
+        if class_id is not None:
+            row = self._rows[int(class_id)]
+            start, end = self.offsets[row], self.offsets[row + 1]
+        diff = np.asarray(embedding, dtype=np.float32).reshape(1, -1) - self.embeddings[start:end] + 1e-6
+        best = start + int(np.argmin(np.einsum('ij,ij->i', diff, diff)))
+        owner = int(np.searchsorted(self.offsets, best, side='right')) - 1
+        name = str(self.names[best]) if self.names is not None else None
+        return int(self.class_ids[owner]), name, float(np.linalg.norm(diff[best - start]))
+
+    @staticmethod
+    def compute_key(siamese_checkpoint, reference_dir, variant: str = '', gallery_dir=None) -> str:
+        """
+        Cache key for a checkpoint and a set of reference images
+
+        Any change to the checkpoint, to a reference image or exemplar or to
+        the model variant (e.g. an int8 backend) yields a new key.
+        """
+        digest = hashlib.sha256(file_sha256(siamese_checkpoint).encode())
+        digest.update(variant.encode())
+        for class_id, path in list_reference_images(reference_dir, gallery_dir):
+            digest.update(f'{class_id}:{file_sha256(path)}'.encode())
+        return digest.hexdigest()[:16]
+
+    @staticmethod
+    def cache_paths(cache_dir, key):
+        """(embeddings .npy, class offsets .npz) paths of a persisted index"""
+        cache_dir = Path(cache_dir)
+        return cache_dir / f'reference_embeddings_{key}.npy', cache_dir / f'reference_embeddings_{key}.npz'
+
+    @classmethod
+    def load(cls, embeddings_path, index_path, reduce: str = 'min'):
+        """
+        Load a persisted index
+
+        The embeddings are memory-mapped, so worker processes share one copy
+        through the page cache.
+        """
+        embeddings = np.load(embeddings_path, mmap_mode='r')
+        with np.load(index_path) as data:
+            return cls(
+                data['class_ids'], embeddings, key=str(data['key']), offsets=data['offsets'], reduce=reduce,
+                names=data['names'] if 'names' in data.files else None
+            )
+
+    def save(self, embeddings_path, index_path):
+        """Persist the embeddings to an .npy file and the class offsets to an .npz file"""
+        embeddings_path, index_path = Path(embeddings_path), Path(index_path)
+        embeddings_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = embeddings_path.with_suffix('.tmp.npy')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.embeddings)
+        tmp_path.replace(embeddings_path)
+        # Written last: the index file marks the embeddings as complete
+        tmp_path = index_path.with_suffix('.tmp.npz')
+        extra = {} if self.names is None else {'names': self.names}
+        np.savez(tmp_path, class_ids=self.class_ids, offsets=self.offsets, key=np.array(self.key), **extra)
+        tmp_path.replace(index_path)
+
+    @classmethod
+    def load_or_build(cls, siamese_checkpoint, reference_dir, cache_dir, embed_fn, variant: str = '', key: str = None,
+                      gallery_dir=None, reduce: str = 'min'):
+        """
+        Load the index from disk, or build and persist it
+
+        Args:
+            siamese_checkpoint: Path to the Siamese checkpoint the embeddings belong to
+            reference_dir: Directory containing class_{n}.png files
+            cache_dir: Directory where the index is persisted
+            embed_fn: Callable mapping a list of image paths to an (N, D) array (in bounded batches)
+            variant: Extra cache key component for the model variant producing embeddings
+            key: Precomputed compute_key() result, to avoid hashing the files twice
+            gallery_dir: Optional directory of class_{n}/ folders with extra exemplars
+            reduce: How exemplar distances combine into a class distance ('min' or 'mean')
+
+        Returns:
+            ReferenceEmbeddingIndex
+        """
+        key = key or cls.compute_key(siamese_checkpoint, reference_dir, variant, gallery_dir)
+        embeddings_path, index_path = cls.cache_paths(cache_dir, key)
+
+        if embeddings_path.exists() and index_path.exists():
+            try:
+                index = cls.load(embeddings_path, index_path, reduce=reduce)
+                # Indexes saved without exemplar names are rebuilt
+                if index.key == key and index.names is not None:
+                    return index
+            except Exception as e:
+                print(f"Warning: Could not read reference embeddings {embeddings_path}: {e}")
+
+        references = list_reference_images(reference_dir, gallery_dir)
+        if not references:
+            raise FileNotFoundError(f"No reference images found in {reference_dir}")
+
+        embeddings = embed_fn([str(path) for _, path in references])
+        # Gallery exemplars are named class_{n}/<file>, reference images by their file name
+        names = [path.name if path.parent == Path(reference_dir) else f'{path.parent.name}/{path.name}'
+                 for _, path in references]
+        index = cls.from_rows(
+            [class_id for class_id, _ in references], embeddings, names=names, key=key, reduce=reduce
+        )
+
+        try:
+            index.save(embeddings_path, index_path)
+        except OSError as e:
+            print(f"Warning: Could not persist reference embeddings to {embeddings_path}: {e}")
+
+        return index
@@ -0,0 +1,389 @@
+"""
+Per-request choice between local models and the HuggingFace Space
+
+In 'hybrid' mode requests stay local until local inference backs up (too
+many requests in flight in this process), then spill to the Space when it is
+expected to answer sooner. A circuit breaker keeps requests off the Space
+after repeated failures, failed remote calls fall back to the local models
+(only failures of the Space itself count: transport errors, timeouts and
+5xx responses, not a rejected input),
+and a sample of requests is re-run on the other backend in the background
+to check that the two agree.
+"""
+import os
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import (
+    INFERENCE_ROUTING, ROUTER_SPILL_DEPTH, ROUTER_WINDOW,
+    ROUTER_BREAKER_FAILURES, ROUTER_BREAKER_COOLDOWN, ROUTER_SHADOW_RATE
+)
+
+LOCAL = 'local'
+REMOTE = 'remote'
+ROUTING_MODES = (LOCAL, REMOTE, 'hybrid')
+
+# Response header naming the backend that served the request
+BACKEND_HEADER = 'X-Inference-Backend'
+
+
+class BackendUnavailable(RuntimeError):
+    """The chosen backend could not be created"""
+
+
+def is_backend_failure(error) -> bool:
+    """
+    Whether an exception means the backend itself failed (unavailable,
+    transport error, timeout or 5xx response), rather than rejecting the
+    request's input (e.g. a gradio AppError for an unreadable image)
+
+    The HF client wraps errors in plain Exceptions, so the whole chain of
+    causes is checked.
+    """
+    try:
+        import httpx
+        transport_errors = (httpx.TransportError,)
+        status_errors = (httpx.HTTPStatusError,)
+    except ImportError:
+        transport_errors = status_errors = ()
+
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (BackendUnavailable, TimeoutError, ConnectionError) + transport_errors):
+            return True
+        if isinstance(error, status_errors) and error.response.status_code >= 500:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class RollingStats:
+    """Latency and outcome of the last `window` calls to one backend"""
+
+    def __init__(self, window: int = 50):
+        self._calls = deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._calls.append((latency, ok))
+
+    def latency(self):
+        """Median latency of recent successful calls in seconds, or None without data"""
+        with self._lock:
+            latencies = [latency for latency, ok in self._calls if ok]
+        return statistics.median(latencies) if latencies else None
+
+    def error_rate(self) -> float:
+        with self._lock:
+            calls = list(self._calls)
+        return sum(1 for _, ok in calls if not ok) / len(calls) if calls else 0.0
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing backend
+
+    Opens after `failures` consecutive failures. After `cooldown` seconds one
+    trial call is let through: success closes the circuit, failure reopens it,
+    and a trial that ends without an outcome is released for the next caller.
+    """
+
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self._consecutive = 0
+        self._opened_at = None
+        # Thread holding the half-open trial call, if any
+        self._trial = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Whether a call may go through now (claims the trial call when half-open)"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and self._trial is None:
+                self._trial = threading.get_ident()
+                return True
+            return False
+
+    def release(self):
+        """Give back the trial call claimed by this thread if it recorded no outcome"""
+        with self._lock:
+            if self._trial == threading.get_ident():
+                self._trial = None
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial = None
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._trial is not None or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+            self._trial = None
+
+
+class Route:
+    """The backend chosen for one request and the model client to use"""
+
+    def __init__(self, router, backend, model):
+        self.router = router
+        self.backend = backend
+        self.model = model
+
+    @property
+    def remote(self) -> bool:
+        return self.backend == REMOTE
+
+    def timed(self, compute):
+        """Wrap a model call so its latency and outcome feed the router's statistics"""
+        def timed_compute():
+            start = time.monotonic()
+            try:
+                result = compute()
+            except Exception as e:
+                if self.remote and not is_backend_failure(e):
+                    # The Space answered, but rejected this request
+                    self.router.breaker.record_success()
+                else:
+                    self.router.record(self.backend, time.monotonic() - start, ok=False)
+                raise
+            self.router.record(self.backend, time.monotonic() - start, ok=True)
+            return result
+        return timed_compute
+
+
+class InferenceRouter:
+    def __init__(self, mode=INFERENCE_ROUTING, local_factory=None, remote_factory=None,
+                 spill_depth=ROUTER_SPILL_DEPTH, window=ROUTER_WINDOW,
+                 breaker_failures=ROUTER_BREAKER_FAILURES, breaker_cooldown=ROUTER_BREAKER_COOLDOWN,
+                 shadow_rate=ROUTER_SHADOW_RATE):
+        """
+        Args:
+            mode: 'local', 'remote' or 'hybrid'
+            local_factory: Callable returning the local RanjanaInference
+            remote_factory: Callable returning the HuggingFaceMLClient
+            spill_depth: In-flight local requests from which requests may spill to the Space
+            window: Calls per backend kept for latency and error rates
+            breaker_failures: Consecutive remote failures that open the circuit
+            breaker_cooldown: Seconds the circuit stays open before a trial call
+            shadow_rate: Fraction of requests re-run on the other backend for comparison
+        """
+        if mode not in ROUTING_MODES:
+            raise ValueError(f"Unknown inference routing mode: {mode} (expected one of {', '.join(ROUTING_MODES)})")
+        self.mode = mode
+        self.spill_depth = spill_depth
+        self.shadow_rate = shadow_rate
+        self.breaker = CircuitBreaker(breaker_failures, breaker_cooldown)
+        self.stats = {LOCAL: RollingStats(window), REMOTE: RollingStats(window)}
+
+        self._factories = {LOCAL: local_factory or _load_local, REMOTE: remote_factory or _load_remote}
+        self._models = {}
+        self._unavailable = set()
+        self._lock = threading.Lock()
+        self._local_inflight = 0
+        self._shadow_pid = None
+        self._shadow_executor = None
+        self.shadow_compared = 0
+        self.shadow_agreed = 0
+
+    def _uses(self, backend) -> bool:
+        return self.mode in (backend, 'hybrid')
+
+    def model(self, backend):
+        """The model client for a backend, or None if it is not used or could not be created"""
+        if not self._uses(backend) or backend in self._unavailable:
+            return None
+        model = self._models.get(backend)
+        if model is None:
+            try:
+                model = self._factories[backend]()
+            except Exception as e:
+                if self.mode != 'hybrid':
+                    raise
+                print(f"Warning: {backend} inference unavailable: {e}")
+                if backend == LOCAL:
+                    # Missing weights won't appear later
+                    self._unavailable.add(backend)
+                else:
+                    self.breaker.record_failure()
+                return None
+            self._models[backend] = model
+        return model
+
+    @property
+    def has_local(self) -> bool:
+        return self.model(LOCAL) is not None
+
+    def record(self, backend, latency: float, ok: bool):
+        """Record one model call (see Route.timed)"""
+        self.stats[backend].record(latency, ok)
+        if backend == REMOTE:
+            if ok:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def choose(self) -> str:
+        """Backend for the next request"""
+        if self.mode != 'hybrid':
+            return self.mode
+        if not self._local_usable():
+            return REMOTE if self._remote_usable() else LOCAL
+
+        depth = self._local_inflight
+        if depth < self.spill_depth:
+            return LOCAL
+        # Local is backed up: spill unless the Space is expected to be slower
+        # than waiting for the local queue (no data yet counts as faster)
+        local_latency = self.stats[LOCAL].latency()
+        remote_latency = self.stats[REMOTE].latency()
+        if None not in (local_latency, remote_latency) and remote_latency >= local_latency * (depth + 1):
+            return LOCAL
+        return REMOTE if self._remote_usable() else LOCAL
+
+    def _local_usable(self) -> bool:
+        # A local backend that keeps failing is as good as missing
+        return self.model(LOCAL) is not None and not (
+            len(self.stats[LOCAL]) >= 5 and self.stats[LOCAL].error_rate() > 0.5
+        )
+
+    def _remote_usable(self) -> bool:
+        return self.breaker.allow() and self.model(REMOTE) is not None
+
+    def run(self, infer, agree=None, remote_ok=True):
+        """
+        Run `infer(route)` on the chosen backend
+
+        Args:
+            infer: Callable taking a Route and returning the request's result;
+                   it must not have side effects beyond the result cache, since
+                   it may also run on the other backend (failover, shadowing)
+            agree: Callable comparing two results of `infer` (primary, shadow);
+                   None disables shadowing for this request
+            remote_ok: False for requests only the local models can serve
+
+        Returns:
+            (result, route): route.backend is the backend that produced the result
+        """
+        backend = self.choose() if remote_ok else LOCAL
+        try:
+            result, route = self._run_on(backend, infer)
+        except Exception as e:
+            # Failover: a remote call the Space failed is retried locally
+            # (a rejected input would only be rejected again)
+            if backend != REMOTE or self.mode != 'hybrid' or not is_backend_failure(e) or not self._local_usable():
+                raise
+            result, route = self._run_on(LOCAL, infer)
+
+        if agree is not None and remote_ok and self.mode == 'hybrid' and random.random() < self.shadow_rate:
+            self._shadow(infer, agree, route.backend, result)
+        return result, route
+
+    def _run_on(self, backend, infer):
+        model = self.model(backend)
+        if model is None:
+            raise BackendUnavailable(f"{backend.capitalize()} inference is not available")
+        route = Route(self, backend, model)
+        if backend != LOCAL:
+            try:
+                return infer(route), route
+            finally:
+                # Calls that never reach the Space (result cache hits, errors
+                # before Route.timed) record no outcome for a trial call
+                self.breaker.release()
+        with self._lock:
+            self._local_inflight += 1
+        try:
+            return infer(route), route
+        finally:
+            with self._lock:
+                self._local_inflight -= 1
+
+    def _shadow(self, infer, agree, primary_backend, primary_result):
+        """Re-run a request on the other backend in the background and compare the results"""
+        other = LOCAL if primary_backend == REMOTE else REMOTE
+        if other == REMOTE and self.breaker.state != 'closed':
+            return
+
+        def compare():
+            try:
+                shadow_result, _ = self._run_on(other, infer)
+                agreed = bool(agree(primary_result, shadow_result))
+            except Exception as e:
+                print(f"Warning: Shadow {other} inference failed: {e}")
+                return
+            with self._lock:
+                self.shadow_compared += 1
+                self.shadow_agreed += agreed
+            if not agreed:
+                print(f"Warning: {primary_backend} and {other} inference disagree")
+
+        pid = os.getpid()
+        with self._lock:
+            if self._shadow_pid != pid:
+                # Threads do not survive fork: one shadow thread per process
+                self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow-inference')
+                self._shadow_pid = pid
+            executor = self._shadow_executor
+        executor.submit(compare)
+
+    def summary(self) -> dict:
+        """Current routing statistics"""
+        return {
+            'mode': self.mode,
+            'local_inflight': self._local_inflight,
+            'breaker': self.breaker.state,
+            **{
+                f'{backend}_latency': stats.latency() for backend, stats in self.stats.items()
+            },
+            **{
+                f'{backend}_error_rate': stats.error_rate() for backend, stats in self.stats.items()
+            },
+            'shadow_compared': self.shadow_compared,
+            'shadow_agreement': self.shadow_agreed / self.shadow_compared if self.shadow_compared else None,
+        }
+
+
+def _load_local():
+    from . import get_classification_model
+    return get_classification_model()
+
+
+def _load_remote():
+    from .hf_client import get_hf_client
+    return get_hf_client()
+
+
+# Singleton instance
+_router = None
+
+
+def get_router():
+    """Get or create the inference router"""
+    global _router
+    if _router is None:
+        _router = InferenceRouter()
+    return _router
@@ -1,18 +1,23 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class PredictionHistory(models.Model):
     """Stores prediction history for each user"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='predictions')
+    # Indexed by the composite indexes below, which all lead with user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='predictions', db_index=False)
     image = models.ImageField(upload_to='predictions/%Y/%m/%d/')
     predicted_class = models.IntegerField()
     confidence = models.FloatField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: rows inserted by the write-behind stage keep their request time
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = 'Prediction Histories'
+        # History pages: one range scan per keyset page (see api/pagination.py)
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='predictionhist_user_created')]
     
     def __str__(self):
         return f"{self.user.username} - Class {self.predicted_class} ({self.created_at})"
@@ -20,7 +25,8 @@ class PredictionHistory(models.Model):
 
 class SimilarityHistory(models.Model):
     """Stores similarity comparison history"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='similarities')
+    # Indexed by the composite indexes below, which all lead with user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='similarities', db_index=False)
     prediction = models.ForeignKey(PredictionHistory, on_delete=models.CASCADE, null=True, blank=True)
     user_image = models.ImageField(upload_to='similarity/%Y/%m/%d/')
     reference_image = models.ImageField(upload_to='references/%Y/%m/%d/', null=True, blank=True)
@@ -30,11 +36,106 @@ class SimilarityHistory(models.Model):
     is_same_character = models.BooleanField()
     blended_overlay = models.ImageField(upload_to='blended/%Y/%m/%d/', null=True, blank=True)
     feedback = models.TextField(null=True, blank=True)
+    # float16 Siamese embedding of user_image and the encoder that produced it (see api/embeddings.py)
+    embedding = models.BinaryField(null=True, blank=True)
+    embedding_version = models.CharField(max_length=40, null=True, blank=True)
+    # When the embedding was written, so searches find entries embedded after a snapshot
+    embedded_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = 'Similarity Histories'
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='similarityhist_user_created'),
+            # History filtered by character; statistics rollup refreshes
+            models.Index(fields=['user', 'target_class', '-created_at', '-id'], name='similarityhist_user_class'),
+            # History filtered to matches only (a fraction of the rows)
+            models.Index(
+                fields=['user', '-created_at', '-id'], condition=models.Q(is_same_character=True),
+                name='similarityhist_user_matched'
+            ),
+            # Entries embedded after the submission snapshot was built
+            models.Index(fields=['user', 'embedded_at'], name='similarityhist_user_embedded'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - Class {self.target_class} ({self.similarity_score:.2f}%)"
+
+
+class FeedbackJob(models.Model):
+    """Queued AI feedback request, processed by `manage.py run_feedback_worker`"""
+    WAITING = 'waiting'
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        # Images not written yet (see api/write_behind.py)
+        (WAITING, 'Waiting for images'),
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feedback_jobs')
+    similarity = models.OneToOneField(SimilarityHistory, on_delete=models.CASCADE, related_name='feedback_job')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    feedback = models.TextField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Feedback cache: target class (+ model version) and int8 Siamese embedding of the user image
+    cache_key = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    embedding = models.BinaryField(null=True, blank=True)
+    cache_hit = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'], name='feedbackjob_status_created')]
+    
+    def __str__(self):
+        return f"{self.user.username} - Feedback job {self.id} ({self.status})"
+
+
+class StatsRollup(models.Model):
+    """Running totals over a user's SimilarityHistory entries (maintained by api/stats.py)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    target_class = models.IntegerField()
+    count = models.PositiveIntegerField(default=0)
+    score_sum = models.FloatField(default=0)
+    best_score = models.FloatField(default=0)
+    matches = models.PositiveIntegerField(default=0)
+    # Score bands, as in the statistics endpoint: >= 90, 75-90 (the rest need practice)
+    high_scores = models.PositiveIntegerField(default=0)
+    good_scores = models.PositiveIntegerField(default=0)
+    last_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        abstract = True
+
+
+class UserClassStats(StatsRollup):
+    """All-time statistics of one user for one character"""
+    
+    class Meta:
+        verbose_name_plural = 'User Class Stats'
+        constraints = [models.UniqueConstraint(fields=['user', 'target_class'], name='userclassstats_user_class')]
+    
+    def __str__(self):
+        return f"{self.user.username} - Class {self.target_class} ({self.count} analyses)"
+
+
+class UserDailyStats(StatsRollup):
+    """Statistics of one user for one character on one (UTC) day"""
+    day = models.DateField()
+    
+    class Meta:
+        verbose_name_plural = 'User Daily Stats'
+        constraints = [models.UniqueConstraint(fields=['user', 'day', 'target_class'], name='userdailystats_user_day_class')]
+    
+    def __str__(self):
+        return f"{self.user.username} - Class {self.target_class} on {self.day} ({self.count} analyses)"
@@ -0,0 +1,75 @@
+"""
+Keyset (seek) pagination for the history endpoints
+
+Pages are ordered newest first by (created_at, id) and the cursor holds the
+last row's values, so each page is one range scan of the (user, created_at,
+id) index however deep the client scrolls, and rows inserted meanwhile don't
+shift later pages.
+"""
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 50)
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        One page of `queryset`, newest first
+
+        Raises:
+            ValueError: if the cursor or limit query parameter is invalid
+        """
+        self.request = request
+        limit = self.get_page_size(request)
+        queryset = queryset.order_by('-created_at', '-id')
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+        # One extra row tells whether there is a next page
+        rows = list(queryset[:limit + 1])
+        self.has_next = len(rows) > limit
+        rows = rows[:limit]
+        self.next_cursor = self.encode_cursor(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_page_size(self, request):
+        limit = request.query_params.get(self.page_size_query_param)
+        if limit is None:
+            return self.page_size
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError(f'Invalid limit: {limit}')
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+        return min(limit, self.max_page_size)
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    @staticmethod
+    def encode_cursor(row):
+        position = f'{row.created_at.isoformat()}|{row.id}'
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.fromisoformat(created_at), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError('Invalid cursor')
@@ -0,0 +1,69 @@
+"""
+Content-addressed cache of model results
+
+Results are keyed on a hash of the image the model actually sees (the
+preprocessed 64x64 for local models, the uploaded bytes for the HF Space),
+the version of the model that produced them and any request parameters, so
+resubmitting the same drawing skips the model entirely. Entries live in the
+'inference' cache (see CACHES in settings), which evicts by TTL and LRU.
+"""
+import hashlib
+
+import numpy as np
+from django.core.cache import caches
+
+CACHE_ALIAS = 'inference'
+
+# Response header reporting whether the result came from the cache
+CACHE_HEADER = 'X-Cache'
+
+
+def image_digest(image) -> str:
+    """SHA-256 of an image given as a numpy array or raw bytes"""
+    digest = hashlib.sha256()
+    if isinstance(image, np.ndarray):
+        image = np.ascontiguousarray(image)
+        digest.update(f'{image.dtype}{image.shape}'.encode())
+        digest.update(image.data)
+    else:
+        digest.update(bytes(image))
+    return digest.hexdigest()
+
+
+def model_version(model, component: str):
+    """
+    Version of a model component ('classifier' or 'siamese'), or None if unknown
+
+    Results are only cached when the producing model can be identified.
+    """
+    return getattr(model, f'{component}_version', None)
+
+
+def cached_result(kind: str, version, digest: str, compute, *params):
+    """
+    Return a cached result, or compute and cache it
+
+    Args:
+        kind: Result type, e.g. 'predict' or 'similarity'
+        version: Model version, or tuple of versions, the result depends on
+                 (None anywhere = don't cache)
+        digest: image_digest() of the model input
+        compute: Callable producing the result on a miss
+        *params: Request parameters the result depends on (e.g. target class)
+
+    Returns:
+        (result, hit): hit is True when the model was skipped
+    """
+    versions = version if isinstance(version, tuple) else (version,)
+    if any(v is None for v in versions):
+        return compute(), False
+
+    cache = caches[CACHE_ALIAS]
+    key = ':'.join([kind, '+'.join(versions), digest, *map(str, params)])
+    result = cache.get(key)
+    if result is not None:
+        return result, True
+
+    result = compute()
+    cache.set(key, result)
+    return result, False
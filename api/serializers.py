@@ -39,12 +39,58 @@ class ImageSerializer(serializers.Serializer):
         fields = ["image"]
 
 
+class BatchImageSerializer(serializers.Serializer):
+    images = serializers.ListField(child=serializers.ImageField(), required=False, allow_empty=False)
+    archive = serializers.FileField(required=False)  # zip of images
+    class Meta:
+        fields = ["images", "archive"]
+
+    def validate(self, attrs):
+        if not attrs.get("images") and not attrs.get("archive"):
+            raise serializers.ValidationError("Provide either images or a zip archive.")
+        return attrs
+
+
+class WorksheetSerializer(serializers.Serializer):
+    image = serializers.ImageField()
+    # Expected class of each glyph in reading order (optional)
+    expected_classes = serializers.ListField(
+        child=serializers.IntegerField(min_value=0, max_value=35), required=False
+    )
+    class Meta:
+        fields = ["image", "expected_classes"]
+
+
 class SimilaritySerializer(serializers.Serializer):
     image = serializers.ImageField(required=False)
     processed_image_base64 = serializers.CharField(required=False, allow_blank=True)
     target_class = serializers.IntegerField(min_value=0, max_value=35)  # Updated to 36 classes (0-35)
     class Meta:
         fields = ["image", "processed_image_base64", "target_class"]
+
+
+class RankSimilaritySerializer(serializers.Serializer):
+    image = serializers.ImageField(required=False)
+    processed_image_base64 = serializers.CharField(required=False, allow_blank=True)
+    top_k = serializers.IntegerField(min_value=1, max_value=36, default=5)
+    # Blend classifier confidence into the ranking, with this weight
+    rerank = serializers.BooleanField(default=False)
+    classifier_weight = serializers.FloatField(min_value=0, max_value=1, default=0.5)
+    class Meta:
+        fields = ["image", "processed_image_base64", "top_k", "rerank", "classifier_weight"]
+
+    def validate(self, attrs):
+        if not attrs.get("image") and not attrs.get("processed_image_base64"):
+            raise serializers.ValidationError("Provide either image or processed_image_base64.")
+        return attrs
+
+
+class AnalyzeSerializer(serializers.Serializer):
+    image = serializers.ImageField()
+    # Class to compare against; defaults to the predicted class
+    target_class = serializers.IntegerField(min_value=0, max_value=35, required=False)
+    class Meta:
+        fields = ["image", "target_class"]
 class FeedbackSerializer(serializers.Serializer):
     user_image = serializers.CharField(required=True)  # base64
     reference_image = serializers.CharField(required=True)  # base64
@@ -0,0 +1,306 @@
+"""
+Per-user similarity statistics, served from rollup tables
+
+Every SimilarityHistory insert bumps two rollup rows: the user's all-time
+UserClassStats row for the target class and the UserDailyStats row for that
+class on that (UTC) day. Deletes (and edits of scored fields) recompute the
+two affected rows from the history, and the two it left when an edit moves
+the entry to another user, class or day. One delete() recomputes each
+affected pair once, however many entries it removes, and deleting a user
+skips the recomputation: their rollup rows are deleted with them. Unfiltered statistics are then one read
+of at most one row per character, and date ranges add the daily buckets of
+the whole days inside the range to one aggregate over the history rows in the
+partial days at its edges.
+
+Bulk writes that skip model signals (QuerySet.update, bulk_create, raw SQL)
+must be followed by rebuild_statistics().
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q, QuerySet, Sum, Value
+from django.db.models.functions import Greatest, TruncDate
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import SimilarityHistory, UserClassStats, UserDailyStats
+
+# Score bands reported by the statistics endpoint
+HIGH_SCORE = 90
+GOOD_SCORE = 75
+
+# SimilarityHistory fields the rollups depend on
+STAT_FIELDS = {'user', 'user_id', 'target_class', 'similarity_score', 'is_same_character', 'created_at'}
+# SimilarityHistory fields that pick an entry's rollup rows
+BUCKET_FIELDS = {'user', 'user_id', 'target_class', 'created_at'}
+
+COUNTER_FIELDS = ('count', 'score_sum', 'best_score', 'matches', 'high_scores', 'good_scores', 'last_at')
+
+
+def history_counters():
+    """Aggregates over SimilarityHistory rows matching the rollup columns"""
+    return {
+        'count': Count('id'),
+        'score_sum': Sum('similarity_score'),
+        'best_score': Max('similarity_score'),
+        'matches': Count('id', filter=Q(is_same_character=True)),
+        'high_scores': Count('id', filter=Q(similarity_score__gte=HIGH_SCORE)),
+        'good_scores': Count('id', filter=Q(similarity_score__gte=GOOD_SCORE, similarity_score__lt=HIGH_SCORE)),
+        'last_at': Max('created_at'),
+    }
+
+
+def rollup_counters():
+    """Aggregates combining rollup rows"""
+    return {
+        'count': Sum('count'),
+        'score_sum': Sum('score_sum'),
+        'best_score': Max('best_score'),
+        'matches': Sum('matches'),
+        'high_scores': Sum('high_scores'),
+        'good_scores': Sum('good_scores'),
+        'last_at': Max('last_at'),
+    }
+
+
+def stats_day(created_at):
+    """UTC day a SimilarityHistory entry is bucketed under"""
+    return created_at.astimezone(dt_timezone.utc).date()
+
+
+def _bump(model, keys, similarity):
+    score = similarity.similarity_score
+    high = score >= HIGH_SCORE
+    good = GOOD_SCORE <= score < HIGH_SCORE
+    updated = model.objects.filter(**keys).update(
+        count=F('count') + 1,
+        score_sum=F('score_sum') + score,
+        best_score=Greatest('best_score', Value(score)),
+        matches=F('matches') + int(similarity.is_same_character),
+        high_scores=F('high_scores') + int(high),
+        good_scores=F('good_scores') + int(good),
+        last_at=Greatest('last_at', Value(similarity.created_at)),
+    )
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(
+                **keys, count=1, score_sum=score, best_score=score,
+                matches=int(similarity.is_same_character), high_scores=int(high), good_scores=int(good),
+                last_at=similarity.created_at
+            )
+    except IntegrityError:
+        # A concurrent insert created the row first
+        _bump(model, keys, similarity)
+
+
+def record_similarity(similarity):
+    """Add a new SimilarityHistory entry to its user's rollups"""
+    keys = {'user_id': similarity.user_id, 'target_class': similarity.target_class}
+    with transaction.atomic():
+        _bump(UserClassStats, keys, similarity)
+        _bump(UserDailyStats, {**keys, 'day': stats_day(similarity.created_at)}, similarity)
+
+
+def refresh_stats(user_id, target_class, day):
+    """Recompute one user's class and daily rollup rows from the history"""
+    history = SimilarityHistory.objects.filter(user_id=user_id, target_class=target_class)
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    scopes = [
+        (UserClassStats, {}, history),
+        (UserDailyStats, {'day': day}, history.filter(created_at__gte=start, created_at__lt=start + timedelta(days=1))),
+    ]
+    with transaction.atomic():
+        for model, extra, rows in scopes:
+            keys = {'user_id': user_id, 'target_class': target_class, **extra}
+            totals = rows.order_by().aggregate(**history_counters())
+            if totals['count']:
+                model.objects.update_or_create(**keys, defaults=totals)
+            else:
+                model.objects.filter(**keys).delete()
+
+
+def rebuild_statistics(user_ids=None):
+    """Recompute all rollups (of the given users) from the history"""
+    history = SimilarityHistory.objects.order_by()
+    if user_ids is not None:
+        history = history.filter(user_id__in=user_ids)
+
+    with transaction.atomic():
+        for model in (UserClassStats, UserDailyStats):
+            stale = model.objects.all()
+            if user_ids is not None:
+                stale = stale.filter(user_id__in=user_ids)
+            stale.delete()
+
+        totals = history.values('user_id', 'target_class').annotate(**history_counters())
+        UserClassStats.objects.bulk_create((UserClassStats(**row) for row in totals), batch_size=1000)
+
+        daily = history.annotate(day=TruncDate('created_at', tzinfo=dt_timezone.utc)).values(
+            'user_id', 'day', 'target_class'
+        ).annotate(**history_counters())
+        UserDailyStats.objects.bulk_create((UserDailyStats(**row) for row in daily), batch_size=1000)
+
+
+def _bucket(user_id, target_class, created_at):
+    return user_id, target_class, stats_day(created_at)
+
+
+@receiver(pre_save, sender=SimilarityHistory)
+def _similarity_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    # An edit may move the entry to another bucket: remember the one it leaves
+    instance._stats_bucket = None
+    if raw or instance.pk is None or not (update_fields is None or BUCKET_FIELDS & set(update_fields)):
+        return
+    previous = SimilarityHistory.objects.filter(pk=instance.pk).values_list(
+        'user_id', 'target_class', 'created_at'
+    ).first()
+    if previous is not None:
+        instance._stats_bucket = _bucket(*previous)
+
+
+@receiver(post_save, sender=SimilarityHistory)
+def _similarity_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        record_similarity(instance)
+    elif update_fields is None or STAT_FIELDS & set(update_fields):
+        bucket = _bucket(instance.user_id, instance.target_class, instance.created_at)
+        refresh_stats(*bucket)
+        previous = getattr(instance, '_stats_bucket', None)
+        if previous is not None and previous != bucket:
+            refresh_stats(*previous)
+
+
+@receiver(pre_delete, sender=SimilarityHistory)
+def _similarity_deleting(sender, instance, origin=None, **kwargs):
+    # Every pre_delete of one delete() is sent before its rows are removed
+    # and its post_deletes are sent: start that delete's set of refreshed buckets
+    try:
+        origin._stats_refreshed = set()
+    except AttributeError:
+        pass
+
+
+@receiver(post_delete, sender=SimilarityHistory)
+def _similarity_deleted(sender, instance, origin=None, **kwargs):
+    # A deleted user's rollup rows cascade away with them
+    if isinstance(origin, User) or (isinstance(origin, QuerySet) and origin.model is User):
+        return
+    # All rows of the delete() are gone by now, so one refresh per bucket suffices
+    refreshed = getattr(origin, '_stats_refreshed', set())
+    bucket = _bucket(instance.user_id, instance.target_class, instance.created_at)
+    if bucket not in refreshed:
+        refreshed.add(bucket)
+        refresh_stats(*bucket)
+
+
+def _midnight(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def _per_class(rows, totals):
+    """Merge per-class aggregate rows into `totals` ({target_class: counters})"""
+    for row in rows:
+        if not row['count']:
+            continue
+        merged = totals.get(row['target_class'])
+        if merged is None:
+            totals[row['target_class']] = {field: row[field] for field in COUNTER_FIELDS}
+            continue
+        for field in ('count', 'score_sum', 'matches', 'high_scores', 'good_scores'):
+            merged[field] += row[field]
+        for field in ('best_score', 'last_at'):
+            merged[field] = max(merged[field], row[field])
+
+
+def class_totals(user, target_class=None, start=None, end=None):
+    """
+    Per-character counters of a user's analyses with start <= created_at <= end
+
+    Returns:
+        dict: {target_class: {count, score_sum, best_score, matches, high_scores, good_scores, last_at}}
+    """
+    totals = {}
+    if start is None and end is None:
+        rollups = UserClassStats.objects.filter(user=user)
+        if target_class is not None:
+            rollups = rollups.filter(target_class=target_class)
+        _per_class(rollups.values('target_class', *COUNTER_FIELDS), totals)
+        return totals
+
+    history = SimilarityHistory.objects.filter(user=user).order_by()
+    buckets = UserDailyStats.objects.filter(user=user).order_by()
+    if target_class is not None:
+        history = history.filter(target_class=target_class)
+        buckets = buckets.filter(target_class=target_class)
+
+    # Whole days inside the range come from the daily buckets,
+    # the partial days at either end from the history itself
+    first_day = None if start is None else stats_day(start) + timedelta(days=int(start != _midnight(stats_day(start))))
+    last_day = None if end is None else stats_day(end) - timedelta(days=1)
+    if first_day is not None and last_day is not None and first_day > last_day:
+        partial = Q(created_at__gte=start, created_at__lte=end)
+    else:
+        if first_day is not None:
+            buckets = buckets.filter(day__gte=first_day)
+        if last_day is not None:
+            buckets = buckets.filter(day__lte=last_day)
+        _per_class(buckets.values('target_class').annotate(**rollup_counters()), totals)
+
+        partial = Q(pk__in=[])
+        if start is not None and start < _midnight(first_day):
+            partial |= Q(created_at__gte=start, created_at__lt=_midnight(first_day))
+        if end is not None:
+            partial |= Q(created_at__gte=_midnight(last_day + timedelta(days=1)), created_at__lte=end)
+
+    _per_class(history.filter(partial).values('target_class').annotate(**history_counters()), totals)
+    return totals
+
+
+def summarize(totals):
+    """The statistics endpoint's figures from class_totals()"""
+    total_count = sum(counters['count'] for counters in totals.values())
+    if total_count == 0:
+        return {
+            'total_analyses': 0,
+            'average_score': 0,
+            'match_rate': 0,
+            'best_score': 0,
+            'total_matches': 0,
+            'total_mismatches': 0,
+            'most_practiced_character': None,
+            'characters_attempted': 0,
+            'high_scores': 0,
+            'good_scores': 0,
+            'needs_practice': 0,
+            'recent_activity': None
+        }
+
+    total_matches = sum(counters['matches'] for counters in totals.values())
+    high_scores = sum(counters['high_scores'] for counters in totals.values())
+    good_scores = sum(counters['good_scores'] for counters in totals.values())
+    # Ties go to the lower class number
+    most_practiced = min(totals, key=lambda target_class: (-totals[target_class]['count'], target_class))
+    return {
+        'total_analyses': total_count,
+        'average_score': round(sum(counters['score_sum'] for counters in totals.values()) / total_count, 2),
+        'match_rate': round(total_matches / total_count * 100, 2),
+        'best_score': round(max(counters['best_score'] for counters in totals.values()), 2),
+        'total_matches': total_matches,
+        'total_mismatches': total_count - total_matches,
+        'most_practiced_character': most_practiced,
+        'characters_attempted': len(totals),
+        'high_scores': high_scores,
+        'good_scores': good_scores,
+        'needs_practice': total_count - high_scores - good_scores,
+        'recent_activity': max(counters['last_at'] for counters in totals.values()).isoformat()
+    }
+
+
+def user_statistics(user, target_class=None, start=None, end=None):
+    """Statistics of a user's analyses, optionally for one character and/or start <= created_at <= end"""
+    return summarize(class_totals(user, target_class, start, end))
@@ -1,6 +1,6 @@
 # python manage.py test api.tests.CalligraphyAPITestCase.test_complete_workflow --verbosity=2
 
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -9,6 +9,8 @@ import base64
 from PIL import Image
 from io import BytesIO
 import json
+import time
+import unittest
 
 
 class CalligraphyAPITestCase(TestCase):
@@ -294,6 +296,1681 @@ class CalligraphyAPITestCase(TestCase):
         print("="*70 + "\n")
 
 
+class MicroBatcherTestCase(SimpleTestCase):
+    """Tests for the dynamic micro-batching scheduler"""
+    
+    def test_concurrent_requests_share_a_batch(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from api.ml_models.batching import MicroBatcher
+        
+        batch_sizes = []
+        
+        def double(items):
+            batch_sizes.append(len(items))
+            return [item * 2 for item in items]
+        
+        batcher = MicroBatcher(double, max_batch_size=8, max_wait_ms=50)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(batcher, range(16)))
+        
+        self.assertEqual(results, [i * 2 for i in range(16)])
+        self.assertLessEqual(max(batch_sizes), 8)
+        self.assertLess(len(batch_sizes), 16)
+    
+    def test_errors_reach_every_caller(self):
+        from api.ml_models.batching import MicroBatcher
+        
+        def fail(items):
+            raise RuntimeError("forward failed")
+        
+        batcher = MicroBatcher(fail, max_batch_size=4, max_wait_ms=1)
+        with self.assertRaises(RuntimeError):
+            batcher(1, timeout=5)
+
+    def test_short_results_and_base_exceptions_fail_callers_not_the_worker(self):
+        from api.ml_models.batching import MicroBatcher
+
+        calls = []
+
+        def flaky(items):
+            calls.append(len(items))
+            if len(calls) == 1:
+                return items[:-1]
+            if len(calls) == 2:
+                raise SystemExit('forward aborted')
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(flaky, max_batch_size=4, max_wait_ms=1)
+        with self.assertRaisesRegex(RuntimeError, '0 results for 1 items'):
+            batcher(1, timeout=5)
+        worker = batcher._thread
+        with self.assertRaises(SystemExit):
+            batcher(2, timeout=5)
+        self.assertEqual(batcher(3, timeout=5), 6)
+        self.assertIs(batcher._thread, worker)
+
+
+class SegmentCharactersTestCase(SimpleTestCase):
+    """Tests for worksheet segmentation"""
+    
+    def test_glyphs_returned_in_reading_order(self):
+        import cv2
+        import numpy as np
+        from api.views import segment_characters
+        
+        page = np.full((300, 700), 255, np.uint8)
+        # Two glyphs on the first line (written right one first), one on the second
+        cv2.rectangle(page, (400, 40), (460, 120), 0, -1)
+        cv2.rectangle(page, (50, 40), (110, 120), 0, -1)
+        cv2.rectangle(page, (60, 180), (120, 260), 0, -1)
+        
+        glyphs = segment_characters(page)
+        
+        self.assertEqual(len(glyphs), 3)
+        # Erosion may shift boxes by a pixel, so compare coarse positions
+        self.assertEqual([(x // 10, y // 10) for _, (x, y, w, h) in glyphs], [(5, 4), (40, 4), (6, 18)])
+        for processed, _ in glyphs:
+            self.assertEqual(processed.shape, (64, 64))
+
+
+class ComparisonOverlayTestCase(SimpleTestCase):
+    """The cached-reference overlay renders like the original per-request PIL renderer"""
+
+    @staticmethod
+    def per_request_overlay(user_image, reference_image_path):
+        # The renderer before the reference layer was cached (four RGBA images, two composites)
+        import numpy as np
+        from PIL import ImageOps
+
+        user_img = ImageOps.invert(Image.fromarray(user_image))
+        ref_img = Image.open(reference_image_path).convert('L')
+        size = (256, 256)
+        user_img = user_img.resize(size, Image.Resampling.LANCZOS)
+        ref_img = ref_img.resize(size, Image.Resampling.LANCZOS)
+
+        blended = Image.new('RGBA', size, (255, 255, 255, 255))
+        ref_with_alpha = Image.new('RGBA', size, (255, 255, 255, 0))
+        ref_with_alpha.paste(ref_img.convert('RGBA'), (0, 0))
+        ref_array = np.array(ref_with_alpha)
+        ref_array[:, :, 3] = (255 - ref_array[:, :, 0]) * 1
+        blended = Image.alpha_composite(blended, Image.fromarray(ref_array.astype('uint8'), 'RGBA'))
+
+        user_with_alpha = Image.new('RGBA', size, (255, 255, 255, 0))
+        user_with_alpha.paste(user_img.convert('RGBA'), (0, 0))
+        user_array = np.array(user_with_alpha)
+        user_array[:, :, 3] = (255 - user_array[:, :, 0]) * 0.8
+        blended = Image.alpha_composite(blended, Image.fromarray(user_array.astype('uint8'), 'RGBA'))
+
+        return ref_img.convert('RGB'), user_img.convert('RGB'), blended.convert('RGB')
+
+    def test_cached_reference_layer_matches_per_request_renderer(self):
+        from pathlib import Path
+        from unittest import mock
+        import numpy as np
+        from api import views
+        from api.views import create_comparison_overlay, decode_image, preprocess_image_array
+
+        reference_dir = Path(__file__).parent / 'reference_images'
+        reference_path = str(reference_dir / 'class_5.png')
+        # A different character, so the two layers do not simply coincide
+        user_image = preprocess_image_array(decode_image((reference_dir / 'class_12.png').read_bytes()))
+        expected = [np.asarray(img, dtype=np.int16) for img in self.per_request_overlay(user_image, reference_path)]
+
+        with mock.patch.dict('api.views._reference_image_cache', clear=True):
+            # First call builds the cached layer, second call reuses it
+            for _ in range(2):
+                ref_img, user_img, blended_img = create_comparison_overlay(
+                    user_image, reference_path, preprocessed=True
+                )
+                np.testing.assert_array_equal(np.asarray(ref_img), expected[0])
+                np.testing.assert_array_equal(np.asarray(user_img), expected[1])
+                # The float blend rounds where alpha_composite truncates: at most one grey level apart
+                self.assertLessEqual(np.abs(np.asarray(blended_img, dtype=np.int16) - expected[2]).max(), 1)
+            self.assertEqual(list(views._reference_image_cache), [reference_path])
+
+
+class ResultCacheTestCase(SimpleTestCase):
+    """Tests for the content-addressed result cache"""
+    
+    def test_identical_images_skip_the_model(self):
+        import numpy as np
+        from api.result_cache import cached_result, image_digest
+        
+        calls = []
+        
+        def compute():
+            calls.append(1)
+            return {'class': 3, 'confidence': 0.9}
+        
+        image = np.zeros((64, 64), np.uint8)
+        first = cached_result('test-predict', 'v1', image_digest(image), compute)
+        second = cached_result('test-predict', 'v1', image_digest(image.copy()), compute)
+        other_version = cached_result('test-predict', 'v2', image_digest(image), compute)
+        
+        self.assertEqual(first, ({'class': 3, 'confidence': 0.9}, False))
+        self.assertEqual(second, ({'class': 3, 'confidence': 0.9}, True))
+        self.assertFalse(other_version[1])
+        self.assertEqual(len(calls), 2)
+    
+    def test_unknown_model_version_is_not_cached(self):
+        from api.result_cache import cached_result
+        
+        result, hit = cached_result('test-predict', ('v1', None), 'digest', lambda: 1)
+        self.assertFalse(hit)
+        result, hit = cached_result('test-predict', ('v1', None), 'digest', lambda: 1)
+        self.assertFalse(hit)
+
+
+class ExecutionBackendTestCase(SimpleTestCase):
+    """Tests for choosing exported models in load_runner (stub manifests, no real exports)"""
+
+    def setUp(self):
+        import tempfile
+        from pathlib import Path
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.export_dir = Path(directory.name)
+        self.checkpoint = self.export_dir / 'model.pth'
+        self.checkpoint.write_bytes(b'weights')
+        (self.export_dir / 'classifier.pt').write_bytes(b'not loaded')
+        self.eager = lambda batch: batch
+
+    def runner(self, manifest, backend='torchscript', **kwargs):
+        from api.ml_models.backends import CLASSIFIER, load_runner, write_manifest
+
+        write_manifest(self.export_dir, manifest)
+        return load_runner(backend, CLASSIFIER, self.eager, self.checkpoint, export_dir=self.export_dir, **kwargs)
+
+    def test_stale_or_missing_exports_fall_back_to_eager(self):
+        from unittest import mock
+        from api.ml_models.reference_index import file_sha256
+
+        stale = {'classifier': {'checkpoint_sha256': 'an-older-checkpoint', 'torchscript': 'classifier.pt'}}
+        self.assertEqual(self.runner(stale), (self.eager, 'eager'))
+        self.assertEqual(self.runner({'siamese_encoder': {}}), (self.eager, 'eager'))
+        # A current ONNX export is skipped too when onnxruntime is not installed
+        (self.export_dir / 'classifier.onnx').write_bytes(b'not loaded')
+        fresh = {'classifier': {'checkpoint_sha256': file_sha256(self.checkpoint), 'onnx': 'classifier.onnx'}}
+        with mock.patch('api.ml_models.backends.missing_onnx_packages', return_value=['onnxruntime']):
+            self.assertEqual(self.runner(fresh, backend='onnx'), (self.eager, 'eager'))
+
+    def test_int8_models_need_an_approving_gate_for_this_checkpoint(self):
+        from unittest import mock
+        from api.ml_models.reference_index import file_sha256
+
+        current = file_sha256(self.checkpoint)
+        for name in ('classifier.onnx', 'classifier.int8.onnx'):
+            (self.export_dir / name).write_bytes(b'not loaded')
+
+        def manifest(gate):
+            return {'classifier': {
+                'checkpoint_sha256': current, 'onnx': 'classifier.onnx',
+                'onnx_int8': 'classifier.int8.onnx', 'int8_gate': gate,
+            }}
+
+        with mock.patch('api.ml_models.backends.OnnxRunner', lambda path, num_threads=None: path.name):
+            refused = [
+                {'approved': False, 'checkpoint_sha256': current},
+                {'approved': True, 'checkpoint_sha256': 'an-older-checkpoint'},
+                {'approved': True},
+            ]
+            for gate in refused:
+                self.assertEqual(
+                    self.runner(manifest(gate), backend='onnx', quantized=True), ('classifier.onnx', 'onnx')
+                )
+            approved = {'approved': True, 'checkpoint_sha256': current}
+            self.assertEqual(
+                self.runner(manifest(approved), backend='onnx', quantized=True), ('classifier.int8.onnx', 'onnx-int8')
+            )
+
+
+    def test_int8_gate_sees_held_out_images_as_served(self):
+        from io import StringIO
+        from pathlib import Path
+        from types import SimpleNamespace
+        from unittest import mock
+        import numpy as np
+        from django.core.management import call_command
+        from api.views import decode_image, preprocess_image_array
+
+        holdout_dir = self.export_dir / 'holdout'
+        holdout_dir.mkdir()
+        # A small dark character off-centre on a large white page, as users upload them
+        page = np.full((300, 400), 255, dtype=np.uint8)
+        page[40:120, 250:290] = 0
+        page[100:120, 220:320] = 0
+        Image.fromarray(page).save(holdout_dir / 'upload.png')
+
+        manifest = {
+            name: {'checkpoint_sha256': 'sha', 'onnx': f'{name}.onnx'} for name in ('classifier', 'siamese_encoder')
+        }
+        for name in manifest:
+            (self.export_dir / f'{name}.onnx').write_bytes(b'fp32')
+        inference = SimpleNamespace(
+            checkpoint_path='classifier.pth', siamese_checkpoint='siamese.pth', load_siamese_model=lambda: None
+        )
+        evaluated = []
+
+        def evaluate_int8(inference, classifier_path, encoder_path, images, **kwargs):
+            evaluated.extend(images)
+            return {name: {'approved': True} for name in manifest}
+
+        with mock.patch('api.ml_models.backends.missing_onnx_packages', lambda: []), \
+                mock.patch('api.ml_models.backends.read_manifest', lambda export_dir: manifest), \
+                mock.patch('api.ml_models.backends.write_manifest'), \
+                mock.patch('api.ml_models.config.EXPORT_DIR', self.export_dir), \
+                mock.patch('api.ml_models.get_classification_model', lambda preload_siamese: inference), \
+                mock.patch('api.ml_models.reference_index.file_sha256', lambda path: 'sha'), \
+                mock.patch('api.ml_models.quantization.quantize_onnx', lambda source, target: target.write_bytes(b'i8')), \
+                mock.patch('api.ml_models.quantization.evaluate_int8', evaluate_int8):
+            call_command('quantize_models', holdout_dir=str(holdout_dir), stdout=StringIO())
+
+        held_out = evaluated[-1]
+        expected = preprocess_image_array(decode_image((holdout_dir / 'upload.png').read_bytes()))
+        self.assertEqual(expected.shape, (64, 64))
+        self.assertTrue(held_out[1])
+        np.testing.assert_array_equal(held_out[0], expected)
+        # Reference images are compared as stored
+        self.assertTrue(all(isinstance(image, Path) and skip for image, skip in evaluated[:-1]))
+
+
+class InMemoryPipelineTestCase(TestCase):
+    """Uploads are decoded once and reach the model as arrays, without temp files"""
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        import numpy as np
+        from django.test import override_settings
+        from django.contrib.auth.models import User
+        from api.ml_models.router import InferenceRouter
+        from api.write_behind import WriteBehind
+
+        media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media_dir.cleanup)
+        media_override = override_settings(MEDIA_ROOT=media_dir.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        calls = self.calls = []
+
+        class FakeModel:
+            def predict(self, image, top_k=1, skip_preprocessing=False):
+                calls.append(('predict', image, skip_preprocessing))
+                return {'class': 3, 'confidence': 0.9}
+
+            def compute_similarity_to_class(self, image, target_class, skip_preprocessing=False):
+                calls.append(('similarity', image, skip_preprocessing))
+                return 80.0, 0.2
+
+        for target, value in [
+            ('api.write_behind._writer', WriteBehind(threads=0)),
+            ('api.ml_models.router._router', InferenceRouter(mode='local', local_factory=FakeModel)),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='inmemory', password='pass12345'))
+
+        # A dark character off-centre on a white page
+        page = np.full((240, 320), 255, dtype=np.uint8)
+        page[30:150, 200:230] = 0
+        page[80:100, 170:280] = 0
+        buffered = BytesIO()
+        Image.fromarray(page).save(buffered, format='PNG')
+        self.upload_bytes = buffered.getvalue()
+
+    def post(self, url, **data):
+        from unittest import mock
+
+        # Any temp file or re-read from disk on the request path fails the request
+        with mock.patch('api.views.tempfile.NamedTemporaryFile', side_effect=AssertionError('temp file written')), \
+                mock.patch('api.views.cv.imread', side_effect=AssertionError('image re-read from disk')):
+            response = self.client.post(url, data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return response.json()
+
+    def test_predict_and_similarity_pass_the_decoded_array(self):
+        import numpy as np
+        from api.views import decode_image, preprocess_image_array
+
+        expected = preprocess_image_array(decode_image(self.upload_bytes))
+        self.assertEqual(expected.shape, (64, 64))
+
+        predicted = self.post(
+            '/api/predict/', image=SimpleUploadedFile('upload.png', self.upload_bytes, content_type='image/png')
+        )
+        compared = self.post('/api/similarity/', target_class=3, image=SimpleUploadedFile(
+            'upload.png', self.upload_bytes, content_type='image/png'
+        ))
+        self.assertEqual((predicted['predicted_class'], compared['similarity_score']), (3, 80.0))
+
+        (kind, image, skip), = [call for call in self.calls if call[0] == 'predict']
+        self.assertTrue(skip)
+        np.testing.assert_array_equal(image, expected)
+        # The processed image returned to the client is the array the model saw
+        returned = base64.b64decode(predicted['processed_image'].split(',', 1)[1])
+        np.testing.assert_array_equal(decode_image(returned), expected)
+
+        # As before the in-memory change, a raw upload is scored as decoded (only its overlay is cropped)
+        (kind, image, skip), = [call for call in self.calls if call[0] == 'similarity']
+        self.assertTrue(skip)
+        np.testing.assert_array_equal(image, decode_image(self.upload_bytes))
+
+    def test_path_wrapper_matches_the_array_pipeline(self):
+        import tempfile
+        import numpy as np
+        from api.views import decode_image, preprocess_image, preprocess_image_array
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'upload.png')
+            with open(path, 'wb') as f:
+                f.write(self.upload_bytes)
+            processed_path, processed_base64 = preprocess_image(path)
+            try:
+                from_path = decode_image(open(processed_path, 'rb').read())
+            finally:
+                os.unlink(processed_path)
+
+        np.testing.assert_array_equal(from_path, preprocess_image_array(decode_image(self.upload_bytes)))
+        np.testing.assert_array_equal(decode_image(base64.b64decode(processed_base64)), from_path)
+
+
+class BatchPredictTestCase(TestCase):
+    """Tests for POST /api/predict/batch/ (fake local classifier, inline writes)"""
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        from django.contrib.auth.models import User
+        from api.ml_models.router import InferenceRouter
+        from api.write_behind import WriteBehind
+
+        media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media_dir.cleanup)
+        media_override = override_settings(MEDIA_ROOT=media_dir.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        test = self
+
+        class FakeClassifier:
+            def predict_batch(self, images, top_k=1, skip_preprocessing=False):
+                test.batches.append(len(images))
+                return [{'class': 4, 'confidence': 0.875} for _ in images]
+
+        self.batches = []
+        for target, value in [
+            ('api.write_behind._writer', WriteBehind(threads=0)),
+            ('api.ml_models.router._router', InferenceRouter(mode='local', local_factory=FakeClassifier)),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(username='batch', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def png(self, shade=255):
+        buffered = BytesIO()
+        Image.new('L', (64, 64), shade).save(buffered, format='PNG')
+        return buffered.getvalue()
+
+    def archive(self, members):
+        import zipfile
+
+        buffered = BytesIO()
+        with zipfile.ZipFile(buffered, 'w') as zf:
+            for name, data in members:
+                zf.writestr(name, data)
+        return SimpleUploadedFile('sheet.zip', buffered.getvalue(), content_type='application/zip')
+
+    def post(self, **data):
+        return self.client.post('/api/predict/batch/', data, format='multipart')
+
+    def test_results_per_item_with_unreadable_members(self):
+        from api.models import PredictionHistory
+
+        response = self.post(
+            images=[SimpleUploadedFile('first.png', self.png(), content_type='image/png')],
+            archive=self.archive([
+                ('sheet/second.png', self.png(0)),
+                ('sheet/broken.png', b'not an image'),
+                ('sheet/notes.txt', b'skipped: not an image extension'),
+            ]),
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual((data['success'], data['count']), (True, 3))
+        first, second, broken = data['results']
+        self.assertEqual(
+            set(first), {'index', 'filename', 'success', 'predicted_class', 'confidence', 'processed_image'}
+        )
+        self.assertEqual(
+            (first['index'], first['filename'], first['success'], first['predicted_class'], first['confidence']),
+            (0, 'first.png', True, 4, 87.5)
+        )
+        self.assertTrue(first['processed_image'].startswith('data:image/png;base64,'))
+        self.assertEqual((second['index'], second['filename'], second['success']), (1, 'second.png', True))
+        self.assertEqual((broken['index'], broken['filename'], broken['success']), (2, 'broken.png', False))
+        self.assertIn('Could not read image', broken['error'])
+        # One forward pass for the readable images; one history row each
+        self.assertEqual(self.batches, [2])
+        self.assertEqual(PredictionHistory.objects.filter(user=self.user).count(), 2)
+
+    def test_item_count_limit(self):
+        from unittest import mock
+
+        with mock.patch('api.views.MAX_BATCH_IMAGES', 2):
+            response = self.post(archive=self.archive([(f'{i}.png', self.png()) for i in range(3)]))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('more than 2 images', response.json()['error'])
+
+            # Uploaded images and archive members count together
+            response = self.post(
+                images=[SimpleUploadedFile(f'{i}.png', self.png(), content_type='image/png') for i in range(2)],
+                archive=self.archive([('2.png', self.png())]),
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('Too many images (3)', response.json()['error'])
+        self.assertEqual(self.batches, [])
+
+    def test_archive_member_size_limit_and_bad_zip(self):
+        from unittest import mock
+
+        with mock.patch('api.views.MAX_ARCHIVE_ENTRY_SIZE', 100):
+            response = self.post(archive=self.archive([('big.png', b'0' * 101)]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('big.png in archive is too large', response.json()['error'])
+
+        response = self.post(archive=SimpleUploadedFile('sheet.zip', b'not a zip', content_type='application/zip'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.json()['error'].startswith('Invalid archive'))
+        self.assertEqual(self.batches, [])
+
+
+class AnalyzeViewTestCase(TestCase):
+    """POST /api/analyze/ answers like /api/predict/ followed by /api/similarity/"""
+
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        from django.contrib.auth.models import User
+        from api.ml_models.config import MODELS_DIR
+        from api.ml_models.router import InferenceRouter
+        from api.write_behind import WriteBehind
+
+        if not (
+            (MODELS_DIR / 'efficientnet_b0_augmented_best.pth').exists()
+            and (MODELS_DIR / 'siamese_efficientnet_b0_best.pth').exists()
+        ):
+            self.skipTest('Local model weights not available')
+
+        media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media_dir.cleanup)
+        media_override = override_settings(MEDIA_ROOT=media_dir.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+
+        for target, value in [
+            ('api.write_behind._writer', WriteBehind(threads=0)),
+            ('api.ml_models.router._router', InferenceRouter(mode='local')),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='analyze', password='pass12345'))
+
+    def upload(self):
+        from pathlib import Path
+
+        reference = Path(__file__).parent / 'reference_images' / 'class_5.png'
+        return SimpleUploadedFile('attempt.png', reference.read_bytes(), content_type='image/png')
+
+    def test_matches_predict_then_similarity(self):
+        from api.ml_models.config import SIMILARITY_THRESHOLD
+
+        analyzed = self.client.post('/api/analyze/', {'image': self.upload()}, format='multipart')
+        self.assertEqual(analyzed.status_code, status.HTTP_200_OK, analyzed.content)
+        analyzed = analyzed.json()
+
+        predicted = self.client.post('/api/predict/', {'image': self.upload()}, format='multipart').json()
+        compared = self.client.post('/api/similarity/', {
+            'processed_image_base64': predicted['processed_image'].split(',', 1)[1],
+            'target_class': predicted['predicted_class'],
+        }, format='multipart').json()
+
+        self.assertEqual(analyzed['threshold'], SIMILARITY_THRESHOLD)
+        self.assertEqual(analyzed, {**predicted, **compared})
+
+
+class WarmStartupTestCase(SimpleTestCase):
+    """Models are loaded and warmed up once before fork, then shared by workers"""
+
+    def setUp(self):
+        import gc
+        from unittest import mock
+
+        test = self
+        self.events = []
+
+        class FakeModel:
+            def warm_up(self):
+                test.events.append('warm_up')
+
+            def after_fork(self):
+                test.events.append(('after_fork', os.getpid()))
+
+        self.model = FakeModel()
+        for target, value in [
+            ('api.ml_models._classification_model', None),
+            ('api.ml_models._siamese_preloaded', False),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(gc.unfreeze)
+
+    def load(self, preload_siamese=True):
+        import api.ml_models
+
+        # Stands in for get_classification_model's checkpoint loading
+        self.events.append('load')
+        api.ml_models._classification_model = self.model
+        api.ml_models._siamese_preloaded = True
+        return self.model
+
+    def test_ready_warms_up_only_when_preloading(self):
+        from unittest import mock
+        from django.apps import apps
+
+        config = apps.get_app_config('api')
+        for preload, routing, expected in (
+            (False, 'local', []), (True, 'remote', []), (True, 'local', ['load', 'warm_up']),
+        ):
+            self.events.clear()
+            with mock.patch('api.ml_models.config.PRELOAD_MODELS', preload), \
+                    mock.patch('api.ml_models.config.INFERENCE_ROUTING', routing), \
+                    mock.patch('api.ml_models.get_classification_model', self.load):
+                config.ready()
+            self.assertEqual(self.events, expected)
+
+    def test_forked_workers_reuse_the_warm_models(self):
+        import gc
+        from unittest import mock
+        import api.ml_models
+        from api.ml_models import configure_worker, get_classification_model, warm_up_models
+
+        with mock.patch('api.ml_models.get_classification_model', self.load):
+            self.assertIs(warm_up_models(), self.model)
+        self.assertEqual(self.events, ['load', 'warm_up'])
+        # Objects loaded in the master are kept out of the workers' collections
+        self.assertGreater(gc.get_freeze_count(), 0)
+
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # Worker: any load from disk would construct RanjanaInference
+            code = 1
+            try:
+                with mock.patch('api.ml_models.inference.RanjanaInference', side_effect=AssertionError('reloaded')), \
+                        mock.patch('api.ml_models.config.TORCH_NUM_THREADS', 0), \
+                        mock.patch('os.cpu_count', return_value=8):
+                    threads = configure_worker(num_workers=2)
+                    shared = get_classification_model() is self.model
+                os.write(write_end, json.dumps([threads, shared, self.events[-1][1] == os.getpid()]).encode())
+                code = 0
+            finally:
+                os._exit(code)
+        os.close(write_end)
+        _, exit_status = os.waitpid(pid, 0)
+        with os.fdopen(read_end) as f:
+            report = f.read()
+        self.assertEqual(os.waitstatus_to_exitcode(exit_status), 0)
+        # Cores split between two workers, the master's model reused, fork hooks run in the worker
+        self.assertEqual(json.loads(report), [4, True, True])
+        self.assertIs(api.ml_models._classification_model, self.model)
+
+
+class ReferenceIndexTestCase(SimpleTestCase):
+    """Tests for the precomputed reference embeddings"""
+
+    def test_batched_distances_match_single_distance(self):
+        import numpy as np
+        from api.ml_models.reference_index import ReferenceEmbeddingIndex
+
+        rng = np.random.default_rng(0)
+        references = rng.normal(size=(36, 128)).astype(np.float32)
+        references /= np.linalg.norm(references, axis=1, keepdims=True)
+        index = ReferenceEmbeddingIndex(range(36), references)
+        # Query 0 is reference 7 itself, the rest are random
+        queries = np.vstack([references[7], rng.normal(size=(3, 128)).astype(np.float32)])
+
+        distances = index.distances(queries)
+
+        self.assertEqual(distances.shape, (4, 36))
+        for row, query in enumerate(queries):
+            for class_id in (0, 7, 35):
+                self.assertAlmostEqual(distances[row, class_id], index.distance(query, class_id), places=4)
+        self.assertEqual(int(np.argmin(distances[0])), 7)
+
+    def test_exemplar_galleries_reduce_per_class(self):
+        import tempfile
+        import numpy as np
+        from api.ml_models.reference_index import ReferenceEmbeddingIndex
+
+        rng = np.random.default_rng(1)
+        # Classes 0-4 with 1, 3, 1, 5 and 2 exemplars, rows given out of order
+        row_classes = np.array([3, 0, 1, 3, 4, 1, 3, 2, 3, 1, 4, 3])
+        rows = rng.normal(size=(len(row_classes), 16)).astype(np.float32)
+        queries = rng.normal(size=(4, 16)).astype(np.float32)
+
+        for reduce, combine in (('min', np.min), ('mean', np.mean)):
+            index = ReferenceEmbeddingIndex.from_rows(row_classes, rows, key='k', reduce=reduce)
+            expected = [
+                [combine(np.linalg.norm(query - rows[row_classes == c] + 1e-6, axis=1)) for c in range(5)]
+                for query in queries
+            ]
+            np.testing.assert_allclose(index.distances(queries), expected, rtol=1e-4)
+            self.assertAlmostEqual(index.distance(queries[0], 3), expected[0][3], places=4)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            paths = ReferenceEmbeddingIndex.cache_paths(cache_dir, 'k')
+            index.save(*paths)
+            loaded = ReferenceEmbeddingIndex.load(*paths, reduce='mean')
+            self.assertIsInstance(loaded.embeddings.base, np.memmap)
+            self.assertEqual(loaded.get(3).shape, (5, 16))
+            np.testing.assert_allclose(loaded.distances(queries), index.distances(queries), rtol=1e-6)
+            del loaded
+
+    def test_persisted_index_is_rebuilt_when_inputs_change(self):
+        import tempfile
+        from pathlib import Path
+        import numpy as np
+        from api.ml_models.reference_index import ReferenceEmbeddingIndex
+
+        embedded = []
+
+        def embed_fn(paths):
+            # Each reference embeds to its mean pixel value, so a changed image changes its row
+            embedded.append(len(paths))
+            return np.array([[np.asarray(Image.open(path)).mean(), 1.0] for path in paths], dtype=np.float32)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            reference_dir, cache_dir = tmp / 'references', tmp / 'cache'
+            reference_dir.mkdir()
+            for class_id, shade in ((0, 10), (1, 20)):
+                Image.new('L', (8, 8), shade).save(reference_dir / f'class_{class_id}.png')
+            checkpoint = tmp / 'siamese.pth'
+            checkpoint.write_bytes(b'weights v1')
+
+            def load():
+                return ReferenceEmbeddingIndex.load_or_build(checkpoint, reference_dir, cache_dir, embed_fn)
+
+            index = load()
+            self.assertEqual(embedded, [2])
+            self.assertEqual(sorted(path.name for path in cache_dir.iterdir()), [
+                f'reference_embeddings_{index.key}.npy', f'reference_embeddings_{index.key}.npz'
+            ])
+
+            # Unchanged inputs: read back from disk without embedding again
+            cached = load()
+            self.assertEqual(embedded, [2])
+            self.assertEqual(cached.key, index.key)
+            self.assertIsInstance(cached.embeddings.base, np.memmap)
+            self.assertEqual(cached.get(1)[0, 0], 20)
+            del cached
+
+            # A changed reference image gets a new key instead of the stale .npy
+            Image.new('L', (8, 8), 200).save(reference_dir / 'class_1.png')
+            changed = load()
+            self.assertEqual(embedded, [2, 2])
+            self.assertNotEqual(changed.key, index.key)
+            self.assertEqual(changed.get(0)[0, 0], 10)
+            self.assertEqual(changed.get(1)[0, 0], 200)
+
+            # So does a new checkpoint
+            checkpoint.write_bytes(b'weights v2')
+            self.assertNotIn(load().key, (index.key, changed.key))
+            self.assertEqual(embedded, [2, 2, 2])
+
+
+class FeedbackJobTestCase(TestCase):
+    """Tests for the background feedback queue (stub provider, no Gemini calls)"""
+    
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from django.contrib.auth.models import User
+        
+        media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media_dir.cleanup)
+        media_override = override_settings(MEDIA_ROOT=media_dir.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        
+        # Images are written inline, once the request's transaction "commits"
+        from unittest import mock
+        from api.write_behind import WriteBehind
+        writer = mock.patch('api.write_behind._writer', WriteBehind(threads=0))
+        writer.start()
+        self.addCleanup(writer.stop)
+        
+        self.user = User.objects.create_user(username='feedback', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def _post_comparison(self, write_images=True):
+        buffered = BytesIO()
+        Image.new('RGB', (64, 64), 'white').save(buffered, format='PNG')
+        image = 'data:image/png;base64,' + base64.b64encode(buffered.getvalue()).decode('utf-8')
+        with self.captureOnCommitCallbacks(execute=write_images) as self.image_writes:
+            return self.client.post('/api/feedback/', {
+                'user_image': image,
+                'reference_image': image,
+                'blended_overlay': image,
+                'target_class': 3,
+                'similarity_score': 80.0,
+                'distance': 0.2,
+                'is_same_character': True,
+            }, format='multipart')
+    
+    def test_job_waits_for_its_images(self):
+        from api.feedback import StubFeedbackProvider, run_pending_jobs
+        
+        job_id = self._post_comparison(write_images=False).data['job_id']
+        self.assertEqual(self.client.get(f'/api/feedback/{job_id}/').data['status'], 'waiting')
+        self.assertEqual(run_pending_jobs(StubFeedbackProvider()), 0)
+        
+        for write in self.image_writes:
+            write()
+        self.assertEqual(self.client.get(f'/api/feedback/{job_id}/').data['status'], 'pending')
+        self.assertEqual(run_pending_jobs(StubFeedbackProvider()), 1)
+    
+    def test_feedback_is_queued_and_filled_in_by_worker(self):
+        from api.feedback import StubFeedbackProvider, run_pending_jobs
+        from api.models import SimilarityHistory
+        
+        response = self._post_comparison()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.data['job_id']
+        self.assertEqual(self.client.get(f'/api/feedback/{job_id}/').data['status'], 'pending')
+        
+        self.assertEqual(run_pending_jobs(StubFeedbackProvider()), 1)
+        
+        job = self.client.get(f'/api/feedback/{job_id}/').data
+        self.assertEqual(job['status'], 'done')
+        self.assertTrue(job['feedback'])
+        self.assertEqual(SimilarityHistory.objects.get(id=job['similarity_id']).feedback, job['feedback'])
+    
+    def test_failed_jobs_are_retried_then_marked_failed(self):
+        from api.feedback import MAX_ATTEMPTS, run_pending_jobs
+        
+        def failing_provider(image, prompt):
+            raise RuntimeError("provider down")
+        
+        job_id = self._post_comparison().data['job_id']
+        self.assertEqual(run_pending_jobs(failing_provider), MAX_ATTEMPTS)
+        
+        job = self.client.get(f'/api/feedback/{job_id}/').data
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('provider down', job['error'])
+    
+    def test_repeated_attempt_reuses_cached_feedback(self):
+        from api.feedback import StubFeedbackProvider, cache_stats, run_pending_jobs
+        
+        calls = []
+        stub = StubFeedbackProvider()
+        
+        def counting_provider(image, prompt):
+            calls.append(prompt)
+            return stub(image, prompt)
+        
+        first_id = self._post_comparison().data['job_id']
+        run_pending_jobs(counting_provider)
+        second_id = self._post_comparison().data['job_id']
+        run_pending_jobs(counting_provider)
+        
+        self.assertEqual(len(calls), 1)
+        first = self.client.get(f'/api/feedback/{first_id}/').data
+        second = self.client.get(f'/api/feedback/{second_id}/').data
+        self.assertFalse(first['cached'])
+        self.assertTrue(second['cached'])
+        self.assertEqual(second['feedback'], first['feedback'])
+        self.assertEqual(cache_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+    
+    def test_near_identical_embeddings_share_feedback(self):
+        import numpy as np
+        from api.feedback import CACHE_DISTANCE, StubFeedbackProvider, run_pending_jobs
+        
+        base = np.random.default_rng(0).normal(size=128)
+        base /= np.linalg.norm(base)
+        offsets = iter([0.0, CACHE_DISTANCE / 4, CACHE_DISTANCE * 4])
+        
+        class FakeEmbedder:
+            version = 'test'
+            
+            def __call__(self, image):
+                embedding = base.copy()
+                embedding[0] += next(offsets)
+                return embedding
+        
+        embedder = FakeEmbedder()
+        job_ids = []
+        for _ in range(3):
+            job_ids.append(self._post_comparison().data['job_id'])
+            run_pending_jobs(StubFeedbackProvider(), embedder=embedder)
+        
+        cached = [self.client.get(f'/api/feedback/{job_id}/').data['cached'] for job_id in job_ids]
+        self.assertEqual(cached, [False, True, False])
+
+    def test_similar_attempts_use_stored_embeddings(self):
+        import numpy as np
+        from unittest import mock
+        from api.feedback import StubFeedbackProvider, run_pending_jobs
+
+        base = np.zeros(128)
+        base[0] = 1.0
+        offsets = iter([0.0, 0.5, 0.1])
+
+        class FakeEmbedder:
+            version = 'test'
+            embedding_version = 'encoder-test'
+
+            def __call__(self, image):
+                embedding = base.copy()
+                embedding[1] = next(offsets)
+                return embedding
+
+        similarity_ids = [self._post_comparison().data['similarity_id'] for _ in range(3)]
+        url = f'/api/history/similarities/{similarity_ids[0]}/similar/'
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_409_CONFLICT)
+
+        run_pending_jobs(StubFeedbackProvider(), embedder=FakeEmbedder())
+        with mock.patch('api.views.nearest_reference', return_value=(3, 'class_3.png', 0.12345)):
+            response = self.client.get(url, {'k': 5})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([sim['id'] for sim in response.data['similar_attempts']], [similarity_ids[2], similarity_ids[1]])
+        self.assertEqual([sim['embedding_distance'] for sim in response.data['similar_attempts']], [0.1, 0.5])
+        self.assertEqual(response.data['nearest_exemplar'], {'class': 3, 'exemplar': 'class_3.png', 'distance': 0.1235})
+        self.assertEqual(self.client.get(url, {'k': 0}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SubmissionIndexTestCase(TestCase):
+    """Tests for nearest-neighbour search over stored submission embeddings"""
+
+    def test_snapshot_and_newer_entries_are_searched_together(self):
+        import tempfile
+        import numpy as np
+        from django.contrib.auth.models import User
+        from api.embeddings import SubmissionIndex, similar_attempts, store_embedding
+        from api.models import SimilarityHistory
+
+        rng = np.random.default_rng(0)
+        users = [User.objects.create_user(username=f'searcher{i}', password='pass12345') for i in range(3)]
+        embeddings = {}
+
+        def add_attempts(count, version='v1'):
+            for _ in range(count):
+                user = users[rng.integers(len(users))]
+                entry = SimilarityHistory.objects.create(
+                    user=user, user_image='similarity/x.png', target_class=int(rng.integers(3)),
+                    similarity_score=80.0, distance=0.2, is_same_character=True
+                )
+                embedding = rng.normal(size=16)
+                embedding /= np.linalg.norm(embedding)
+                store_embedding(entry.id, embedding, version)
+                if version == 'v1':
+                    embeddings[entry.id] = (entry.user_id, entry.target_class, embedding.astype(np.float16))
+
+        def expected(user, query, k, target_class=None):
+            candidates = [
+                (float(np.linalg.norm(query - e.astype(np.float32))), i) for i, (u, c, e) in embeddings.items()
+                if u == user.id and target_class in (None, c)
+            ]
+            return [i for _, i in sorted(candidates)[:k]]
+
+        add_attempts(60)
+        with tempfile.TemporaryDirectory() as index_dir:
+            index = SubmissionIndex.build('v1', index_dir, chunk_size=7)
+            self.assertEqual(len(index), 60)
+            # Newer entries, an entry of another encoder and a deleted entry
+            add_attempts(20)
+            add_attempts(5, version='v0')
+            deleted = next(iter(embeddings))
+            SimilarityHistory.objects.filter(id=deleted).delete()
+            del embeddings[deleted]
+
+            query = rng.normal(size=16).astype(np.float32)
+            for user in users:
+                for target_class in (None, 1):
+                    found = similar_attempts(user.id, query, 'v1', k=4, target_class=target_class, index_dir=index_dir)
+                    self.assertEqual([entry.id for entry, _ in found], expected(user, query, 4, target_class))
+
+            # Without a snapshot everything comes from the database
+            found = similar_attempts(users[0].id, query, 'v1', k=4, index_dir=os.path.join(index_dir, 'missing'))
+            self.assertEqual([entry.id for entry, _ in found], expected(users[0], query, 4))
+
+    def test_entries_embedded_after_the_snapshot_are_found(self):
+        import tempfile
+        import numpy as np
+        from django.contrib.auth.models import User
+        from api.embeddings import SubmissionIndex, similar_attempts, store_embedding
+        from api.models import SimilarityHistory
+
+        user = User.objects.create_user(username='late', password='pass12345')
+        entries = [
+            SimilarityHistory.objects.create(
+                user=user, user_image='similarity/x.png', target_class=0,
+                similarity_score=80.0, distance=0.2, is_same_character=True
+            )
+            for _ in range(4)
+        ]
+        basis = np.eye(4, dtype=np.float32)
+        # Entries 0 and 1 are embedded before the snapshot, 2 and 3 are not yet
+        store_embedding(entries[0].id, basis[0], 'v1')
+        store_embedding(entries[1].id, basis[1], 'v1')
+
+        with tempfile.TemporaryDirectory() as index_dir:
+            index = SubmissionIndex.build('v1', index_dir)
+            self.assertEqual(len(index), 2)
+            self.assertGreaterEqual(index.watermark, entries[3].id)
+
+            # The feedback worker (or embed_history) embeds an older entry afterwards,
+            # and another snapshot entry is re-embedded
+            store_embedding(entries[2].id, basis[2], 'v1')
+            store_embedding(entries[1].id, basis[3], 'v1')
+
+            found = similar_attempts(user.id, basis[2], 'v1', k=3, index_dir=index_dir)
+            self.assertEqual([entry.id for entry, _ in found][:1], [entries[2].id])
+            self.assertAlmostEqual(found[0][1], 0.0, places=3)
+            self.assertEqual(sorted(entry.id for entry, _ in found), sorted(e.id for e in entries[:3]))
+
+            # The re-embedded entry is scored by its stored embedding, not the snapshot's copy
+            found = similar_attempts(user.id, basis[3], 'v1', k=1, index_dir=index_dir)
+            self.assertEqual([(entry.id, round(distance, 3)) for entry, distance in found], [(entries[1].id, 0.0)])
+
+    def test_embed_history_backfills_missing_and_stale_embeddings(self):
+        import tempfile
+        from io import StringIO
+        import numpy as np
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        from django.test import override_settings
+        from api.embeddings import decode_embeddings, store_embedding
+        from api.models import SimilarityHistory
+
+        class FakeEmbedder:
+            embedding_version = 'v2'
+            batches = []
+
+            def embed_batch(self, images, batch_size=None):
+                self.batches.append(len(images))
+                return np.array([[float(np.asarray(image.convert('L'))[0, 0])] * 4 for image in images], np.float32)
+
+        user = User.objects.create_user(username='backfill', password='pass12345')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            entries = []
+            for shade in (10, 20, 30, 40):
+                buffered = BytesIO()
+                Image.new('L', (8, 8), shade).save(buffered, format='PNG')
+                entry = SimilarityHistory(
+                    user=user, target_class=1, similarity_score=80.0, distance=0.2, is_same_character=True
+                )
+                entry.user_image.save(f'user_{shade}.png', ContentFile(buffered.getvalue()), save=False)
+                entry.save()
+                entries.append(entry)
+            store_embedding(entries[1].id, np.zeros(4), 'v1')
+            store_embedding(entries[2].id, np.full(4, 7.0), 'v2')
+            SimilarityHistory.objects.filter(id=entries[3].id).update(user_image='similarity/missing.png')
+
+            with mock.patch('api.feedback.SiameseEmbedder', FakeEmbedder):
+                call_command('embed_history', chunk_size=1, stdout=StringIO(), stderr=StringIO())
+
+        stored = {
+            entry.id: (entry.embedding_version, decode_embeddings([entry.embedding])[0][0] if entry.embedding else None)
+            for entry in SimilarityHistory.objects.filter(user=user)
+        }
+        self.assertEqual(stored, {
+            entries[0].id: ('v2', 10.0),
+            entries[1].id: ('v2', 20.0),
+            entries[2].id: ('v2', 7.0),
+            entries[3].id: (None, None),
+        })
+        self.assertEqual(FakeEmbedder.batches, [1, 1])
+
+    def test_rescore_history_resumes_from_checkpoint(self):
+        import tempfile
+        from io import StringIO
+        import numpy as np
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        from django.test import override_settings
+        from api.models import SimilarityHistory, UserClassStats
+
+        class FakeEmbedder:
+            version = 'model-2'
+            embedding_version = 'v2'
+            chunks = []
+
+            @staticmethod
+            def model_input(image):
+                return float(np.asarray(image.convert('L'))[0, 0])
+
+            def score_batch(self, inputs, target_classes, batch_size=None):
+                self.chunks.append(len(inputs))
+                embeddings = np.array([[shade] * 4 for shade in inputs], np.float32)
+                return embeddings, [(shade, shade / 100, shade < 25) for shade in inputs]
+
+        user = User.objects.create_user(username='rescore', password='pass12345')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            entries = []
+            for shade in (10, 20, 30):
+                buffered = BytesIO()
+                Image.new('L', (8, 8), shade).save(buffered, format='PNG')
+                entry = SimilarityHistory(
+                    user=user, target_class=1, similarity_score=50.0, distance=0.5, is_same_character=False
+                )
+                entry.user_image.save(f'user_{shade}.png', ContentFile(buffered.getvalue()), save=False)
+                entry.save()
+                entries.append(entry)
+            checkpoint = os.path.join(media_root, 'rescore.json')
+
+            with mock.patch('api.feedback.SiameseEmbedder', FakeEmbedder):
+                call_command('rescore_history', chunk_size=1, limit=2, checkpoint=checkpoint, stdout=StringIO())
+                self.assertEqual(
+                    SimilarityHistory.objects.get(id=entries[2].id).similarity_score, 50.0
+                )
+                call_command('rescore_history', chunk_size=1, checkpoint=checkpoint, stdout=StringIO())
+                with open(checkpoint) as f:
+                    progress = json.load(f)
+
+        self.assertEqual(FakeEmbedder.chunks, [1, 1, 1])
+        self.assertEqual(progress['last_id'], entries[2].id)
+        self.assertEqual(progress['rescored'], 3)
+        rescored = SimilarityHistory.objects.filter(user=user).order_by('id').values_list(
+            'similarity_score', 'distance', 'is_same_character', 'embedding_version'
+        )
+        self.assertEqual(list(rescored), [
+            (10.0, 0.1, True, 'v2'),
+            (20.0, 0.2, True, 'v2'),
+            (30.0, 0.3, False, 'v2'),
+        ])
+        # bulk_update skips the rollup signals; the command rebuilds them
+        stats = UserClassStats.objects.get(user=user, target_class=1)
+        self.assertEqual((stats.count, stats.matches, stats.best_score), (3, 2, 30.0))
+
+    def test_rescore_input_tolerance_from_the_stored_display_image(self):
+        from pathlib import Path
+        import cv2 as cv
+        import numpy as np
+        from api.feedback import SiameseEmbedder
+        from api.views import create_comparison_overlay, preprocess_image_array
+
+        upload = np.full((240, 180), 255, np.uint8)
+        cv.line(upload, (40, 50), (140, 60), 0, 9)
+        cv.line(upload, (90, 30), (80, 200), 0, 9)
+        cv.circle(upload, (95, 150), 30, 0, 7)
+        reference = str(Path(__file__).parent / 'reference_images' / 'class_1.png')
+
+        # processed_image_base64 flow: the stored image round-trips to the scored input
+        scored = preprocess_image_array(upload)
+        _, stored, _ = create_comparison_overlay(scored, reference, preprocessed=True)
+        error = np.abs(SiameseEmbedder.model_input(stored).astype(int) - scored.astype(int))
+        self.assertLess(error.mean(), 4)
+
+        # Raw uploads were scored as uploaded; only their preprocessed crop is stored
+        _, stored, _ = create_comparison_overlay(upload, reference)
+        scored = cv.resize(upload, scored.shape[::-1], interpolation=cv.INTER_AREA)
+        error = np.abs(SiameseEmbedder.model_input(stored).astype(int) - scored.astype(int))
+        self.assertGreater(error.mean(), 100)
+
+
+class WriteBehindTestCase(TestCase):
+    """Tests for the write-behind stage (inline, no threads)"""
+    
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        from django.contrib.auth.models import User
+        
+        media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media_dir.cleanup)
+        media_override = override_settings(MEDIA_ROOT=media_dir.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.media_root = media_dir.name
+        self.journal = os.path.join(media_dir.name, 'journal')
+        self.user = User.objects.create_user(username='writer', password='pass12345')
+    
+    def stored_files(self):
+        return [name for _, _, names in os.walk(os.path.join(self.media_root, 'predictions')) for name in names]
+    
+    def test_prediction_row_and_image_are_written(self):
+        from api.models import PredictionHistory
+        from api.write_behind import WriteBehind
+        
+        WriteBehind(threads=0, journal_dir=self.journal).add_prediction(self.user, 'upload.png', b'png-bytes', 7, 91.5)
+        
+        row = PredictionHistory.objects.get(user=self.user)
+        self.assertEqual((row.predicted_class, row.confidence), (7, 91.5))
+        with row.image.open('rb') as f:
+            self.assertEqual(f.read(), b'png-bytes')
+    
+    def test_failed_writes_are_journaled_and_replayed(self):
+        from unittest import mock
+        from django.db import DatabaseError
+        from api.models import PredictionHistory
+        from api.write_behind import WriteBehind, replay_journal
+        
+        writer = WriteBehind(threads=0, journal_dir=self.journal)
+        with mock.patch.object(PredictionHistory.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            writer.add_prediction(self.user, 'upload.png', b'png-bytes', 7, 91.5)
+        self.assertEqual(writer.journaled, 1)
+        self.assertFalse(PredictionHistory.objects.exists())
+        
+        self.assertEqual(replay_journal(self.journal), (1, 0))
+        self.assertEqual(PredictionHistory.objects.filter(user=self.user).count(), 1)
+        # The image stored by the failed attempt is reused, not written twice
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertEqual(os.listdir(self.journal), [])
+
+    def test_replay_skips_corrupt_entries_and_reclaims_orphans(self):
+        import subprocess
+        import sys
+        from unittest import mock
+        from django.db import DatabaseError
+        from api.models import PredictionHistory
+        from api.write_behind import WriteBehind, replay_journal
+
+        writer = WriteBehind(threads=0, journal_dir=self.journal)
+        with mock.patch.object(PredictionHistory.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            writer.add_prediction(self.user, 'first.png', b'png-1', 1, 90.0)
+            writer.add_prediction(self.user, 'second.png', b'png-2', 2, 80.0)
+        first, second = sorted(os.listdir(self.journal))
+        # A truncated entry sorted first, and one claimed by a replay whose process died
+        with open(os.path.join(self.journal, '0-truncated.json'), 'w') as f:
+            f.write('{"kind": "predictions", "rows": [')
+        finished = subprocess.Popen([sys.executable, '-c', ''])
+        finished.wait()
+        dead = finished.pid
+        os.rename(os.path.join(self.journal, second), os.path.join(self.journal, second[:-5] + f'.replaying-{dead}'))
+
+        self.assertEqual(replay_journal(self.journal), (2, 1))
+        self.assertEqual(
+            sorted(PredictionHistory.objects.filter(user=self.user).values_list('predicted_class', flat=True)), [1, 2]
+        )
+        self.assertEqual(os.listdir(self.journal), ['0-truncated.corrupt'])
+
+
+class HuggingFaceClientTestCase(SimpleTestCase):
+    """Tests for the pooled HF Space client against a local stub Gradio app"""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import socket
+        try:
+            import gradio as gr
+        except ImportError:
+            raise unittest.SkipTest("gradio not installed")
+        
+        cls.delays = []  # Seconds to stall the next calls, one entry per call
+        cls.calls = []
+        
+        def stall():
+            cls.calls.append(time.monotonic())
+            if cls.delays:
+                time.sleep(cls.delays.pop(0))
+        
+        def predict_class(path):
+            stall()
+            return {'predicted_class': 7, 'confidence': 0.9, 'size': list(Image.open(path).size)}
+        
+        def compute_similarity(path1, path2):
+            stall()
+            img = Image.open(path1)
+            return {'similarity_score': 80.0, 'distance': 0.2}, Image.open(path2), img, img
+        
+        with gr.Blocks(analytics_enabled=False) as cls.app:
+            image1, image2 = gr.Image(type='filepath'), gr.Image(type='filepath')
+            scores, ref_out, user_out, overlay_out = gr.JSON(), gr.Image(), gr.Image(), gr.Image()
+            gr.Button().click(predict_class, image1, scores, api_name='predict_class', concurrency_limit=None)
+            gr.Button().click(
+                compute_similarity, [image1, image2], [scores, ref_out, user_out, overlay_out],
+                api_name='compute_similarity', concurrency_limit=None
+            )
+        
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        cls.app.launch(server_name='127.0.0.1', server_port=port, prevent_thread_lock=True, quiet=True)
+        cls.url = f'http://127.0.0.1:{port}'
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.app.close()
+        super().tearDownClass()
+    
+    def setUp(self):
+        self.delays.clear()
+        self.calls.clear()
+    
+    def _client(self, **kwargs):
+        from api.ml_models.hf_client import HuggingFaceMLClient
+        options = {'pool_size': 4, 'timeout': 10, 'retries': 0, 'backoff': 0.05, 'hedge_after': 0}
+        options.update(kwargs)
+        return HuggingFaceMLClient(self.url, **options)
+    
+    def _png(self, size=(40, 30)):
+        buffered = BytesIO()
+        Image.new('L', size, 255).save(buffered, format='PNG')
+        return buffered.getvalue()
+    
+    def test_uploads_from_memory(self):
+        client = self._client()
+        self.assertEqual(client.predict(self._png()), {'class': 7, 'confidence': 0.9})
+        
+        score, distance, ref_img, user_img, overlay_img = client.compute_similarity(
+            self._png((40, 30)), Image.new('L', (20, 10), 0)
+        )
+        self.assertEqual((score, distance), (80.0, 0.2))
+        self.assertEqual(ref_img.size, (20, 10))
+        self.assertEqual(user_img.size, (40, 30))
+    
+    def test_predict_many_runs_calls_concurrently(self):
+        client = self._client()
+        self.delays.extend([1.0] * 4)
+        
+        start = time.monotonic()
+        results = client.predict_many([self._png() for _ in range(4)])
+        
+        self.assertEqual([r['class'] for r in results], [7] * 4)
+        self.assertLess(time.monotonic() - start, 3)
+    
+    def test_timed_out_call_is_retried(self):
+        client = self._client(timeout=1, retries=1)
+        self.delays.append(3)
+        
+        self.assertEqual(client.predict(self._png())['class'], 7)
+        self.assertEqual(len(self.calls), 2)
+    
+    def test_slow_call_is_hedged(self):
+        client = self._client(hedge_after=0.2)
+        self.delays.append(3)
+        
+        start = time.monotonic()
+        self.assertEqual(client.predict(self._png())['class'], 7)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(len(self.calls), 2)
+
+
+class InferenceRouterTestCase(SimpleTestCase):
+    """Tests for hybrid local/remote routing (fake backends, no models)"""
+    
+    def _router(self, **kwargs):
+        from api.ml_models.router import InferenceRouter
+        options = {
+            'mode': 'hybrid', 'local_factory': lambda: 'local-model', 'remote_factory': lambda: 'remote-model',
+            'spill_depth': 2, 'breaker_failures': 2, 'breaker_cooldown': 60, 'shadow_rate': 0
+        }
+        options.update(kwargs)
+        return InferenceRouter(**options)
+
+    @staticmethod
+    def _space_down():
+        raise TimeoutError('HF API call /predict_class timed out after 30s')
+    
+    def test_stays_local_until_local_backs_up(self):
+        from concurrent.futures import ThreadPoolExecutor
+        import threading
+        
+        router = self._router()
+        release = threading.Event()
+        started = threading.Barrier(3)
+        
+        def slow_local(route):
+            if not route.remote:
+                started.wait()
+                release.wait()
+            return route.backend
+        
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            busy = [pool.submit(router.run, slow_local) for _ in range(2)]
+            started.wait()
+            # Two local requests in flight = spill depth: the next one spills
+            self.assertEqual(router.run(lambda route: route.backend)[0], 'remote')
+            release.set()
+            self.assertEqual([f.result()[0] for f in busy], ['local', 'local'])
+        
+        self.assertEqual(router.run(lambda route: route.backend)[0], 'local')
+    
+    def test_shipped_defaults_spill_when_every_thread_is_busy(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from unittest import mock
+        import runpy
+        import threading
+        from django.conf import settings
+        from api.ml_models.router import InferenceRouter
+
+        with mock.patch.dict(os.environ, {}, clear=False):
+            os.environ.pop('GUNICORN_THREADS', None)
+            threads = runpy.run_path(str(settings.BASE_DIR / 'gunicorn.conf.py'))['threads']
+        # The default spill depth, not the one _router uses
+        router = InferenceRouter(
+            mode='hybrid', local_factory=lambda: 'local-model', remote_factory=lambda: 'remote-model'
+        )
+        self.assertLess(router.spill_depth, threads)
+
+        # Fill the worker's threads one request at a time, as gunicorn would
+        release = threading.Event()
+        backends = []
+        with ThreadPoolExecutor(max_workers=threads - 1) as pool:
+            for _ in range(threads - 1):
+                entered = threading.Event()
+
+                def request(route, entered=entered):
+                    backends.append(route.backend)
+                    entered.set()
+                    if not route.remote:
+                        release.wait()
+                    return route.backend
+                pool.submit(router.run, request)
+                entered.wait()
+            # The last free thread's request finds the others all busy locally
+            self.assertEqual(router.run(lambda route: route.backend)[0], 'remote')
+            release.set()
+        self.assertIn('remote', backends)
+        self.assertEqual(backends[:router.spill_depth], ['local'] * router.spill_depth)
+
+    def test_remote_failures_fail_over_and_open_circuit(self):
+        router = self._router(spill_depth=0)
+        calls = []
+        
+        def infer(route):
+            calls.append(route.backend)
+            return route.timed(lambda: route.backend if not route.remote else self._space_down())()
+        
+        self.assertEqual(router.run(infer)[0], 'local')
+        self.assertEqual(router.run(infer)[0], 'local')
+        self.assertEqual(calls, ['remote', 'local', 'remote', 'local'])
+        self.assertEqual(router.breaker.state, 'open')
+        
+        # Circuit open: requests no longer try the Space
+        calls.clear()
+        self.assertEqual(router.run(infer)[0], 'local')
+        self.assertEqual(calls, ['local'])
+
+    def test_cached_trial_call_does_not_hold_circuit_open(self):
+        router = self._router(spill_depth=0)
+        failing = lambda route: route.timed(lambda: route.backend if not route.remote else self._space_down())()
+        router.run(failing)
+        router.run(failing)
+        self.assertEqual(router.breaker.state, 'open')
+        router.breaker.cooldown = 0
+
+        # The half-open trial is answered from the result cache: no outcome recorded
+        self.assertEqual(router.run(lambda route: f'cached-{route.backend}')[0], 'cached-remote')
+        self.assertEqual(router.breaker.state, 'half-open')
+
+        # The next request gets the trial call, and its success closes the circuit
+        self.assertEqual(router.run(lambda route: route.timed(lambda: route.backend)())[0], 'remote')
+        self.assertEqual(router.breaker.state, 'closed')
+
+    def test_rejected_inputs_neither_fail_over_nor_open_circuit(self):
+        import httpx
+        from gradio_client.exceptions import AppError
+
+        router = self._router(spill_depth=0)
+        calls = []
+
+        def wrapped(error):
+            # As HuggingFaceMLClient.predict reports errors
+            try:
+                raise error
+            except Exception as e:
+                raise Exception(f'HF API prediction failed: {e}')
+
+        def status_error(code):
+            request = httpx.Request('POST', 'https://space.example/upload')
+            return httpx.HTTPStatusError(str(code), request=request, response=httpx.Response(code, request=request))
+
+        def infer(error):
+            def run(route):
+                calls.append(route.backend)
+                return route.timed(lambda: route.backend if not route.remote else wrapped(error))()
+            return run
+
+        # Bad input is reported to the caller once, and the Space stays in use
+        for error in (AppError('Could not read image'), status_error(413)) * 2:
+            with self.assertRaisesRegex(Exception, 'HF API prediction failed'):
+                router.run(infer(error))
+        self.assertEqual(calls, ['remote'] * 4)
+        self.assertEqual(router.breaker.state, 'closed')
+        self.assertEqual(router.stats['remote'].error_rate(), 0.0)
+
+        # Server errors and dropped connections are the Space's failures
+        calls.clear()
+        self.assertEqual(router.run(infer(status_error(503)))[0], 'local')
+        self.assertEqual(router.run(infer(httpx.ConnectError('connection refused')))[0], 'local')
+        self.assertEqual(calls, ['remote', 'local', 'remote', 'local'])
+        self.assertEqual(router.breaker.state, 'open')
+
+    def test_shadow_comparison_records_agreement(self):
+        router = self._router(shadow_rate=1.0)
+        
+        router.run(lambda route: 'same', agree=lambda a, b: a == b)
+        router.run(lambda route: route.backend, agree=lambda a, b: a == b)
+        router._shadow_executor.shutdown(wait=True)
+        
+        self.assertEqual(router.shadow_compared, 2)
+        self.assertEqual(router.summary()['shadow_agreement'], 0.5)
+
+
+class HistoryPaginationTestCase(TestCase):
+    """Tests for keyset-paginated history endpoints"""
+    
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from api.models import PredictionHistory
+        
+        self.user = User.objects.create_user(username='history', password='pass12345')
+        other = User.objects.create_user(username='other', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        
+        rows = [PredictionHistory(user=self.user, image=f'predictions/{i}.png', predicted_class=i, confidence=90.0)
+                for i in range(5)]
+        rows.append(PredictionHistory(user=other, image='predictions/other.png', predicted_class=9, confidence=90.0))
+        PredictionHistory.objects.bulk_create(rows)
+        # Equal timestamps: the id tie-break must still give a stable order
+        PredictionHistory.objects.update(created_at=PredictionHistory.objects.first().created_at)
+    
+    def test_pages_cover_all_rows_once(self):
+        seen, url = [], '/api/history/predictions/?limit=2'
+        while url:
+            data = self.client.get(url).data
+            self.assertLessEqual(data['count'], 2)
+            seen.extend(p['predicted_class'] for p in data['predictions'])
+            url = data['next']
+        
+        self.assertEqual(seen, [4, 3, 2, 1, 0])
+    
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/history/predictions/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_similarity_filters(self):
+        from api.models import SimilarityHistory
+        
+        for target_class, matched in [(1, True), (1, False), (2, True), (2, True)]:
+            SimilarityHistory.objects.create(
+                user=self.user, user_image='similarity/u.png', target_class=target_class,
+                similarity_score=90.0 if matched else 40.0, distance=0.1, is_same_character=matched
+            )
+        
+        data = self.client.get('/api/history/similarities/?target_class=2&matched=true').data
+        self.assertEqual([s['target_class'] for s in data['similarities']], [2, 2])
+        data = self.client.get('/api/history/similarities/?matched=false').data
+        self.assertEqual([s['is_same_character'] for s in data['similarities']], [False])
+        response = self.client.get('/api/history/similarities/?matched=maybe')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UserStatisticsTestCase(TestCase):
+    """Tests for the rollup-backed statistics endpoint"""
+    
+    def setUp(self):
+        from django.contrib.auth.models import User
+        
+        self.user = User.objects.create_user(username='stats', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def add(self, target_class, score):
+        from api.models import SimilarityHistory
+        return SimilarityHistory.objects.create(
+            user=self.user, user_image='similarity/u.png', target_class=target_class,
+            similarity_score=score, distance=0.1, is_same_character=score >= 75
+        )
+    
+    def expected(self, rows):
+        scores = [row.similarity_score for row in rows]
+        return {
+            'total_analyses': len(rows),
+            'average_score': round(sum(scores) / len(scores), 2),
+            'best_score': round(max(scores), 2),
+            'total_matches': sum(row.is_same_character for row in rows),
+            'high_scores': sum(score >= 90 for score in scores),
+            'characters_attempted': len({row.target_class for row in rows}),
+        }
+    
+    def assertStats(self, stats, rows):
+        self.assertEqual({key: stats[key] for key in self.expected(rows)}, self.expected(rows))
+    
+    def test_rollups_follow_inserts_and_deletes(self):
+        from api.models import UserClassStats
+        from api.stats import user_statistics
+        
+        rows = [self.add(3, 95.0), self.add(3, 80.0), self.add(7, 60.0)]
+        with self.assertNumQueries(1):
+            stats = user_statistics(self.user)
+        self.assertStats(stats, rows)
+        self.assertEqual(stats['most_practiced_character'], 3)
+        
+        response = self.client.delete(f'/api/history/similarities/{rows[0].id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = self.client.get('/api/user/statistics/').data['statistics']
+        self.assertStats(stats, rows[1:])
+        
+        rows[2].delete()
+        self.assertFalse(UserClassStats.objects.filter(user=self.user, target_class=7).exists())
+        self.assertStats(user_statistics(self.user), rows[1:2])
+    
+    def test_bulk_and_cascading_deletes_refresh_each_bucket_once(self):
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from api.models import SimilarityHistory, UserClassStats, UserDailyStats
+        from api.stats import user_statistics
+
+        rows = [self.add(target_class, 50.0 + i) for i in range(15) for target_class in (3, 7)]
+
+        # One QuerySet.delete over 20 rows in two buckets: two refreshes, not twenty
+        doomed = SimilarityHistory.objects.filter(id__in=[row.id for row in rows[:20]])
+        with CaptureQueriesContext(connection) as deleting:
+            doomed.delete()
+        # Each refresh aggregates the bucket's class and day from the history
+        aggregates = [q for q in deleting.captured_queries if q['sql'].startswith('SELECT COUNT(')]
+        self.assertEqual(len(aggregates), 4)
+        self.assertStats(user_statistics(self.user), rows[20:])
+
+        # Deleting the user removes their rollups with them, at a cost independent of their history
+        other = User.objects.create_user(username='bystander', password='pass12345')
+        SimilarityHistory.objects.create(
+            user=other, user_image='similarity/u.png', target_class=3,
+            similarity_score=70.0, distance=0.1, is_same_character=False
+        )
+        with CaptureQueriesContext(connection) as deleting:
+            self.user.delete()
+        self.assertFalse([q for q in deleting.captured_queries if 'COUNT' in q['sql']])
+        self.assertFalse(UserClassStats.objects.exclude(user=other).exists())
+        self.assertFalse(UserDailyStats.objects.exclude(user=other).exists())
+        self.assertEqual(UserClassStats.objects.get(user=other).count, 1)
+
+    def test_edit_moving_an_entry_refreshes_both_buckets(self):
+        from datetime import timedelta
+        from api.models import UserClassStats, UserDailyStats
+
+        rows = [self.add(3, 95.0), self.add(3, 80.0)]
+        moved = rows[0]
+        moved.target_class = 7
+        moved.created_at -= timedelta(days=2)
+        moved.save()
+
+        class_rows = dict(UserClassStats.objects.filter(user=self.user).values_list('target_class', 'count'))
+        self.assertEqual(class_rows, {3: 1, 7: 1})
+        daily_rows = set(UserDailyStats.objects.filter(user=self.user).values_list('target_class', 'day', 'count'))
+        self.assertEqual(daily_rows, {
+            (3, rows[1].created_at.date(), 1),
+            (7, moved.created_at.date(), 1),
+        })
+        self.assertEqual(UserClassStats.objects.get(user=self.user, target_class=3).best_score, 80.0)
+
+    def test_date_ranges_combine_buckets_and_partial_days(self):
+        from datetime import datetime, timedelta, timezone
+        from api.models import SimilarityHistory
+        from api.stats import rebuild_statistics, user_statistics
+        
+        base = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        for hours in range(0, 24 * 6, 7):
+            row = self.add(hours % 5, 50.0 + hours % 50)
+            # Backdating skips the signals, so the rollups are rebuilt below
+            SimilarityHistory.objects.filter(pk=row.pk).update(created_at=base + timedelta(hours=hours))
+        rebuild_statistics([self.user.id])
+        rows = list(SimilarityHistory.objects.filter(user=self.user))
+        
+        ranges = [
+            (base + timedelta(hours=5), base + timedelta(days=4, hours=13)),
+            (base + timedelta(days=1), base + timedelta(days=3)),
+            (base + timedelta(days=2, hours=3), base + timedelta(days=2, hours=20)),
+            (base + timedelta(days=3, hours=1), None),
+            (None, base + timedelta(days=1, hours=9)),
+        ]
+        for start, end in ranges:
+            with self.subTest(start=start, end=end):
+                in_range = [
+                    row for row in rows
+                    if (start is None or row.created_at >= start) and (end is None or row.created_at <= end)
+                ]
+                self.assertStats(user_statistics(self.user, start=start, end=end), in_range)
+        
+        stats = user_statistics(self.user, target_class=2, start=ranges[0][0], end=ranges[0][1])
+        self.assertStats(stats, [
+            row for row in rows if row.target_class == 2 and ranges[0][0] <= row.created_at <= ranges[0][1]
+        ])
+    
+    def test_no_analyses(self):
+        response = self.client.get('/api/user/statistics/?days=7')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['statistics']['total_analyses'], 0)
+
+
 def run_tests():
     """Helper function to run tests programmatically"""
     import sys
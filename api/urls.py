@@ -2,8 +2,8 @@
 from django.urls import path
 from .views import (
     SignupView, SigninView, ChangePasswordView, ChangeUsernameView,
-    PredictView, SimilarityView, PredictionHistoryView, SimilarityHistoryView,
-    FeedbackView, UserStatisticsView
+    PredictView, BatchPredictView, WorksheetView, SimilarityView, RankSimilarityView, AnalyzeView, PredictionHistoryView, SimilarityHistoryView,
+    SimilarAttemptsView, FeedbackView, FeedbackJobView, UserStatisticsView
 )
 
 urlpatterns = [
@@ -14,13 +14,19 @@ urlpatterns = [
 
 
     path('predict/', PredictView.as_view(), name='predict'),
+    path('predict/batch/', BatchPredictView.as_view(), name='predict-batch'),
+    path('predict/worksheet/', WorksheetView.as_view(), name='predict-worksheet'),
     path('similarity/', SimilarityView.as_view(), name='similarity'),
+    path('similarity/rank/', RankSimilarityView.as_view(), name='similarity-rank'),
+    path('analyze/', AnalyzeView.as_view(), name='analyze'),
     
     path('feedback/', FeedbackView.as_view(), name='feedback'),
+    path('feedback/<int:job_id>/', FeedbackJobView.as_view(), name='feedback-job'),
     
     path('history/predictions/', PredictionHistoryView.as_view(), name='prediction-history'),
     path('history/similarities/', SimilarityHistoryView.as_view(), name='similarity-history'),
     path('history/similarities/<int:history_id>/', SimilarityHistoryView.as_view(), name='similarity-history-delete'),
+    path('history/similarities/<int:history_id>/similar/', SimilarAttemptsView.as_view(), name='similarity-history-similar'),
     
     path('user/statistics/', UserStatisticsView.as_view(), name='user-statistics'),
 
@@ -9,47 +9,74 @@ from django.contrib.auth.hashers import check_password
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from .serializers import SignupSerializer, SigninSerializer, ImageSerializer, SimilaritySerializer, FeedbackSerializer
+from .serializers import SignupSerializer, SigninSerializer, ImageSerializer, BatchImageSerializer, WorksheetSerializer, SimilaritySerializer, RankSimilaritySerializer, AnalyzeSerializer, FeedbackSerializer
 from rest_framework.parsers import MultiPartParser, FormParser
 from io import BytesIO
-from PIL import Image, ImageOps
+from PIL import Image
 import tempfile
 import os
+import zipfile
 import base64
 import numpy as np
 import cv2 as cv
-from django.core.files.base import ContentFile
-from .models import PredictionHistory, SimilarityHistory
-import google.generativeai as genai
+from .models import PredictionHistory, SimilarityHistory, FeedbackJob
+from .feedback import enqueue_feedback
+from .embeddings import decode_embeddings, nearest_reference, similar_attempts
+from .pagination import KeysetPagination
+from .stats import user_statistics
+from .write_behind import get_writer
+from .result_cache import CACHE_HEADER, cached_result, image_digest, model_version
+from .ml_models.config import SIMILARITY_THRESHOLD
+from .ml_models.router import BACKEND_HEADER, get_router
 from django.conf import settings
-from django.db.models import Avg, Count, Max, Q
+from django.db import transaction
+from django.utils import timezone
 from datetime import datetime, timedelta
 
-# Use HuggingFace Space API instead of local models
-_hf_client = None
-_use_hf_api = None
-_reference_image_cache = {}  # Cache for reference images
-
-def get_ml_client():
-	global _hf_client, _use_hf_api
-	if _hf_client is None:
-		# Check if we should use HF or local models
-		_use_hf_api = os.getenv('USE_HUGGINGFACE_API', 'False') == 'True'
-		if _use_hf_api:
-			from .ml_models.hf_client import get_hf_client
-			_hf_client = get_hf_client()
-		else:
-			# Fallback to local models
-			from .ml_models import get_classification_model
-			_hf_client = get_classification_model()
-	return _hf_client
-
-def is_using_hf_api():
-	"""Check if using HuggingFace API"""
-	global _use_hf_api
-	if _use_hf_api is None:
-		_use_hf_api = os.getenv('USE_HUGGINGFACE_API', 'False') == 'True'
-	return _use_hf_api
+_reference_image_cache = {}  # Cache for reference images (overlay layers)
+
+# Batch prediction limits
+MAX_BATCH_IMAGES = 50
+MAX_ARCHIVE_ENTRY_SIZE = 10 * 1024 * 1024  # 10 MB per image inside a zip
+ARCHIVE_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+MAX_WORKSHEET_GLYPHS = 100
+
+# Most past attempts returned by a similar-attempts search
+MAX_SIMILAR_ATTEMPTS = 50
+
+# Display size of the similarity comparison images
+OVERLAY_SIZE = (256, 256)
+
+def same_prediction(primary, shadow):
+	"""Shadow-comparison check: both backends predicted the same class"""
+	return primary[0]['class'] == shadow[0]['class']
+
+
+def close_similarity(primary, shadow, tolerance=10.0):
+	"""Shadow-comparison check: similarity scores within `tolerance` points"""
+	return abs(primary[0]['similarity_score'] - shadow[0]['similarity_score']) <= tolerance
+
+
+def same_analysis(primary, shadow, tolerance=10.0):
+	"""Shadow-comparison check for analyze: same class and similarity scores within `tolerance`"""
+	primary, shadow = primary[0], shadow[0]
+	if primary['result']['class'] != shadow['result']['class']:
+		return False
+	if 'similarity_score' not in primary or 'similarity_score' not in shadow:
+		return 'similarity_score' not in primary and 'similarity_score' not in shadow
+	return abs(primary['similarity_score'] - shadow['similarity_score']) <= tolerance
+
+
+def same_batch_predictions(primary, shadow):
+	"""Shadow-comparison check for batches: same class for every image"""
+	return [p['class'] for _, p in primary[0]] == [p['class'] for _, p in shadow[0]]
+
+
+def routed_response(response, cache_hit, route):
+	"""Tag a response with its cache status and the backend that served it"""
+	response[CACHE_HEADER] = 'HIT' if cache_hit else 'MISS'
+	response[BACKEND_HEADER] = route.backend
+	return response
 
 def get_reference_image_path(target_class):
 	"""Get reference image path with validation"""
@@ -117,144 +144,217 @@ class ChangeUsernameView(APIView):
 		return Response({'message': 'Username updated successfully.'}, status=status.HTTP_200_OK)
 
 
-def preprocess_image(image_path):
+def decode_image(image_data):
+	"""Decode uploaded image bytes into a grayscale array"""
+	img = cv.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv.IMREAD_COLOR)
+	if img is None:
+		# Formats OpenCV cannot decode - let PIL try before giving up
+		img = Image.open(BytesIO(image_data)).convert('L')
+		return np.array(img)
+	return cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+
+
+def encode_png_base64(img):
+	"""Encode an image array as base64 PNG for the frontend"""
+	_, buffer = cv.imencode('.png', img)
+	return base64.b64encode(buffer).decode('utf-8')
+
+
+def _character_mask(img_gray):
+	"""Binary mask (white strokes on black) and its significant contours"""
+	# Threshold: white letter on black background
+	_, thresh = cv.threshold(img_gray, 0, 255, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
+	
+	# Optional clean-up: remove tiny dots or gaps
+	kernel = np.ones((2, 2), np.uint8)
+	thresh = cv.erode(thresh, kernel, iterations=1)
+	
+	# Find contours
+	contours, _ = cv.findContours(thresh, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+	if not contours:
+		raise ValueError("No contours found in image")
+	
+	# Filter out very small areas (noise)
+	filtered = [c for c in contours if cv.contourArea(c) > 100]
+	if not filtered:
+		raise ValueError("No significant contours found after filtering")
+	
+	return thresh, filtered
+
+
+def _merge_near_contours(main_contour, contours, margin=10):
+	"""Contours whose bounding boxes overlap or lie within margin px of main_contour's box"""
+	x_main, y_main, w_main, h_main = cv.boundingRect(main_contour)
+	main_box = np.array([x_main, y_main, x_main + w_main, y_main + h_main])
+	
+	close_contours = [main_contour]
+	
+	for cnt in contours:
+		if cnt is main_contour:
+			continue
+		x, y, w, h = cv.boundingRect(cnt)
+		# Compute overlap or closeness
+		if not (x + w < main_box[0] - margin or x > main_box[2] + margin or
+				y + h < main_box[1] - margin or y > main_box[3] + margin):
+			close_contours.append(cnt)
+	
+	return close_contours
+
+
+def _normalize_region(thresh, contours):
+	"""Crop the merged contours, center them in a square and resize to 64x64"""
+	# Get bounding box around merged contours
+	x, y, w, h = cv.boundingRect(np.vstack(contours))
+	
+	# Crop the region
+	cropped = thresh[y:y+h, x:x+w]
+	
+	# Center the cropped region in a square
+	side = max(w, h)
+	square = np.zeros((side, side), dtype=np.uint8)
+	start_x = (side - w) // 2
+	start_y = (side - h) // 2
+	square[start_y:start_y+h, start_x:start_x+w] = cropped
+	
+	# Resize to 64x64
+	return cv.resize(square, (64, 64), interpolation=cv.INTER_AREA), (x, y, w, h)
+
+
+def preprocess_image_array(img_gray):
+	"""
+	Crop, center and resize the character in a grayscale image to 64x64
+	
+	Returns the processed array, or the input unchanged if no character
+	could be isolated.
+	"""
 	try:
-		# Read image
-		img = cv.imread(image_path)
-		if img is None:
-			raise ValueError(f"Error: Could not read image from {image_path}")
-		
-		# Convert to grayscale
-		img_gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-		
-		# Threshold: white letter on black background
-		_, thresh = cv.threshold(img_gray, 0, 255, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
-		
-		# Optional clean-up: remove tiny dots or gaps
-		kernel = np.ones((2, 2), np.uint8)
-		thresh = cv.erode(thresh, kernel, iterations=1)
-		
-		# Find contours
-		contours, _ = cv.findContours(thresh, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-		if not contours:
-			raise ValueError("No contours found in image")
-		
-		# Filter out very small areas (noise)
-		filtered = [c for c in contours if cv.contourArea(c) > 100]
-		if not filtered:
-			raise ValueError("No significant contours found after filtering")
+		thresh, contours = _character_mask(img_gray)
 		
 		# Selective merging: keep contours that are near the largest one
-		main_contour = max(filtered, key=cv.contourArea)
-		x_main, y_main, w_main, h_main = cv.boundingRect(main_contour)
-		main_box = np.array([x_main, y_main, x_main + w_main, y_main + h_main])
-		
-		close_contours = [main_contour]
-		
-		for cnt in filtered:
-			if cnt is main_contour:
-				continue
-			x, y, w, h = cv.boundingRect(cnt)
-			# Compute overlap or closeness
-			if not (x + w < main_box[0] - 10 or x > main_box[2] + 10 or
-					y + h < main_box[1] - 10 or y > main_box[3] + 10):
-				close_contours.append(cnt)
-		
-		# Merge selected contours
-		all_points = np.vstack(close_contours)
-		
-		# Get bounding box around merged contours
-		x, y, w, h = cv.boundingRect(all_points)
-		
-		# Crop the region
-		cropped = thresh[y:y+h, x:x+w]
-		
-		# Center the cropped region in a square
-		side = max(w, h)
-		square = np.zeros((side, side), dtype=np.uint8)
-		start_x = (side - w) // 2
-		start_y = (side - h) // 2
-		square[start_y:start_y+h, start_x:start_x+w] = cropped
-		
-		# Resize to 64x64
-		resized = cv.resize(square, (64, 64), interpolation=cv.INTER_AREA)
-		
-		# Save processed image to temporary file
-		with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_processed:
-			processed_path = tmp_processed.name
-			cv.imwrite(processed_path, resized)
-		
-		# Convert to base64 for frontend
-		_, buffer = cv.imencode('.png', resized)
-		img_base64 = base64.b64encode(buffer).decode('utf-8')
-		
-		return processed_path, img_base64
+		main_contour = max(contours, key=cv.contourArea)
+		processed, _ = _normalize_region(thresh, _merge_near_contours(main_contour, contours))
+		return processed
 	
 	except Exception as e:
-		# If preprocessing fails, return original image
+		# If preprocessing fails, use original image
 		print(f"Preprocessing error: {str(e)}. Using original image.")
-		img = Image.open(image_path)
-		buffered = BytesIO()
-		img.save(buffered, format="PNG")
-		img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-		return image_path, img_base64
-		# Fallback: minimal preprocessing
-		print(f"Preprocessing error: {str(e)}. Using fallback.")
-		try:
-			img = cv.imread(image_path, cv.IMREAD_GRAYSCALE)
-			if img is None:
-				raise
-			# Apply threshold and resize without cropping
-			_, thresh = cv.threshold(img, 0, 255, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
-			resized = cv.resize(thresh, (64, 64), interpolation=cv.INTER_AREA)
-			_, buffer = cv.imencode('.png', resized)
-			img_base64 = base64.b64encode(buffer.tobytes()).decode('utf-8')
-			
-			# Save fallback
-			with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_processed:
-				fallback_path = tmp_processed.name
-				cv.imwrite(fallback_path, resized)
-			
-			return fallback_path, img_base64
-		except:
-			# Ultimate fallback - just resize original
-			img = Image.open(image_path).convert('L')
-			img = img.resize((64, 64), Image.Resampling.LANCZOS)
-			buffered = BytesIO()
-			img.save(buffered, format="PNG")
-			img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-			return image_path, img_base64
+		return img_gray
+
+
+def segment_characters(img_gray):
+	"""
+	Extract every character on a page, normalized to 64x64
+	
+	Contours are grouped with the same near-box rule as preprocess_image_array,
+	taking the largest unassigned contour as the next group's anchor.
+	
+	Returns:
+		list of (processed_array, (x, y, w, h)) in reading order
+		(top-to-bottom lines, left-to-right within a line)
+	"""
+	thresh, contours = _character_mask(img_gray)
+	remaining = sorted(contours, key=cv.contourArea, reverse=True)
+	
+	glyphs = []
+	while remaining:
+		group = _merge_near_contours(remaining[0], remaining[1:])
+		grouped_ids = {id(c) for c in group}
+		remaining = [c for c in remaining if id(c) not in grouped_ids]
+		glyphs.append(_normalize_region(thresh, group))
+	
+	# Reading order: start a new line when a glyph begins below the current line
+	glyphs.sort(key=lambda glyph: glyph[1][1])
+	lines, line_bottom = [], None
+	for glyph in glyphs:
+		x, y, w, h = glyph[1]
+		if line_bottom is None or y > line_bottom:
+			lines.append([])
+			line_bottom = y + h
+		else:
+			line_bottom = max(line_bottom, y + h)
+		lines[-1].append(glyph)
+	
+	return [glyph for line in lines for glyph in sorted(line, key=lambda g: g[1][0])]
+
+
+def preprocess_image(image_path):
+	"""
+	Path-based wrapper around preprocess_image_array
+	
+	Returns the path of a temporary PNG holding the processed image (caller
+	deletes it) and its base64 encoding.
+	"""
+	with open(image_path, 'rb') as f:
+		processed = preprocess_image_array(decode_image(f.read()))
+	
+	with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_processed:
+		processed_path = tmp_processed.name
+		cv.imwrite(processed_path, processed)
+	
+	return processed_path, encode_png_base64(processed)
+
+
+def _overlay_reference_layer(reference_image_path):
+	"""Display-size reference image and its composite over white, computed once per reference"""
+	cached = _reference_image_cache.get(reference_image_path)
+	if cached is None:
+		ref_img = Image.open(reference_image_path).convert('L').resize(OVERLAY_SIZE, Image.Resampling.LANCZOS)
+		ref_array = np.asarray(ref_img, dtype=np.float32)
+		# Reference layer (full opacity): alpha = 255 - value, over a white background
+		ref_alpha = (255 - ref_array) / 255
+		ref_base = ref_array * ref_alpha + 255 * (1 - ref_alpha)
+		cached = (ref_img.convert('RGB'), ref_base)
+		_reference_image_cache[reference_image_path] = cached
+	return cached
+
+
+def create_comparison_overlay(user_image, reference_image_path, preprocessed=False):
+	"""Create comparison overlay with preprocessed user image and original reference"""
+	# Preprocess only user image (grayscale array), unless the caller already did
+	if not preprocessed:
+		user_image = preprocess_image_array(user_image)
+	ref_output, ref_base = _overlay_reference_layer(reference_image_path)
+	
+	# Invert user image and resize to display size
+	user_img = Image.fromarray(255 - np.asarray(user_image, dtype=np.uint8))
+	user_img = user_img.resize(OVERLAY_SIZE, Image.Resampling.LANCZOS)
+	user_array = np.asarray(user_img, dtype=np.float32)
+	
+	# User layer (80% opacity) over the reference layer
+	user_alpha = np.floor((255 - user_array) * 0.8) / 255
+	blended = user_array * user_alpha + ref_base * (1 - user_alpha)
+	blended = np.clip(np.rint(blended), 0, 255).astype(np.uint8)
+	
+	user_output = user_img.convert('RGB')
+	blended_output = Image.fromarray(blended).convert('RGB')
+	
+	return ref_output, user_output, blended_output
+
+
+def encode_pil_base64(img):
+	"""Encode a PIL image as base64 PNG for the frontend"""
+	buffered = BytesIO()
+	img.save(buffered, format="PNG")
+	return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+
+def comparison_result(similarity_score, distance, ref_img, user_img, blended_img):
+	"""Similarity scores and comparison images (base64 PNGs) in cacheable form"""
+	return {
+		'similarity_score': similarity_score,
+		'distance': distance,
+		'reference_image': encode_pil_base64(ref_img),
+		'user_image': encode_pil_base64(user_img),
+		'blended_overlay': encode_pil_base64(blended_img),
+	}
 
 
 class FeedbackView(APIView):
 	permission_classes = [IsAuthenticated]
 	parser_classes = [MultiPartParser, FormParser]
 	
-	def gemini_api_request(self, image_path, prompt):
-		try:
-			# Configure Gemini API
-			api_key = os.getenv('GEMINI_API_KEY')
-			if not api_key:
-				raise ValueError("GEMINI_API_KEY not found in environment variables")
-			
-			genai.configure(api_key=api_key)
-			
-			# Use gemini-pro-vision for image analysis
-			model = genai.GenerativeModel('gemini-2.5-flash')
-			
-			img = Image.open(image_path)
-			try:
-				response = model.generate_content([prompt, img])
-				result = response.text
-			finally:
-				img.close() 
-			
-			return result
-		
-		except Exception as e:
-			raise Exception(f"Gemini API request failed: {str(e)}")
-	
 	def post(self, request):
+		"""Save the comparison and queue AI feedback for it (see api/feedback.py)"""
 		serializer = FeedbackSerializer(data=request.data)
 		if serializer.is_valid():
 			try:
@@ -268,60 +368,39 @@ class FeedbackView(APIView):
 				distance = serializer.validated_data['distance']
 				is_same_character = serializer.validated_data['is_same_character']
 				
-				# Decode blended image for Gemini API
+				# Convert base64 back to image files for storage
+				user_image_data = base64.b64decode(user_image_base64)
+				reference_image_data = base64.b64decode(reference_image_base64)
 				blended_image_data = base64.b64decode(blended_overlay_base64)
 				
-				with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
-					tmp.write(blended_image_data)
-					tmp_path = tmp.name
+				similarity = SimilarityHistory(
+					user=request.user,
+					target_class=target_class,
+					similarity_score=similarity_score,
+					distance=distance,
+					is_same_character=is_same_character
+				)
+				# The images are written after the response; their names are fixed now
+				writer = get_writer()
+				images = writer.reserve_media(similarity, {
+					'user_image': (f'user_{target_class}.png', user_image_data),
+					'reference_image': (f'ref_{target_class}.png', reference_image_data),
+					'blended_overlay': (f'blended_{target_class}.png', blended_image_data),
+				})
 				
-				try:
-					prompt = (
-						"Analyze the attached blended image (white=reference, blackish=input). "
-						"Provide only an actionable feedback summary. The summary must consist of "
-						"a general assessment sentence followed by a list of 4 specific focus points "
-						"for correction in the next attempt. Format the response as follows:<br><br>"
-						"[General assessment sentence]<br><br>"
-						"Focus points for correction:<br>"
-						"1. [First point]<br>"
-						"2. [Second point]<br>"
-						"3. [Third point]<br>"
-						"4. [Fourth point]<br><br>"
-						"Do not provide a detailed section-by-section analysis or any introductory/closing remarks."
-					)
-					
-					feedback = self.gemini_api_request(tmp_path, prompt)
-					
-					# Save to history if user is authenticated
-					if request.user.is_authenticated:
-						# Convert base64 back to image files for storage
-						user_image_data = base64.b64decode(user_image_base64)
-						reference_image_data = base64.b64decode(reference_image_base64)
-						
-						user_image_content = ContentFile(user_image_data, name=f'user_{target_class}.png')
-						ref_image_content = ContentFile(reference_image_data, name=f'ref_{target_class}.png')
-						blended_image_content = ContentFile(blended_image_data, name=f'blended_{target_class}.png')
-						
-						SimilarityHistory.objects.create(
-							user=request.user,
-							user_image=user_image_content,
-							reference_image=ref_image_content,
-							target_class=target_class,
-							similarity_score=similarity_score,
-							distance=distance,
-							is_same_character=is_same_character,
-							blended_overlay=blended_image_content,
-							feedback=feedback
-						)
-					
-					return Response({
-						'success': True,
-						'feedback': feedback
-					}, status=status.HTTP_200_OK)
+				# Feedback is filled in by the feedback worker once the images exist
+				with transaction.atomic():
+					similarity.save()
+					job = enqueue_feedback(similarity, waiting=True)
+					transaction.on_commit(lambda: writer.write_similarity_media(similarity, job, images))
 				
-				finally:
-					if os.path.exists(tmp_path):
-						os.unlink(tmp_path)
+				return Response({
+					'success': True,
+					'job_id': job.id,
+					'status': job.status,
+					'similarity_id': similarity.id,
+					'feedback': None
+				}, status=status.HTTP_202_ACCEPTED)
 			
 			except Exception as e:
 				return Response({
@@ -330,6 +409,34 @@ class FeedbackView(APIView):
 				}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 		
 		return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class FeedbackJobView(APIView):
+	permission_classes = [IsAuthenticated]
+	
+	def get(self, request, job_id):
+		"""Status of a queued feedback job; poll until status is done or failed"""
+		try:
+			job = FeedbackJob.objects.get(id=job_id, user=request.user)
+		except FeedbackJob.DoesNotExist:
+			return Response({
+				'success': False,
+				'error': 'Feedback job not found'
+			}, status=status.HTTP_404_NOT_FOUND)
+		
+		return Response({
+			'success': True,
+			'job_id': job.id,
+			'status': job.status,
+			'similarity_id': job.similarity_id,
+			'feedback': job.feedback,
+			'cached': job.cache_hit,
+			'error': job.error if job.status == FeedbackJob.FAILED else None,
+			'created_at': job.created_at.isoformat(),
+			'finished_at': job.finished_at.isoformat() if job.finished_at else None
+		}, status=status.HTTP_200_OK)
+
+
 class PredictView(APIView):
 	permission_classes = [IsAuthenticated]
 	parser_classes = [MultiPartParser, FormParser]
@@ -340,63 +447,154 @@ class PredictView(APIView):
 			try:
 				
 				image_file = serializer.validated_data['image']
-
-				with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
-					tmp.write(image_file.read())
-					tmp_path = tmp.name
+				image_data = image_file.read()
 				
-				try:
-					model = get_ml_client()
-					
-					if is_using_hf_api():
+				def infer(route):
+					model = route.model
+					if route.remote:
 						# HF Space now has OpenCV preprocessing - send original image
-						processed_image_path = tmp_path
 						# Still generate base64 for frontend display
-						img = Image.open(tmp_path)
+						img = Image.open(BytesIO(image_data))
 						buffered = BytesIO()
 						img.save(buffered, format="PNG")
 						processed_image_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
 						
-						result = model.predict(processed_image_path, top_k=1)
+						result, cache_hit = cached_result(
+							'predict', model_version(model, 'classifier'), image_digest(image_data),
+							route.timed(lambda: model.predict(image_data, top_k=1))
+						)
 					else:
-						# Local model - do OpenCV preprocessing locally
-						processed_image_path, processed_image_base64 = preprocess_image(tmp_path)
-						result = model.predict(processed_image_path, top_k=1, skip_preprocessing=True)
-					
-					predicted_class = result['class']
-					
-					if predicted_class < 0 or predicted_class > 35:
+						# Local model - decode once and preprocess in memory
+						processed_image = preprocess_image_array(decode_image(image_data))
+						processed_image_base64 = encode_png_base64(processed_image)
+						result, cache_hit = cached_result(
+							'predict', model_version(model, 'classifier'), image_digest(processed_image),
+							route.timed(lambda: model.predict(processed_image, top_k=1, skip_preprocessing=True))
+						)
+					return result, cache_hit, processed_image_base64
+				
+				(result, cache_hit, processed_image_base64), route = get_router().run(infer, agree=same_prediction)
+				predicted_class = result['class']
+				
+				if predicted_class < 0 or predicted_class > 35:
+					return Response({
+						'success': False,
+						'error': f'Model predicted invalid class {predicted_class}. Expected 0-35.'
+					}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+				
+				# Save to history if user is authenticated
+				# Convert confidence from 0-1 to 0-100 if needed
+				confidence = result['confidence']
+				if confidence <= 1.0:
+					confidence = confidence * 100
+				
+				if request.user.is_authenticated:
+					get_writer().add_prediction(request.user, image_file.name, image_data, predicted_class, confidence)
+				
+				response = Response({
+					'success': True,
+					'predicted_class': predicted_class,
+					'confidence': round(confidence, 2),
+					'processed_image': f'data:image/png;base64,{processed_image_base64}',
+				}, status=status.HTTP_200_OK)
+				return routed_response(response, cache_hit, route)
+			
+			except Exception as e:
+				return Response({
+					'success': False,
+					'error': str(e)
+				}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+		
+		return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def read_archive_images(archive):
+	"""Read image entries from an uploaded zip as (filename, bytes) pairs"""
+	images = []
+	with zipfile.ZipFile(archive) as zf:
+		for info in zf.infolist():
+			name = os.path.basename(info.filename)
+			if info.is_dir() or name.startswith('.') or not name.lower().endswith(ARCHIVE_IMAGE_EXTENSIONS):
+				continue
+			if len(images) >= MAX_BATCH_IMAGES:
+				raise ValueError(f'Archive contains more than {MAX_BATCH_IMAGES} images.')
+			if info.file_size > MAX_ARCHIVE_ENTRY_SIZE:
+				raise ValueError(f'Image {name} in archive is too large.')
+			images.append((name, zf.read(info)))
+	return images
+
+
+class BatchPredictView(APIView):
+	"""Classify every image of a worksheet upload in one batched forward pass"""
+	permission_classes = [IsAuthenticated]
+	parser_classes = [MultiPartParser, FormParser]
+	
+	def post(self, request):
+		serializer = BatchImageSerializer(data=request.data)
+		if serializer.is_valid():
+			try:
+				uploads = [(f.name, f.read()) for f in serializer.validated_data.get('images', [])]
+				archive = serializer.validated_data.get('archive')
+				if archive:
+					try:
+						uploads.extend(read_archive_images(archive))
+					except (zipfile.BadZipFile, ValueError) as e:
 						return Response({
+							'success': False,
+							'error': f'Invalid archive: {str(e)}'
+						}, status=status.HTTP_400_BAD_REQUEST)
+				
+				if not uploads:
+					return Response({
+						'success': False,
+						'error': 'No images found in upload.'
+					}, status=status.HTTP_400_BAD_REQUEST)
+				if len(uploads) > MAX_BATCH_IMAGES:
+					return Response({
+						'success': False,
+						'error': f'Too many images ({len(uploads)}). Maximum is {MAX_BATCH_IMAGES}.'
+					}, status=status.HTTP_400_BAD_REQUEST)
+				
+				def infer(route):
+					results = [{'index': i, 'filename': name} for i, (name, _) in enumerate(uploads)]
+					if route.remote:
+						predictions = self._predict_remote(route, uploads, results)
+					else:
+						predictions = self._predict_local(route, uploads, results)
+					return predictions, results
+				
+				(predictions, results), route = get_router().run(infer, agree=same_batch_predictions)
+				
+				# Queued rows are inserted together by one write-behind flush
+				writer = get_writer()
+				for i, prediction in predictions:
+					predicted_class = prediction['class']
+					if predicted_class < 0 or predicted_class > 35:
+						results[i].update({
 							'success': False,
 							'error': f'Model predicted invalid class {predicted_class}. Expected 0-35.'
-						}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+						})
+						continue
 					
-					# Save to history if user is authenticated
 					# Convert confidence from 0-1 to 0-100 if needed
-					confidence = result['confidence']
+					confidence = prediction['confidence']
 					if confidence <= 1.0:
 						confidence = confidence * 100
 					
-					if request.user.is_authenticated:
-						prediction_history = PredictionHistory.objects.create(
-							user=request.user,
-							image=image_file,
-							predicted_class=predicted_class,
-							confidence=confidence
-						)
-					
-					return Response({
+					results[i].update({
 						'success': True,
 						'predicted_class': predicted_class,
 						'confidence': round(confidence, 2),
-						'processed_image': f'data:image/png;base64,{processed_image_base64}',
-					}, status=status.HTTP_200_OK)
-				
-				finally:
-					if os.path.exists(tmp_path):
-						os.unlink(tmp_path)
-					if 'processed_image_path' in locals() and processed_image_path != tmp_path and os.path.exists(processed_image_path):
-						os.unlink(processed_image_path)
+					})
+					writer.add_prediction(request.user, uploads[i][0], uploads[i][1], predicted_class, confidence)
+				
+				response = Response({
+					'success': True,
+					'count': len(results),
+					'results': results
+				}, status=status.HTTP_200_OK)
+				response[BACKEND_HEADER] = route.backend
+				return response
 			
 			except Exception as e:
 				return Response({
@@ -405,63 +603,119 @@ class PredictView(APIView):
 				}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 		
 		return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+	
+	def _predict_local(self, route, uploads, results):
+		"""Preprocess every image, then classify them in one batch"""
+		indices, processed_images = [], []
+		for i, (_, image_data) in enumerate(uploads):
+			try:
+				processed_image = preprocess_image_array(decode_image(image_data))
+			except Exception as e:
+				results[i].update({'success': False, 'error': f'Could not read image: {str(e)}'})
+				continue
+			results[i]['processed_image'] = f'data:image/png;base64,{encode_png_base64(processed_image)}'
+			indices.append(i)
+			processed_images.append(processed_image)
+		
+		predictions = route.timed(
+			lambda: route.model.predict_batch(processed_images, top_k=1, skip_preprocessing=True)
+		)()
+		return list(zip(indices, predictions))
+	
+	def _predict_remote(self, route, uploads, results):
+		"""HF Space has no batch API - classify images concurrently, one call each"""
+		predictions = []
+		outcomes = route.timed(
+			lambda: route.model.predict_many([image_data for _, image_data in uploads], top_k=1)
+		)()
+		if outcomes and all(isinstance(outcome, Exception) for outcome in outcomes):
+			# Nothing came back: fail the whole call so the router can fail over
+			raise outcomes[0]
+		for i, ((_, image_data), outcome) in enumerate(zip(uploads, outcomes)):
+			if isinstance(outcome, Exception):
+				results[i].update({'success': False, 'error': str(outcome)})
+				continue
+			predictions.append((i, outcome))
+			results[i]['processed_image'] = f'data:image/png;base64,{base64.b64encode(image_data).decode("utf-8")}'
+		return predictions
 
 
-class SimilarityView(APIView):
+class WorksheetView(APIView):
+	"""Segment every character on a worksheet image and grade them in one batch"""
 	permission_classes = [IsAuthenticated]
 	parser_classes = [MultiPartParser, FormParser]
 	
-	def _create_comparison_overlay(self, user_image_path, reference_image_path):
-		"""Create comparison overlay with preprocessed user image and original reference"""
-		# Preprocess only user image
-		user_processed_path, _ = preprocess_image(user_image_path)
-		
-		# Open preprocessed user and original reference
-		user_img = Image.open(user_processed_path).convert('L')
-		ref_img = Image.open(reference_image_path).convert('L')
-		
-		# Invert user image
-		user_img = ImageOps.invert(user_img)
-		
-		# Resize to display size
-		size = (256, 256)
-		user_img = user_img.resize(size, Image.Resampling.LANCZOS)
-		ref_img = ref_img.resize(size, Image.Resampling.LANCZOS)
-		
-		# Create display versions
-		ref_output = ref_img.convert('RGB')
-		user_output = user_img.convert('RGB')
-		
-		# Create overlay
-		ref_rgba = ref_img.convert('RGBA')
-		user_rgba = user_img.convert('RGBA')
-		blended = Image.new('RGBA', size, (255, 255, 255, 255))
-		
-		# Reference layer (full opacity)
-		ref_with_alpha = Image.new('RGBA', size, (255, 255, 255, 0))
-		ref_with_alpha.paste(ref_rgba, (0, 0))
-		ref_array = np.array(ref_with_alpha)
-		ref_array[:, :, 3] = (255 - ref_array[:, :, 0]) * 1
-		ref_with_alpha = Image.fromarray(ref_array.astype('uint8'), 'RGBA')
-		blended = Image.alpha_composite(blended, ref_with_alpha)
-		
-		# User layer (80% opacity)
-		user_with_alpha = Image.new('RGBA', size, (255, 255, 255, 0))
-		user_with_alpha.paste(user_rgba, (0, 0))
-		user_array = np.array(user_with_alpha)
-		user_array[:, :, 3] = (255 - user_array[:, :, 0]) * 0.8
-		user_with_alpha = Image.fromarray(user_array.astype('uint8'), 'RGBA')
-		blended = Image.alpha_composite(blended, user_with_alpha)
-		
-		blended_output = blended.convert('RGB')
-		
-		# Clean up temp file
-		try:
-			os.unlink(user_processed_path)
-		except:
-			pass
+	def post(self, request):
+		serializer = WorksheetSerializer(data=request.data)
+		if serializer.is_valid():
+			try:
+				if not get_router().has_local:
+					return Response({
+						'success': False,
+						'error': 'Worksheet grading requires local models.'
+					}, status=status.HTTP_501_NOT_IMPLEMENTED)
+				
+				image_file = serializer.validated_data['image']
+				expected_classes = serializer.validated_data.get('expected_classes', [])
+				
+				try:
+					glyphs = segment_characters(decode_image(image_file.read()))
+				except ValueError as e:
+					return Response({
+						'success': False,
+						'error': f'No characters found: {str(e)}'
+					}, status=status.HTTP_400_BAD_REQUEST)
+				
+				if len(glyphs) > MAX_WORKSHEET_GLYPHS:
+					return Response({
+						'success': False,
+						'error': f'Too many characters ({len(glyphs)}). Maximum is {MAX_WORKSHEET_GLYPHS}.'
+					}, status=status.HTTP_400_BAD_REQUEST)
+				
+				graded, _ = get_router().run(
+					lambda route: route.timed(lambda: route.model.grade_batch(
+						[processed for processed, _ in glyphs],
+						target_classes=expected_classes,
+						skip_preprocessing=True
+					))(),
+					remote_ok=False
+				)
+				
+				threshold = SIMILARITY_THRESHOLD
+				characters = []
+				for i, ((processed, (x, y, w, h)), result) in enumerate(zip(glyphs, graded)):
+					characters.append({
+						'index': i,
+						'box': {'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)},
+						'predicted_class': result['class'],
+						'confidence': round(result['confidence'], 2),
+						'expected_class': expected_classes[i] if i < len(expected_classes) else None,
+						'compared_with_class': result['compared_with_class'],
+						'similarity_score': round(result['similarity_score'], 2),
+						'distance': round(result['distance'], 4),
+						'is_same_character': result['distance'] < threshold,
+						'processed_image': f'data:image/png;base64,{encode_png_base64(processed)}',
+					})
+				
+				return Response({
+					'success': True,
+					'count': len(characters),
+					'threshold': threshold,
+					'characters': characters
+				}, status=status.HTTP_200_OK)
+			
+			except Exception as e:
+				return Response({
+					'success': False,
+					'error': str(e)
+				}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 		
-		return ref_output, user_output, blended_output
+		return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class SimilarityView(APIView):
+	permission_classes = [IsAuthenticated]
+	parser_classes = [MultiPartParser, FormParser]
 	
 	def post(self, request):
 		serializer = SimilaritySerializer(data=request.data)
@@ -487,72 +741,141 @@ class SimilarityView(APIView):
 				
 				# Use processed image if provided, otherwise process the uploaded image
 				if processed_image_base64:
-					# Decode base64 and save to temp file
-					import base64 as b64
-					image_data = b64.b64decode(processed_image_base64)
-					with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
-						tmp.write(image_data)
-						tmp_path = tmp.name
+					image_data = base64.b64decode(processed_image_base64)
 				else:
-					# Process the uploaded image
-					with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp:
-						tmp.write(image_file.read())
-						tmp_path = tmp.name
+					image_data = image_file.read()
 				
-				try:
-					model = get_ml_client()
-					
-					if is_using_hf_api():
-						# HF Space returns everything: score, distance, and all images
-						similarity_score, distance, ref_img, user_img, blended_img = model.compute_similarity(
-							tmp_path, 
-							reference_image_path
-						)
-						# Ensure they are PIL Images
-						if not isinstance(ref_img, Image.Image):
-							raise ValueError(f"HF API returned invalid ref_img type: {type(ref_img)}")
-						if not isinstance(user_img, Image.Image):
-							raise ValueError(f"HF API returned invalid user_img type: {type(user_img)}")
-						if not isinstance(blended_img, Image.Image):
-							raise ValueError(f"HF API returned invalid blended_img type: {type(blended_img)}")
+				def infer(route):
+					model = route.model
+					if route.remote:
+						digest = image_digest(image_data)
+						
+						def compare():
+							# HF Space returns everything: score, distance, and all images
+							similarity_score, distance, ref_img, user_img, blended_img = model.compute_similarity(
+								image_data,
+								reference_image_path
+							)
+							# Ensure they are PIL Images
+							if not isinstance(ref_img, Image.Image):
+								raise ValueError(f"HF API returned invalid ref_img type: {type(ref_img)}")
+							if not isinstance(user_img, Image.Image):
+								raise ValueError(f"HF API returned invalid user_img type: {type(user_img)}")
+							if not isinstance(blended_img, Image.Image):
+								raise ValueError(f"HF API returned invalid blended_img type: {type(blended_img)}")
+							return comparison_result(similarity_score, distance, ref_img, user_img, blended_img)
 					else:
-						# Local model - images already preprocessed, skip ML preprocessing
-						similarity_score, distance = model.compute_similarity(
-							tmp_path, 
-							reference_image_path,
-							skip_preprocessing=True
-						)
-						# Create overlay locally
-						ref_img, user_img, blended_img = self._create_comparison_overlay(tmp_path, reference_image_path)
-					
-					threshold = 0.45
-					is_same = distance < threshold
-					ref_buffered = BytesIO()
-					ref_img.save(ref_buffered, format="PNG")
-					ref_base64 = base64.b64encode(ref_buffered.getvalue()).decode('utf-8')
-					user_buffered = BytesIO()
-					user_img.save(user_buffered, format="PNG")
-					user_base64 = base64.b64encode(user_buffered.getvalue()).decode('utf-8')
-					blended_buffered = BytesIO()
-					blended_img.save(blended_buffered, format="PNG")
-					blended_base64 = base64.b64encode(blended_buffered.getvalue()).decode('utf-8')
+						user_image = decode_image(image_data)
+						digest = image_digest(user_image)
+						
+						def compare():
+							# Local model - images already preprocessed, skip ML preprocessing.
+							# Reference embeddings are precomputed, so only the user image is embedded.
+							similarity_score, distance = model.compute_similarity_to_class(
+								user_image,
+								target_class,
+								skip_preprocessing=True
+							)
+							# Create overlay locally (images from the predict endpoint are already preprocessed)
+							ref_img, user_img, blended_img = create_comparison_overlay(
+								user_image,
+								reference_image_path,
+								preprocessed=bool(processed_image_base64)
+							)
+							return comparison_result(similarity_score, distance, ref_img, user_img, blended_img)
 					
+					return cached_result(
+						'similarity', model_version(model, 'siamese'), digest, route.timed(compare),
+						target_class, bool(processed_image_base64)
+					)
+				
+				(comparison, cache_hit), route = get_router().run(infer, agree=close_similarity)
+				
+				threshold = SIMILARITY_THRESHOLD
+				is_same = comparison['distance'] < threshold
+				
+				response = Response({
+					'success': True,
+					'similarity_score': round(comparison['similarity_score'], 2),
+					'distance': round(comparison['distance'], 4),
+					'is_same_character': is_same,
+					'threshold': threshold,
+					'compared_with_class': target_class,
+					'reference_image': f'data:image/png;base64,{comparison["reference_image"]}',
+					'user_image': f'data:image/png;base64,{comparison["user_image"]}',
+					'gradcam_image': f'data:image/png;base64,{comparison["blended_overlay"]}',
+					'blended_overlay': f'data:image/png;base64,{comparison["blended_overlay"]}',
+				}, status=status.HTTP_200_OK)
+				return routed_response(response, cache_hit, route)
+			
+			except Exception as e:
+				return Response({
+					'success': False,
+					'error': str(e)
+				}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+		
+		return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+
+class RankSimilarityView(APIView):
+	"""Rank all 36 reference classes by similarity to one image"""
+	permission_classes = [IsAuthenticated]
+	parser_classes = [MultiPartParser, FormParser]
+	
+	def post(self, request):
+		serializer = RankSimilaritySerializer(data=request.data)
+		if serializer.is_valid():
+			try:
+				# The HF Space compares against one class per call
+				if not get_router().has_local:
 					return Response({
-						'success': True,
-						'similarity_score': round(similarity_score, 2),
-						'distance': round(distance, 4),
-						'is_same_character': is_same,
-						'threshold': threshold,
-						'compared_with_class': target_class,
-						'reference_image': f'data:image/png;base64,{ref_base64}',
-						'user_image': f'data:image/png;base64,{user_base64}',
-						'gradcam_image': f'data:image/png;base64,{blended_base64}',
-						'blended_overlay': f'data:image/png;base64,{blended_base64}',
-					}, status=status.HTTP_200_OK)
-				
-				finally:
-					if os.path.exists(tmp_path):
-						os.unlink(tmp_path)
+						'success': False,
+						'error': 'Similarity ranking requires local models.'
+					}, status=status.HTTP_501_NOT_IMPLEMENTED)
+				
+				top_k = serializer.validated_data['top_k']
+				rerank = serializer.validated_data['rerank']
+				classifier_weight = serializer.validated_data['classifier_weight']
+				processed_image_base64 = serializer.validated_data.get('processed_image_base64')
+				if processed_image_base64:
+					image_data = base64.b64decode(processed_image_base64)
+				else:
+					image_data = serializer.validated_data['image'].read()
+				
+				def infer(route):
+					model = route.model
+					# Same input as the similarity endpoint, so rankings agree with its scores
+					user_image = decode_image(image_data)
+					versions = (model_version(model, 'siamese'), model_version(model, 'classifier') if rerank else '')
+					return cached_result(
+						'rank', versions, image_digest(user_image),
+						route.timed(lambda: model.rank_classes(
+							user_image, top_k=top_k, rerank=rerank, classifier_weight=classifier_weight,
+							skip_preprocessing=True
+						)),
+						top_k, rerank, classifier_weight
+					)
+				
+				(ranking, cache_hit), route = get_router().run(infer, remote_ok=False)
+				
+				threshold = SIMILARITY_THRESHOLD
+				response = Response({
+					'success': True,
+					'count': len(ranking),
+					'reranked': rerank,
+					'threshold': threshold,
+					'ranking': [{
+						'rank': i + 1,
+						'class': entry['class'],
+						'similarity_score': round(entry['similarity_score'], 2),
+						'distance': round(entry['distance'], 4),
+						'is_same_character': entry['distance'] < threshold,
+						'confidence': round(entry['confidence'], 2) if 'confidence' in entry else None,
+						'score': round(entry['score'], 2),
+					} for i, entry in enumerate(ranking)]
+				}, status=status.HTTP_200_OK)
+				return routed_response(response, cache_hit, route)
 			
 			except Exception as e:
 				return Response({
@@ -564,12 +887,142 @@ class SimilarityView(APIView):
 
 
 
+class AnalyzeView(APIView):
+	"""Prediction and reference similarity for one upload in a single request"""
+	permission_classes = [IsAuthenticated]
+	parser_classes = [MultiPartParser, FormParser]
+	
+	def post(self, request):
+		serializer = AnalyzeSerializer(data=request.data)
+		if serializer.is_valid():
+			try:
+				image_file = serializer.validated_data['image']
+				target_class = serializer.validated_data.get('target_class')
+				image_data = image_file.read()
+				
+				def infer(route):
+					model = route.model
+					if route.remote:
+						processed_image_base64 = encode_pil_base64(Image.open(BytesIO(image_data)))
+						digest = image_digest(image_data)
+						
+						def analyze():
+							if target_class is not None and get_reference_image_path(target_class):
+								# Reference known up front: run both remote calls concurrently
+								result, comparison = model.predict_and_compare(
+									image_data,
+									get_reference_image_path(target_class)
+								)
+								compared_class = target_class
+							else:
+								result = model.predict(image_data, top_k=1)
+								compared_class = result['class'] if target_class is None else target_class
+								reference_image_path = get_reference_image_path(compared_class)
+								if not reference_image_path:
+									return {'result': result, 'compared_with_class': compared_class}
+								comparison = model.compute_similarity(image_data, reference_image_path)
+							similarity_score, distance, ref_img, user_img, blended_img = comparison
+							return {
+								'result': result,
+								'compared_with_class': compared_class,
+								**comparison_result(similarity_score, distance, ref_img, user_img, blended_img)
+							}
+					else:
+						# Local model - decode and preprocess once, then one combined forward pass
+						processed_image = preprocess_image_array(decode_image(image_data))
+						processed_image_base64 = encode_png_base64(processed_image)
+						digest = image_digest(processed_image)
+						
+						def analyze():
+							result = model.analyze(processed_image, target_class, top_k=1, skip_preprocessing=True)
+							compared_class = result['compared_with_class']
+							reference_image_path = get_reference_image_path(compared_class)
+							if not reference_image_path:
+								return {'result': result, 'compared_with_class': compared_class}
+							ref_img, user_img, blended_img = create_comparison_overlay(
+								processed_image,
+								reference_image_path,
+								preprocessed=True
+							)
+							return {
+								'result': result,
+								'compared_with_class': compared_class,
+								**comparison_result(result['similarity_score'], result['distance'], ref_img, user_img, blended_img)
+							}
+					
+					analysis, cache_hit = cached_result(
+						'analyze', (model_version(model, 'classifier'), model_version(model, 'siamese')),
+						digest, route.timed(analyze), target_class
+					)
+					return analysis, cache_hit, processed_image_base64
+				
+				(analysis, cache_hit, processed_image_base64), route = get_router().run(infer, agree=same_analysis)
+				result, compared_class = analysis['result'], analysis['compared_with_class']
+				if 'reference_image' not in analysis:
+					return Response({
+						'success': False,
+						'error': f'Reference image for class {compared_class} not found.'
+					}, status=status.HTTP_404_NOT_FOUND)
+				
+				predicted_class = result['class']
+				if predicted_class < 0 or predicted_class > 35:
+					return Response({
+						'success': False,
+						'error': f'Model predicted invalid class {predicted_class}. Expected 0-35.'
+					}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+				
+				confidence = result['confidence']
+				if confidence <= 1.0:
+					confidence = confidence * 100
+				
+				if request.user.is_authenticated:
+					get_writer().add_prediction(request.user, image_file.name, image_data, predicted_class, confidence)
+				
+				threshold = SIMILARITY_THRESHOLD
+				
+				response = Response({
+					'success': True,
+					'predicted_class': predicted_class,
+					'confidence': round(confidence, 2),
+					'processed_image': f'data:image/png;base64,{processed_image_base64}',
+					'similarity_score': round(analysis['similarity_score'], 2),
+					'distance': round(analysis['distance'], 4),
+					'is_same_character': analysis['distance'] < threshold,
+					'threshold': threshold,
+					'compared_with_class': compared_class,
+					'reference_image': f'data:image/png;base64,{analysis["reference_image"]}',
+					'user_image': f'data:image/png;base64,{analysis["user_image"]}',
+					'gradcam_image': f'data:image/png;base64,{analysis["blended_overlay"]}',
+					'blended_overlay': f'data:image/png;base64,{analysis["blended_overlay"]}',
+				}, status=status.HTTP_200_OK)
+				return routed_response(response, cache_hit, route)
+			
+			except Exception as e:
+				return Response({
+					'success': False,
+					'error': str(e)
+				}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+		
+		return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 
 class PredictionHistoryView(APIView):
 	permission_classes = [IsAuthenticated]
 	
 	def get(self, request):
-		predictions = PredictionHistory.objects.filter(user=request.user)
+		paginator = KeysetPagination()
+		try:
+			predictions = paginator.paginate_queryset(
+				PredictionHistory.objects.filter(user=request.user).only(
+					'id', 'image', 'predicted_class', 'confidence', 'created_at'
+				),
+				request
+			)
+		except ValueError as e:
+			return Response({
+				'success': False,
+				'error': str(e)
+			}, status=status.HTTP_400_BAD_REQUEST)
 		
 		data = [{
 			'id': pred.id,
@@ -582,7 +1035,9 @@ class PredictionHistoryView(APIView):
 		return Response({
 			'success': True,
 			'count': len(data),
-			'predictions': data
+			'predictions': data,
+			'next_cursor': paginator.next_cursor,
+			'next': paginator.get_next_link()
 		}, status=status.HTTP_200_OK)
 
 
@@ -592,6 +1047,40 @@ class SimilarityHistoryView(APIView):
 	def get(self, request):
 		similarities = SimilarityHistory.objects.filter(user=request.user)
 		
+		target_class = request.query_params.get('target_class')
+		if target_class is not None:
+			try:
+				similarities = similarities.filter(target_class=int(target_class))
+			except (ValueError, TypeError):
+				return Response({
+					'success': False,
+					'error': 'Invalid target_class parameter'
+				}, status=status.HTTP_400_BAD_REQUEST)
+		
+		matched = request.query_params.get('matched')
+		if matched is not None:
+			if matched.lower() not in ('true', 'false'):
+				return Response({
+					'success': False,
+					'error': 'Invalid matched parameter (use true or false)'
+				}, status=status.HTTP_400_BAD_REQUEST)
+			similarities = similarities.filter(is_same_character=matched.lower() == 'true')
+		
+		paginator = KeysetPagination()
+		try:
+			similarities = paginator.paginate_queryset(
+				similarities.only(
+					'id', 'user_image', 'reference_image', 'blended_overlay', 'target_class',
+					'similarity_score', 'distance', 'is_same_character', 'feedback', 'created_at'
+				),
+				request
+			)
+		except ValueError as e:
+			return Response({
+				'success': False,
+				'error': str(e)
+			}, status=status.HTTP_400_BAD_REQUEST)
+		
 		data = [{
 			'id': sim.id,
 			'user_image_url': request.build_absolute_uri(sim.user_image.url) if sim.user_image else None,
@@ -608,7 +1097,9 @@ class SimilarityHistoryView(APIView):
 		return Response({
 			'success': True,
 			'count': len(data),
-			'similarities': data
+			'similarities': data,
+			'next_cursor': paginator.next_cursor,
+			'next': paginator.get_next_link()
 		}, status=status.HTTP_200_OK)
 	
 	def delete(self, request, history_id=None):
@@ -654,6 +1145,87 @@ class SimilarityHistoryView(APIView):
 			}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class SimilarAttemptsView(APIView):
+	"""A user's past attempts, and the reference exemplar, closest to one history entry"""
+	permission_classes = [IsAuthenticated]
+	
+	def get(self, request, history_id):
+		try:
+			entry = SimilarityHistory.objects.only(
+				'id', 'user_id', 'target_class', 'embedding', 'embedding_version'
+			).get(id=history_id, user=request.user)
+		except SimilarityHistory.DoesNotExist:
+			return Response({
+				'success': False,
+				'error': 'History item not found'
+			}, status=status.HTTP_404_NOT_FOUND)
+		
+		try:
+			k = int(request.query_params.get('k', 5))
+			if not 1 <= k <= MAX_SIMILAR_ATTEMPTS:
+				raise ValueError
+		except (ValueError, TypeError):
+			return Response({
+				'success': False,
+				'error': f'Invalid k parameter (1-{MAX_SIMILAR_ATTEMPTS})'
+			}, status=status.HTTP_400_BAD_REQUEST)
+		
+		same_class = request.query_params.get('same_class', 'false').lower()
+		if same_class not in ('true', 'false'):
+			return Response({
+				'success': False,
+				'error': 'Invalid same_class parameter (use true or false)'
+			}, status=status.HTTP_400_BAD_REQUEST)
+		
+		# Filled in by the feedback worker once it has processed the entry
+		if entry.embedding is None:
+			return Response({
+				'success': False,
+				'error': 'The embedding of this attempt has not been computed yet'
+			}, status=status.HTTP_409_CONFLICT)
+		
+		try:
+			embedding = decode_embeddings([entry.embedding])[0]
+			similar = similar_attempts(
+				request.user.id, embedding, entry.embedding_version, k=k,
+				target_class=entry.target_class if same_class == 'true' else None, exclude_id=entry.id
+			)
+			exemplar = nearest_reference(embedding, entry.embedding_version)
+		except Exception as e:
+			return Response({
+				'success': False,
+				'error': str(e)
+			}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+		
+		return Response({
+			'success': True,
+			'similarity_id': entry.id,
+			'nearest_exemplar': {
+				'class': exemplar[0],
+				'exemplar': exemplar[1],
+				'distance': round(exemplar[2], 4)
+			} if exemplar is not None else None,
+			'count': len(similar),
+			'similar_attempts': [{
+				'id': sim.id,
+				'user_image_url': request.build_absolute_uri(sim.user_image.url) if sim.user_image else None,
+				'target_class': sim.target_class,
+				'similarity_score': round(sim.similarity_score, 2),
+				'is_same_character': sim.is_same_character,
+				'embedding_distance': round(distance, 4),
+				'created_at': sim.created_at.isoformat()
+			} for sim, distance in similar]
+		}, status=status.HTTP_200_OK)
+
+
+def parse_stats_date(value):
+	"""ISO date or datetime query parameter as an aware datetime (naive values use TIME_ZONE)"""
+	date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+	if timezone.is_naive(date):
+		date = timezone.make_aware(date)
+	return date
+
+
 class UserStatisticsView(APIView):
 	permission_classes = [IsAuthenticated]
 	
@@ -664,12 +1236,11 @@ class UserStatisticsView(APIView):
 			start_date = request.query_params.get('start_date')
 			end_date = request.query_params.get('end_date')
 			
-			similarities = SimilarityHistory.objects.filter(user=request.user)
+			start = end = None
 			
 			if target_class is not None:
 				try:
 					target_class = int(target_class)
-					similarities = similarities.filter(target_class=target_class)
 				except (ValueError, TypeError):
 					return Response({
 						'success': False,
@@ -679,8 +1250,7 @@ class UserStatisticsView(APIView):
 			if days:
 				try:
 					days = int(days)
-					cutoff_date = datetime.now() - timedelta(days=days)
-					similarities = similarities.filter(created_at__gte=cutoff_date)
+					start = timezone.now() - timedelta(days=days)
 				except (ValueError, TypeError):
 					return Response({
 						'success': False,
@@ -689,8 +1259,8 @@ class UserStatisticsView(APIView):
 			
 			if start_date:
 				try:
-					start = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-					similarities = similarities.filter(created_at__gte=start)
+					date = parse_stats_date(start_date)
+					start = date if start is None else max(start, date)
 				except (ValueError, TypeError):
 					return Response({
 						'success': False,
@@ -699,72 +1269,17 @@ class UserStatisticsView(APIView):
 			
 			if end_date:
 				try:
-					end = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-					similarities = similarities.filter(created_at__lte=end)
+					end = parse_stats_date(end_date)
 				except (ValueError, TypeError):
 					return Response({
 						'success': False,
 						'error': 'Invalid end_date parameter (use ISO format)'
 					}, status=status.HTTP_400_BAD_REQUEST)
 			
-			total_count = similarities.count()
-			
-			if total_count == 0:
-				return Response({
-					'success': True,
-					'statistics': {
-						'total_analyses': 0,
-						'average_score': 0,
-						'match_rate': 0,
-						'best_score': 0,
-						'total_matches': 0,
-						'total_mismatches': 0,
-						'most_practiced_character': None,
-						'characters_attempted': 0,
-						'high_scores': 0,
-						'good_scores': 0,
-						'needs_practice': 0,
-						'recent_activity': None
-					}
-				}, status=status.HTTP_200_OK)
-			
-			# Basic statistics
-			avg_score = similarities.aggregate(Avg('similarity_score'))['similarity_score__avg'] or 0
-			best_score = similarities.aggregate(Max('similarity_score'))['similarity_score__max'] or 0
-			total_matches = similarities.filter(is_same_character=True).count()
-			total_mismatches = similarities.filter(is_same_character=False).count()
-			match_rate = (total_matches / total_count * 100) if total_count > 0 else 0
-			
-			# Character statistics
-			character_counts = similarities.values('target_class').annotate(count=Count('id')).order_by('-count')
-			most_practiced = character_counts.first()['target_class'] if character_counts else None
-			characters_attempted = similarities.values('target_class').distinct().count()
-			
-			# Score distribution
-			high_scores = similarities.filter(similarity_score__gte=90).count()
-			good_scores = similarities.filter(similarity_score__gte=75, similarity_score__lt=90).count()
-			needs_practice = similarities.filter(similarity_score__lt=75).count()
-			
-			# Recent activity
-			last_analysis = similarities.order_by('-created_at').first()
-			recent_activity = last_analysis.created_at.isoformat() if last_analysis else None
-			
+			# Rollup reads (see api/stats.py), not a scan of the history
 			return Response({
 				'success': True,
-				'statistics': {
-					'total_analyses': total_count,
-					'average_score': round(avg_score, 2),
-					'match_rate': round(match_rate, 2),
-					'best_score': round(best_score, 2),
-					'total_matches': total_matches,
-					'total_mismatches': total_mismatches,
-					'most_practiced_character': most_practiced,
-					'characters_attempted': characters_attempted,
-					'high_scores': high_scores,
-					'good_scores': good_scores,
-					'needs_practice': needs_practice,
-					'recent_activity': recent_activity
-				}
+				'statistics': user_statistics(request.user, target_class, start, end)
 			}, status=status.HTTP_200_OK)
 			
 		except Exception as e:
@@ -0,0 +1,322 @@
+"""
+Write-behind stage for history rows and their images
+
+Views hand the slow part of saving history (storing images through the
+storage backend and inserting rows) to a small thread pool and respond as
+soon as inference is done:
+
+- Prediction history rows are queued in memory. One flush stores their
+  images and inserts every row queued so far with a single bulk_create, so
+  rows that arrive while a flush runs are batched into the next one.
+- Similarity entries are inserted by the request (their ids are returned)
+  with file names reserved up front; the three images are written behind,
+  after which the entry's feedback job is released to the worker.
+
+Work that fails is written to a journal directory and retried after later
+successful flushes or by `python manage.py replay_write_behind`. The pool is
+drained when the process exits.
+"""
+import atexit
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import FeedbackJob, PredictionHistory, SimilarityHistory
+
+# Background threads; 0 writes inline in the request thread
+WRITE_BEHIND_THREADS = int(os.getenv('WRITE_BEHIND_THREADS', '2'))
+
+# Failed work, one JSON file per batch
+JOURNAL_DIR = Path(os.getenv('WRITE_BEHIND_JOURNAL', str(Path(settings.BASE_DIR) / 'write_behind_journal')))
+
+# Minimum seconds between automatic journal replays in one process
+REPLAY_INTERVAL = 60
+
+
+def _encode(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'__bytes__': base64.b64encode(bytes(value)).decode('ascii')}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _decode(obj):
+    return base64.b64decode(obj['__bytes__']) if set(obj) == {'__bytes__'} else obj
+
+
+def _store(field, file, instance=None):
+    """Write a pending file once; its stored name is kept so a retry doesn't write it again"""
+    if file.get('stored') is None:
+        name = file['name'] if instance is None else field.generate_filename(instance, file['name'])
+        file['stored'] = field.storage.save(name, ContentFile(file['data']), max_length=field.max_length)
+        file['data'] = None
+    return file['stored']
+
+
+def save_predictions(rows):
+    """Store the images of queued prediction rows and insert the rows"""
+    field = PredictionHistory._meta.get_field('image')
+    live_users = set(User.objects.filter(id__in={row['user_id'] for row in rows}).values_list('id', flat=True))
+    history = []
+    for row in rows:
+        # The user may have been deleted before the row was written
+        if row['user_id'] not in live_users:
+            continue
+        prediction = PredictionHistory(
+            user_id=row['user_id'],
+            predicted_class=row['predicted_class'],
+            confidence=row['confidence'],
+            created_at=datetime.fromisoformat(row['created_at'])
+        )
+        prediction.image.name = _store(field, row['image'], prediction)
+        history.append(prediction)
+    PredictionHistory.objects.bulk_create(history)
+
+
+def save_similarity_media(similarity_id, job_id, files):
+    """Write the reserved images of a similarity entry, then release its feedback job"""
+    if not SimilarityHistory.objects.filter(pk=similarity_id).exists():
+        return
+    renamed = {}
+    for field_name, file in files.items():
+        stored = _store(SimilarityHistory._meta.get_field(field_name), file)
+        if stored != file['name']:
+            renamed[field_name] = stored
+    if renamed:
+        SimilarityHistory.objects.filter(pk=similarity_id).update(**renamed)
+    if job_id is not None:
+        FeedbackJob.objects.filter(pk=job_id, status=FeedbackJob.WAITING).update(status=FeedbackJob.PENDING)
+
+
+def apply(entry):
+    """Run one unit of queued or journaled work"""
+    if entry['kind'] == 'predictions':
+        save_predictions(entry['rows'])
+    elif entry['kind'] == 'similarity_media':
+        save_similarity_media(entry['similarity_id'], entry['job_id'], entry['files'])
+    else:
+        raise ValueError(f"Unknown write-behind entry kind: {entry['kind']}")
+
+
+class WriteBehind:
+    def __init__(self, threads=WRITE_BEHIND_THREADS, journal_dir=JOURNAL_DIR):
+        """
+        Args:
+            threads: Background threads (0 = write inline)
+            journal_dir: Directory failed work is journaled to
+        """
+        self.threads = max(0, int(threads))
+        self.journal_dir = Path(journal_dir)
+        self._lock = threading.Lock()
+        self._rows = []
+        self._flush_scheduled = False
+        self._pid = None
+        self._executor = None
+        self._last_replay = 0.0
+        self.journaled = 0
+
+    def _submit(self, fn, *args):
+        if not self.threads:
+            fn(*args)
+            return
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    # Threads do not survive fork: one pool per process
+                    self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='write-behind')
+                    self._pid = pid
+        self._executor.submit(self._in_thread, fn, *args)
+
+    @staticmethod
+    def _in_thread(fn, *args):
+        close_old_connections()
+        try:
+            fn(*args)
+        finally:
+            close_old_connections()
+
+    def add_prediction(self, user, image_name, image_data, predicted_class, confidence):
+        """Queue a PredictionHistory row; its image is stored when the row is flushed"""
+        row = {
+            'user_id': user.id,
+            'image': {'name': os.path.basename(image_name or 'image.png'), 'data': bytes(image_data)},
+            'predicted_class': predicted_class,
+            'confidence': confidence,
+            'created_at': timezone.now().isoformat(),
+        }
+        with self._lock:
+            self._rows.append(row)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._submit(self._flush_predictions)
+
+    def _flush_predictions(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._flush_scheduled = False
+        if rows:
+            self._run({'kind': 'predictions', 'rows': rows})
+
+    def reserve_media(self, instance, files):
+        """
+        Give an unsaved model instance unique names for images written later
+
+        Args:
+            instance: Model instance with FileFields
+            files: {field name: (file name, bytes)}
+
+        Returns:
+            dict: The pending files, for write_similarity_media()
+        """
+        pending = {}
+        for field_name, (name, data) in files.items():
+            stem, ext = os.path.splitext(name)
+            field = instance._meta.get_field(field_name)
+            reserved = field.generate_filename(instance, f'{stem}_{uuid.uuid4().hex[:12]}{ext}')
+            setattr(instance, field_name, reserved)
+            pending[field_name] = {'name': reserved, 'data': bytes(data)}
+        return pending
+
+    def write_similarity_media(self, similarity, job, files):
+        """Write a saved similarity entry's reserved images (call after its transaction commits)"""
+        self._submit(self._run, {
+            'kind': 'similarity_media',
+            'similarity_id': similarity.id,
+            'job_id': job.id if job is not None else None,
+            'files': files,
+        })
+
+    def _run(self, entry):
+        try:
+            apply(entry)
+        except Exception as e:
+            self._journal(entry, e)
+            return
+        if self.threads and time.monotonic() - self._last_replay > REPLAY_INTERVAL:
+            self._last_replay = time.monotonic()
+            replay_journal(self.journal_dir)
+
+    def _journal(self, entry, error):
+        print(f"Warning: Write-behind {entry['kind']} failed, journaling for retry: {error}")
+        try:
+            self.journal_dir.mkdir(parents=True, exist_ok=True)
+            path = self.journal_dir / f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.json"
+            tmp = path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(entry, default=_encode))
+            # The rename makes the entry visible to replays only once it is complete
+            tmp.rename(path)
+            self.journaled += 1
+        except Exception as e:
+            print(f"Error: Could not journal write-behind {entry['kind']}: {e}")
+
+    def flush(self):
+        """Write everything queued so far and wait for it"""
+        self._flush_predictions()
+        executor = self._executor if self._pid == os.getpid() else None
+        if executor is not None:
+            self._executor = None
+            self._pid = None
+            executor.shutdown(wait=True)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, owned by another user
+        return True
+    return True
+
+
+def _reclaim_orphans(journal_dir):
+    """Return entries claimed by replays whose process has died to the journal"""
+    for claimed in journal_dir.glob('*.replaying-*'):
+        try:
+            pid = int(claimed.suffix.rsplit('-', 1)[1])
+        except ValueError:
+            continue
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        try:
+            claimed.rename(claimed.with_suffix('.json'))
+        except FileNotFoundError:
+            # Reclaimed by another process
+            continue
+
+
+def replay_journal(journal_dir=JOURNAL_DIR):
+    """
+    Retry journaled work; entries that fail again stay in the journal
+
+    Entries are claimed by renaming them, so several processes can replay
+    the same directory. Entries left claimed by a process that died are
+    returned to the journal first, and unreadable entries (e.g. truncated by
+    a crash) are renamed to *.corrupt for inspection.
+
+    Returns:
+        tuple: (replayed, failed) entry counts
+    """
+    journal_dir = Path(journal_dir)
+    if not journal_dir.is_dir():
+        return 0, 0
+    _reclaim_orphans(journal_dir)
+    replayed = failed = 0
+    for path in sorted(journal_dir.glob('*.json')):
+        claimed = path.with_suffix(f'.replaying-{os.getpid()}')
+        try:
+            path.rename(claimed)
+        except FileNotFoundError:
+            continue
+        try:
+            entry = json.loads(claimed.read_text(), object_hook=_decode)
+        except (OSError, ValueError) as e:
+            print(f"Error: Unreadable write-behind journal entry {path.name}, moved aside: {e}")
+            claimed.rename(path.with_suffix('.corrupt'))
+            failed += 1
+            continue
+        try:
+            apply(entry)
+        except Exception as e:
+            print(f"Warning: Journaled write-behind {entry['kind']} failed again: {e}")
+            # Files written during this attempt are recorded in the entry
+            claimed.write_text(json.dumps(entry, default=_encode))
+            claimed.rename(path)
+            failed += 1
+            continue
+        claimed.unlink()
+        replayed += 1
+    return replayed, failed
+
+
+# Singleton instance
+_writer = None
+
+
+def get_writer():
+    """Get or create the write-behind stage"""
+    global _writer
+    if _writer is None:
+        _writer = WriteBehind()
+        atexit.register(_writer.flush)
+    return _writer
+
+
+def flush_writer():
+    """Drain the write-behind stage, if it was used (gunicorn's worker_exit hook)"""
+    if _writer is not None:
+        _writer.flush()
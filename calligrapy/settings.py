@@ -151,6 +151,34 @@ WHITENOISE_COMPRESS_OFFLINE = True  # Pre-compress static files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Caches
+# 'inference' holds model results keyed by image content (see api/result_cache.py).
+# INFERENCE_CACHE_BACKEND=file shares entries between workers via disk;
+# the default per-process memory cache evicts least recently used entries.
+INFERENCE_CACHE_BACKEND = os.getenv('INFERENCE_CACHE_BACKEND', 'locmem')
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "inference": {
+        "BACKEND": (
+            "django.core.cache.backends.filebased.FileBasedCache"
+            if INFERENCE_CACHE_BACKEND == 'file'
+            else "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": (
+            os.getenv('INFERENCE_CACHE_DIR', str(BASE_DIR / '.cache' / 'inference'))
+            if INFERENCE_CACHE_BACKEND == 'file'
+            else "inference-results"
+        ),
+        "TIMEOUT": int(os.getenv('INFERENCE_CACHE_TTL', str(24 * 60 * 60))),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv('INFERENCE_CACHE_MAX_ENTRIES', '1000')),
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -252,6 +280,8 @@ CORS_ALLOW_HEADERS = [
 CORS_EXPOSE_HEADERS = [
     'content-type',
     'authorization',
+    'x-cache',
+    'x-inference-backend',
 ]
 
 CORS_PREFLIGHT_MAX_AGE = 86400  # 24 hours
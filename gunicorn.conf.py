@@ -0,0 +1,49 @@
+"""
+Gunicorn settings (used by the Procfile)
+
+The app is preloaded in the master, which loads and warms up the ML models
+once (see ApiConfig.ready). Workers are forked from it and share the model
+weights copy-on-write, so extra workers and `max_requests` recycles start
+warm without reloading anything.
+"""
+import os
+
+# Read by api.ml_models.config when the app is preloaded below
+os.environ.setdefault('PRELOAD_ML_MODELS', 'True')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+# More than one thread per worker lets concurrent requests share micro-batches
+# and lets hybrid routing see local queue depth (see api/ml_models/router.py):
+# a request sees at most threads - 1 others in flight, so ROUTER_SPILL_DEPTH
+# must stay below this
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+preload_app = True
+timeout = 300
+max_requests = 100
+max_requests_jitter = 10
+
+
+def when_ready(server):
+    # After the app (and .env) is loaded
+    from api.ml_models.config import INFERENCE_ROUTING, ROUTER_SPILL_DEPTH
+
+    if INFERENCE_ROUTING == 'hybrid' and ROUTER_SPILL_DEPTH >= threads:
+        server.log.warning(
+            "Hybrid routing will never spill to the Space: ROUTER_SPILL_DEPTH (%s) must be below "
+            "GUNICORN_THREADS (%s)", ROUTER_SPILL_DEPTH, threads
+        )
+
+
+def post_fork(server, worker):
+    from api.ml_models import configure_worker
+
+    num_threads = configure_worker(workers)
+    server.log.info("Worker %s: torch using %s thread(s)", worker.pid, num_threads)
+
+
+def worker_exit(server, worker):
+    # Write queued history rows and images before the worker goes away
+    from api.write_behind import flush_writer
+
+    flush_writer()